@@ -47,10 +47,12 @@ if "bpy" in locals():
 	importlib.reload(export_mgn)
 	importlib.reload(import_lod)
 	importlib.reload(export_lod)
+	importlib.reload(generate_lod)
 	importlib.reload(import_flr)
 	importlib.reload(export_flr)
 	importlib.reload(import_pob)
 	importlib.reload(export_pob)
+	importlib.reload(import_proxy)
 	importlib.reload(import_skt)
 	importlib.reload(export_skt)
 	importlib.reload(export_lmg)
@@ -69,10 +71,12 @@ else:
 	from . import export_mgn
 	from . import import_lod
 	from . import export_lod
+	from . import generate_lod
 	from . import import_flr
 	from . import export_flr
 	from . import import_pob
 	from . import export_pob
+	from . import import_proxy
 	from . import import_skt
 	from . import export_skt
 	from . import export_lmg
@@ -99,6 +103,10 @@ import bpy, os, functools, base64, bmesh, math
 from bpy.types import Operator, AddonPreferences
 from bpy.props import StringProperty, IntProperty, BoolProperty
 from mathutils import Vector, Matrix
+from mathutils.bvhtree import BVHTree
+from mathutils.interpolate import poly_3d_calc
+from mathutils.kdtree import KDTree
+import numpy as np
 import bpy
 from bpy.types import (
 	Gizmo,
@@ -182,6 +190,12 @@ class ImportMSH(bpy.types.Operator, ImportHelper):
 			default=True,
 			)
 
+	proxy: BoolProperty(
+			name="Bounding Boxes Only",
+			description="Only read the extents and create a box per mesh instead of importing geometry. Useful for laying out or reviewing many files at once",
+			default=False,
+			)
+
 	files: CollectionProperty(
 			type=bpy.types.OperatorFileListElement,
 			options={'HIDDEN', 'SKIP_SAVE'},
@@ -190,16 +204,20 @@ class ImportMSH(bpy.types.Operator, ImportHelper):
 	def execute(self, context):
 		keywords = self.as_keywords(ignore=("filter_glob",
 											"files",
-											"filepath"))
+											"filepath",
+											"proxy"))
 
-			  
+		cache = {}
 		for f in self.files:   
 			dirname = os.path.dirname(self.filepath)
 			filepath = os.path.join(dirname, f.name)
 			
 
 			print(f'IMPORTING: {self.filepath} {filepath}')
-			result = import_msh.load_new(context, filepath, **keywords)
+			if self.proxy:
+				result = import_proxy.load_new(context, filepath, cache=cache)
+			else:
+				result = import_msh.load_new(context, filepath, **keywords)
 
 		# if 'ERROR' in result:
 		#	 self.report({'ERROR'}, 'Something went wrong importing MESH')
@@ -232,6 +250,7 @@ class MSH_PT_import_option(bpy.types.Panel):
 		operator = sfile.active_operator
 		layout.prop(operator, 'flip_uv_vertical')
 		layout.prop(operator, 'remove_duplicate_verts')
+		layout.prop(operator, 'proxy')
 
 class ExportMSH(bpy.types.Operator, ExportHelper):
 	"""Save a SWG .msh File"""
@@ -251,6 +270,11 @@ class ExportMSH(bpy.types.Operator, ExportHelper):
 			description="SWG seems to flip DDS vertical axis, but blender doesn't. Need to flip UVs on import and export to be able to use Blender UV mapping without being destructive",
 			default=True,
 			)
+	apply_modifiers: BoolProperty(
+			name="Apply Modifiers",
+			description="Export meshes with their modifiers applied, instead of the bare mesh data",
+			default=False,
+			)
 
 	def invoke(self, context, _event):
 		import os
@@ -295,6 +319,7 @@ class MSH_PT_export_option(bpy.types.Panel):
 		sfile = context.space_data
 		operator = sfile.active_operator
 		layout.prop(operator, 'flip_uv_vertical')
+		layout.prop(operator, 'apply_modifiers')
 
 class MGN_PT_import_option(bpy.types.Panel):
 	bl_space_type = 'FILE_BROWSER'
@@ -436,6 +461,23 @@ class ImportLOD(bpy.types.Operator, ImportHelper):
 			description="Attempt to remove verts that are probably duplicates (within 0.0001 units of each other)",
 			default=True,
 			)
+	lazy_lods: BoolProperty(
+			name="Only Import One Detail Level",
+			description="Import just the chosen LOD level. The others become placeholder empties that can be materialised later (SWG > LOD > Materialise), which saves importing their geometry, materials and textures",
+			default=False,
+			)
+	detail_level: IntProperty(
+			name="Detail Level",
+			description="The LOD level to import when only importing one. 0 is the most detailed",
+			default=0,
+			min=0,
+			)
+
+	proxy: BoolProperty(
+			name="Bounding Boxes Only",
+			description="Only read the extents and create a box per detail level instead of importing geometry. Useful for laying out or reviewing many files at once",
+			default=False,
+			)
 
 	files: CollectionProperty(
 			type=bpy.types.OperatorFileListElement,
@@ -445,14 +487,25 @@ class ImportLOD(bpy.types.Operator, ImportHelper):
 	def execute(self, context):
 		keywords = self.as_keywords(ignore=("filter_glob",
 											"files",
-											"filepath"))			  
+											"filepath",
+											"proxy"))			  
+		dirname = os.path.dirname(self.filepath)
+		if self.proxy:
+			cache = {}
+			for f in self.files:
+				import_proxy.load_new(context, os.path.join(dirname, f.name), cache=cache)
+			return {'FINISHED'}
+
+		session = import_msh.ImportSession(context.preferences.addons[__package__].preferences.swg_root, self.lazy_lods, self.detail_level)
+		session.prefetch(*[os.path.join(dirname, f.name) for f in self.files])
 		for f in self.files:   
-			dirname = os.path.dirname(self.filepath)
 			filepath = os.path.join(dirname, f.name) 
-			result = import_lod.load_new(context, filepath, parent = None, **keywords)
+			result = import_lod.load_new(context, filepath, parent = None, session = session, **keywords)
 			if 'ERROR' in result:
 				self.report({'ERROR'}, 'Something went wrong importing LOD')
+				session.close()
 				return {'CANCELLED'}		
+		session.close()
 		return {'FINISHED'}
 
 	def invoke(self, context, _event):
@@ -488,6 +541,9 @@ class LOD_PT_import_option(bpy.types.Panel):
 		
 		layout.prop(operator, 'flip_uv_vertical')
 		layout.prop(operator, 'remove_duplicate_verts')
+		layout.prop(operator, 'proxy')
+		layout.prop(operator, 'lazy_lods')
+		layout.prop(operator, 'detail_level')
 
 class ExportLOD(bpy.types.Operator, ExportHelper):
 	"""Save a SWG .lod File"""
@@ -515,6 +571,18 @@ class ExportLOD(bpy.types.Operator, ExportHelper):
 			default=True,
 			)
 
+	incremental: BoolProperty(
+			name="Incremental",
+			description="Skip re-exporting LOD meshes and floors whose Blender content and exported files haven't changed since the last export, as recorded in a .manifest.json file next to the .lod",
+			default=True,
+			)
+
+	apply_modifiers: BoolProperty(
+			name="Apply Modifiers",
+			description="Export LOD meshes and floors with their modifiers applied, instead of the bare mesh data",
+			default=False,
+			)
+
 	def invoke(self, context, _event):
 		
 		if context.preferences.addons[__package__].preferences.swg_root != "":			
@@ -557,6 +625,8 @@ class LOD_PT_export_option(bpy.types.Panel):
 		
 		layout.prop(operator, 'flip_uv_vertical')
 		layout.prop(operator, 'export_children')
+		layout.prop(operator, 'incremental')
+		layout.prop(operator, 'apply_modifiers')
 
 class ExportLMG(bpy.types.Operator, ExportHelper):
 	"""Save a SWG .lmg File"""
@@ -637,6 +707,23 @@ class ImportPOB(bpy.types.Operator, ImportHelper):
 			description="Attempt to remove verts that are probably duplicates (within 0.0001 units of each other)",
 			default=True,
 			)
+	lazy_lods: BoolProperty(
+			name="Only Import One Detail Level",
+			description="Import just the chosen LOD level. The others become placeholder empties that can be materialised later (SWG > LOD > Materialise), which saves importing their geometry, materials and textures",
+			default=False,
+			)
+	detail_level: IntProperty(
+			name="Detail Level",
+			description="The LOD level to import when only importing one. 0 is the most detailed",
+			default=0,
+			min=0,
+			)
+
+	proxy: BoolProperty(
+			name="Bounding Boxes Only",
+			description="Only read the extents and create a box per cell instead of importing geometry. Useful for laying out or reviewing many files at once",
+			default=False,
+			)
 
 	files: CollectionProperty(
 			type=bpy.types.OperatorFileListElement,
@@ -646,14 +733,19 @@ class ImportPOB(bpy.types.Operator, ImportHelper):
 	def execute(self, context):
 		keywords = self.as_keywords(ignore=("filter_glob",
 											"files",
-											"filepath"))
+											"filepath",
+											"proxy"))
 			  
+		cache = {}
 		for f in self.files:   
 			dirname = os.path.dirname(self.filepath)
 			filepath = os.path.join(dirname, f.name) 
 
 			print(f'IMPORTING: {self.filepath} {filepath}')	
-			result = import_pob.load_new(context, filepath, **keywords)
+			if self.proxy:
+				result = import_proxy.load_new(context, filepath, cache=cache)
+			else:
+				result = import_pob.load_new(context, filepath, **keywords)
 			if 'ERROR' in result:
 				self.report({'ERROR'}, 'Something went wrong importing LOD')
 				return {'CANCELLED'}
@@ -685,6 +777,9 @@ class POB_PT_import_option(bpy.types.Panel):
 		operator = sfile.active_operator
 		layout.prop(operator, 'flip_uv_vertical')
 		layout.prop(operator, 'remove_duplicate_verts')
+		layout.prop(operator, 'proxy')
+		layout.prop(operator, 'lazy_lods')
+		layout.prop(operator, 'detail_level')
 
 class ExportPOB(bpy.types.Operator, ExportHelper):
 	"""Save a SWG .pob File"""
@@ -718,6 +813,18 @@ class ExportPOB(bpy.types.Operator, ExportHelper):
 			default=False,
 			)
 
+	incremental: BoolProperty(
+			name="Incremental",
+			description="Skip re-exporting cells whose Blender content and exported files haven't changed since the last export, as recorded in a .manifest.json file next to the .pob",
+			default=True,
+			)
+
+	apply_modifiers: BoolProperty(
+			name="Apply Modifiers",
+			description="Export cell meshes and floors with their modifiers applied, instead of the bare mesh data",
+			default=False,
+			)
+
 	def invoke(self, context, _event):
 		import os
 		if not self.filepath:
@@ -770,6 +877,8 @@ class POB_PT_export_option(bpy.types.Panel):
 		layout.prop(operator, 'flip_uv_vertical')
 		layout.prop(operator, 'export_children')
 		layout.prop(operator, 'use_imported_crc')
+		layout.prop(operator, 'incremental')
+		layout.prop(operator, 'apply_modifiers')
 
 class ImportSKT(bpy.types.Operator, ImportHelper):
 	"""Load a SWG SKT File"""
@@ -1253,12 +1362,19 @@ class SWG_Generate_Blends_From_Other(bpy.types.Operator):
 	bl_idname = "object.swg_generate_blends_from_other"
 	bl_label = "Generate Blend Shapes from Other"
 	bl_description = '''If this option is disabled, you need to have 2 objects selected'''
+	bl_options = {'REGISTER', 'UNDO'}
+
+	interpolate_deltas: BoolProperty(
+			name="Interpolate Deltas",
+			description="Blend the deltas of the closest source triangle's corners (barycentric) instead of copying the delta of the single closest source vert",
+			default=False,
+			)
 
 	@classmethod
 	def poll(cls, context):
 		return len(context.selected_objects) == 2
 
-	def invoke(self, context, event):
+	def execute(self, context):
 		
 		destination = context.active_object
 		source = None
@@ -1282,48 +1398,69 @@ class SWG_Generate_Blends_From_Other(bpy.types.Operator):
 		keys = sm.shape_keys
 		print(f"Generating Shap Keys on {dm.name} from : {sm.name} number of keys: {str(len(sm.shape_keys.key_blocks))}")
 
-		sverts = sm.vertices
-		dverts = dm.vertices
-
-		closest_vert_map={}
-
-		for dv in dverts:
-			dist = float('inf')
-			closest_vert=None
-			for sv in sverts:
-				d = (Vector(dv.co) - Vector(sv.co)).magnitude
-				if d < dist:
-					dist = d
-					closest_vert = sv
-			closest_vert_map[dv.index] = closest_vert.index
-
-		#print(f"Closest Vert Map:  {str(closest_vert_map)}")
-
-		basis = keys.key_blocks[0].data
+		scount = len(sm.vertices)
+		dcount = len(dm.vertices)
+		sco = np.empty(scount * 3, dtype=np.float32)
+		sm.vertices.foreach_get("co", sco)
+		sco = sco.reshape(-1, 3)
+		dco = np.empty(dcount * 3, dtype=np.float32)
+		dm.vertices.foreach_get("co", dco)
+		dco = dco.reshape(-1, 3)
+
+		# For each vert in Destination, which source verts its delta comes from, and how much of each
+		source_indices = np.zeros((dcount, 3), dtype=np.int64)
+		source_weights = np.zeros((dcount, 3), dtype=np.float32)
+
+		if self.interpolate_deltas:
+			sm.calc_loop_triangles()
+			stris = np.empty(len(sm.loop_triangles) * 3, dtype=np.int32)
+			sm.loop_triangles.foreach_get("vertices", stris)
+			stris = stris.reshape(-1, 3)
+			if len(stris) == 0:
+				self.report({'ERROR'}, f"{source.name} has no faces to interpolate deltas across")
+				return {'CANCELLED'}
+			bvh = BVHTree.FromPolygons(sco.tolist(), stris.tolist())
+			for i, co in enumerate(dco.tolist()):
+				location, normal, tri_index, dist = bvh.find_nearest(co)
+				tri = stris[tri_index]
+				weights = poly_3d_calc([Vector(sco[j]) for j in tri], location)
+				source_indices[i] = tri
+				source_weights[i] = weights
+		elif scount == 0:
+			self.report({'ERROR'}, f"{source.name} has no vertices to copy deltas from")
+			return {'CANCELLED'}
+		else:
+			kd = KDTree(scount)
+			for i, co in enumerate(sco.tolist()):
+				kd.insert(co, i)
+			kd.balance()
+			for i, co in enumerate(dco.tolist()):
+				source_indices[i, 0] = kd.find(co)[1]
+			source_weights[:, 0] = 1.0
+
+		basis = np.empty(scount * 3, dtype=np.float32)
+		keys.key_blocks[0].data.foreach_get("co", basis)
+		basis = basis.reshape(-1, 3)
+		key_co = np.empty(scount * 3, dtype=np.float32)
 		for key in keys.key_blocks:
 			sk = destination.shape_key_add(name=key.name)
 
-			# deltas=key.data
-			# for i, delta in enumerate(deltas):
-			#	 dv = sverts[i].co - delta.co
-			#	 print(f"{sm.name} Shape {key.name}: Vert {i} has position {sverts[i].co} delta: {delta.co} diff: {dv}")
-
 			if(key.name == "Basis"):
 				print(f"Skipping Basis...")
 				continue
 
 			# for each vert in Destination Mesh, add a delta to the Shape key based on its corresponding vert's delta in the same key of the other mesh...
-			for vert in dverts:
-				corresponding_index = closest_vert_map[vert.index]
-				delta = key.data[corresponding_index].co - basis[corresponding_index].co
-				#print(f"Key: {sk.name} Vert: {vert.index} Source Vert was: {corresponding_index} with Original Pos: {sverts[corresponding_index].co} Basis: {basis[corresponding_index].co} ShapeKeyPos: {key.data[corresponding_index].co} Delta: {delta} Final: {vert.co+delta}")
-				sk.data[vert.index].co = vert.co + delta
+			key.data.foreach_get("co", key_co)
+			deltas = key_co.reshape(-1, 3) - basis
+			final = dco + (deltas[source_indices] * source_weights[:, :, None]).sum(axis=1)
+			sk.data.foreach_set("co", final.ravel())
 			print(f"Completed Generating: {sk.name}")
 
 		return {'FINISHED'}
  
 	def draw(self, context):
-		pass
+		layout = self.layout
+		layout.prop(self, "interpolate_deltas")
 
 class SWG_Load_Flr(bpy.types.Operator):
 	bl_idname = "object.swg_load_flr"
@@ -1362,13 +1499,18 @@ class SWG_Write_Flr(bpy.types.Operator):
 	filename_ext = ".flr"
 	filter_glob : StringProperty(default="*.flr", options={'HIDDEN'})
 	filepath: StringProperty(default="test.flr",subtype='FILE_PATH')
+	apply_modifiers: BoolProperty(
+			name="Apply Modifiers",
+			description="Export floors with their modifiers applied, instead of the bare mesh data",
+			default=False,
+			)
 
 	@classmethod
 	def poll(cls, context):
 		return context.active_object != None
 
 	def execute(self, context):
-		export_flr.export_flr(context, self.properties.filepath)
+		export_flr.export_flr(context, self.properties.filepath, self.apply_modifiers)
 
 		return {'FINISHED'}
 
@@ -1415,6 +1557,92 @@ class SWG_Create_LOD(bpy.types.Operator):
 	def draw(self, context):
 		pass
 
+class SWG_Materialise_LOD(bpy.types.Operator):
+	bl_idname = "object.swg_materialise_lod"
+	bl_label = "Materialise selected LOD placeholders"
+	bl_description = '''Import the real meshes for the selected placeholder empties left by a LOD/POB import that only imported one detail level'''
+
+	@classmethod
+	def poll(cls, context):
+		return any(support.is_lod_placeholder(obj) for obj in context.selected_objects)
+
+	def execute(self, context):
+		placeholders = [obj for obj in context.selected_objects if support.is_lod_placeholder(obj)]
+		session = import_msh.ImportSession(context.preferences.addons[__package__].preferences.swg_root)
+		session.prefetch(*[obj['lod_path'] for obj in placeholders])
+		failed = 0
+		for obj in placeholders:
+			if import_lod.materialise(context, obj, session) == None:
+				failed += 1
+		session.close()
+		if failed > 0:
+			self.report({'WARNING'}, f"Couldn't materialise {failed} of {len(placeholders)} placeholders")
+		return {'FINISHED'}
+
+	def draw(self, context):
+		pass
+
+class SWG_Generate_LODs(bpy.types.Operator):
+	bl_idname = "object.swg_generate_lods"
+	bl_label = "Generate LOD chain from active mesh"
+	bl_description = '''Decimate the active mesh (LOD0) into simpler copies, one per distance after the first, keeping UV seams and material borders. Each level is simplified only as far as stays under the pixel error at the distance it starts being drawn'''
+	bl_options = {'REGISTER', 'UNDO'}
+
+	distances: StringProperty(
+			name="Distances",
+			description="Comma separated 'distance' of LOD0 and of each level to generate",
+			default="50,100,200,400",
+			)
+	pixel_error: FloatProperty(
+			name="Pixel Error",
+			description="Largest on-screen error, in pixels, a level may have when it starts being drawn",
+			default=1.0,
+			min=0.01,
+			)
+	screen_height: IntProperty(
+			name="Screen Height",
+			description="Vertical resolution the pixel error is measured at",
+			default=1080,
+			min=1,
+			)
+	fov: FloatProperty(
+			name="Field of View",
+			description="Vertical field of view the pixel error is measured at",
+			subtype='ANGLE',
+			default=math.radians(60.0),
+			min=math.radians(1.0),
+			max=math.radians(179.0),
+			)
+
+	@classmethod
+	def poll(cls, context):
+		return context.active_object != None and context.active_object.type == 'MESH'
+
+	def invoke(self, context, event):
+		return context.window_manager.invoke_props_dialog(self)
+
+	def execute(self, context):
+		try:
+			distances = [float(d) for d in self.distances.split(",") if d.strip() != ""]
+		except ValueError:
+			self.report({'ERROR'}, f"Couldn't read distances: {self.distances}")
+			return {'CANCELLED'}
+		if len(distances) < 2 or any(b <= a for a, b in zip(distances, distances[1:])):
+			self.report({'ERROR'}, "Need at least two increasing distances")
+			return {'CANCELLED'}
+
+		levels = generate_lod.generate_lods(context, context.active_object, distances,
+			pixel_error=self.pixel_error, screen_height=self.screen_height, fov=self.fov)
+		self.report({'INFO'}, ", ".join(f"{obj.name}: {tris} tris" for obj, tris in levels))
+		return {'FINISHED'}
+
+	def draw(self, context):
+		layout = self.layout
+		layout.prop(self, "distances")
+		layout.prop(self, "pixel_error")
+		layout.prop(self, "screen_height")
+		layout.prop(self, "fov")
+
 class SWG_Add_Distance_CP(bpy.types.Operator):
 	bl_idname = "object.swg_add_distance_cp"
 	bl_label = "Add 'Distance Custom' Property to selection"
@@ -1680,6 +1908,8 @@ class SWGLodMenu(bpy.types.Menu):
 		layout = self.layout
 		layout.operator(SWG_Create_LOD.bl_idname, text=SWG_Create_LOD.bl_label)
 		layout.operator(SWG_Add_Distance_CP.bl_idname, text=SWG_Add_Distance_CP.bl_label)
+		layout.operator(SWG_Materialise_LOD.bl_idname, text=SWG_Materialise_LOD.bl_label)
+		layout.operator(SWG_Generate_LODs.bl_idname, text=SWG_Generate_LODs.bl_label)
 
 class SWGPobMenu(bpy.types.Menu):
 	bl_label = "POB (Portalized Object)"
@@ -1752,6 +1982,8 @@ classes = (
 	debug_flr.SWG_Debug_Portal_Edges,
 	SWG_Create_LOD,
 	SWG_Add_Distance_CP,
+	SWG_Materialise_LOD,
+	SWG_Generate_LODs,
 	SWG_Create_POB,
 	SWG_Create_POB_Room,
 	SWG_Portals_Unpassable,
@@ -23,45 +23,34 @@
 import os
 import time
 import math
+import hashlib
 import mathutils
+import numpy as np
 from .swg_types import FloorEdgeType, FloorFile, FloorTri, PathGraph, PathGraphNode, PathNodeType
-from .support import convert_vector3, getChildren
+from .support import convert_vector3, getChildren, in_forked_worker, object_mesh
 from mathutils import Vector
 
 SNAP_MAX_DIST_BELOW = 3.0
 SNAP_MAX_DIST_ABOVE = 1.0
 
-def _snap_to_floor(pos, flr):
-    """Snap a position's Y to the floor surface, preserving XZ.
-    Matches Maya's vertical ray cast (FloorBuilder.cpp:597-623):
-    prefer floor below within 3.0, fall back to above within 1.0."""
-    best_below_y = None
-    best_below_dist = float('inf')
-    best_above_y = None
-    best_above_dist = float('inf')
-    ray_down = Vector((0.0, -1.0, 0.0))
-    ray_up = Vector((0.0, 1.0, 0.0))
-    for tri in flr.tris:
-        corners = [Vector(flr.verts[i]) for i in [tri.corner1, tri.corner2, tri.corner3]]
-        # Search below
-        hit = mathutils.geometry.intersect_ray_tri(corners[0], corners[1], corners[2], ray_down, pos, True)
-        if hit is not None:
-            dist = pos.y - hit.y
-            if dist <= SNAP_MAX_DIST_BELOW and dist < best_below_dist:
-                best_below_dist = dist
-                best_below_y = hit.y
-        # Search above
-        hit = mathutils.geometry.intersect_ray_tri(corners[0], corners[1], corners[2], ray_up, pos, True)
-        if hit is not None:
-            dist = hit.y - pos.y
-            if dist <= SNAP_MAX_DIST_ABOVE and dist < best_above_dist:
-                best_above_dist = dist
-                best_above_y = hit.y
-    if best_below_y is not None:
-        return best_below_y
-    return best_above_y
-
-def export_flr(context, filepath):
+# Last floor built for each object: {name: (content hash, triangle keys, triangle
+# XZ bounds, visibility)}. Lets a rebuild after an edit re-walk only the node
+# pairs the edit can have changed. Only the most recently stored floors are kept.
+_floor_cache = {}
+FLOOR_CACHE_SIZE = 16
+# Corner positions are compared at 1/FLOOR_KEY_SCALE precision
+FLOOR_KEY_SCALE = 1e4
+
+def _snap_all_to_floor(positions, flr):
+    """Snap positions' Y to the floor surface, preserving XZ, with one vectorised
+    ray cast that tests only the triangles whose XZ bounds contain each point.
+    Matches Maya's vertical ray cast (FloorBuilder.cpp:597-623): prefer floor
+    below within 3.0, fall back to above within 1.0.
+    Returns a list of heights, None where no floor was found."""
+    heights = flr.snap_heights([[p[0], p[1], p[2]] for p in positions], SNAP_MAX_DIST_BELOW, SNAP_MAX_DIST_ABOVE)
+    return [None if math.isnan(h) else h for h in heights.tolist()]
+
+def export_flr(context, filepath, apply_modifiers=False):
     objects = context.selected_objects
 
     if not objects:
@@ -72,18 +61,95 @@ def export_flr(context, filepath):
             continue
         dirname = os.path.dirname(filepath)
         fullpath = os.path.join(dirname, ob.name + ".flr")
-        result, _ = export_one(fullpath, ob, [])
+        result, _ = export_one(fullpath, ob, [], apply_modifiers=apply_modifiers)
         if 'FINISHED' not in result:
             return {'CANCELLED'}
     return {'FINISHED'}
 
-def build_floor(current_obj, portal_objects):
-    """Build a FloorFile in memory from a Blender mesh object. Does not write to disk."""
-    globalPortalIndices = [p[1] for p in portal_objects]
+def _floor_content(flr):
+    """Everything a floor walk depends on, per triangle: quantised corner
+    positions, edge types and which edges have a neighbour, as one hashable key
+    each, plus the triangle's XZ bounds. Also returns a hash of the whole lot.
+    Keys hold no indices, so adding or removing triangles elsewhere (which
+    renumbers everything) leaves the untouched triangles' keys alone."""
+    verts = np.asarray(flr.verts, dtype=np.float64).reshape(-1, 3)
+    tris = flr.tri_array()
+    points = verts[tris['corners']]
+    # Neighbour presence rather than index: unmerging vertices or ripping an edge
+    # changes walks across it without moving anything
+    rows = np.hstack((np.round(points.reshape(-1, 9) * FLOOR_KEY_SCALE).astype(np.int64),
+                      tris['edgeTypes'].astype(np.int64), (tris['neighbors'] != -1).astype(np.int64)))
+    keys = [row.tobytes() for row in rows]
+    xz = points[:, :, [0, 2]]
+    bounds = np.hstack((xz.min(axis=1), xz.max(axis=1)))
+    return hashlib.blake2b(b''.join(sorted(keys))).hexdigest(), keys, bounds
+
+def _reuse_visibility(name, flr, content):
+    """Seed flr.visibility with the cached walk results for this object that the
+    floor changes since the last build can't have affected. A walk only visits
+    triangles its segment crosses, so a result stays valid while no added or
+    removed triangle overlaps the segment's XZ bounds and both ends still lie
+    on the floor."""
+    flr.visibility = {}
+    cached = _floor_cache.get(name)
+    if cached is None:
+        return
+    old_hash, old_keys, old_bounds, visibility = cached
+    content_hash, keys, bounds = content
+    if content_hash == old_hash:
+        flr.visibility = dict(visibility)
+        print(f"{name}: floor unchanged, reusing {len(visibility)} cached walk results")
+        return
+    if not visibility:
+        return
+
+    key_set = set(keys)
+    old_key_set = set(old_keys)
+    changed = np.vstack((
+        old_bounds[np.array([k not in key_set for k in old_keys], dtype=bool)],
+        bounds[np.array([k not in old_key_set for k in keys], dtype=bool)],
+    ))
+    pairs = list(visibility.items())
+    starts = np.array([key[0] for key, _ in pairs], dtype=np.float64)
+    ends = np.array([key[1] for key, _ in pairs], dtype=np.float64)
+    lo = np.minimum(starts, ends)[:, [0, 2]] - 1e-4
+    hi = np.maximum(starts, ends)[:, [0, 2]] + 1e-4
+
+    grid = flr.tri_grid()
+    keep = (grid.locate_many(starts) != -1) & (grid.locate_many(ends) != -1)
+    # Chunked so pairs x changed-triangles stays a modest array
+    for i in range(0, len(changed), 256):
+        block = changed[i:i + 256]
+        overlap = ((lo[:, None, 0] <= block[None, :, 2]) & (hi[:, None, 0] >= block[None, :, 0]) &
+                   (lo[:, None, 1] <= block[None, :, 3]) & (hi[:, None, 1] >= block[None, :, 1]))
+        keep &= ~overlap.any(axis=1)
+    flr.visibility = {key: connected for (key, connected), ok in zip(pairs, keep.tolist()) if ok}
+    print(f"{name}: {len(changed)} floor triangles changed, reusing {len(flr.visibility)} of {len(pairs)} cached walk results")
+
+def build_floor(current_obj, portal_objects, use_cache=True, apply_modifiers=False):
+    """Build a FloorFile in memory from a Blender mesh object. Does not write to disk.
+    With use_cache, mesh walks from the last build of this object are reused
+    wherever the floor and waypoint edits since then can't have changed them."""
+    flr, content = extract_floor(current_obj, portal_objects, use_cache, apply_modifiers)
+    if flr is None:
+        return None
+    finish_floor(flr, [p[1] for p in portal_objects], [p[0].name for p in portal_objects])
+    if use_cache:
+        store_visibility(current_obj.name, content, live_visibility(flr))
+    return flr
 
+def extract_floor(current_obj, portal_objects, use_cache=True, apply_modifiers=False):
+    """The part of build_floor that needs Blender: triangles, portal tags and
+    snapped waypoints, with cached walk results seeded when use_cache is set.
+    The floor is the object's own mesh unless apply_modifiers is set.
+    Returns (flr, content), content being what store_visibility needs later
+    (None without use_cache), or (None, None) if the mesh can't be a floor."""
     flr = FloorFile(None)
+    content = None
 
-    me = current_obj.to_mesh()
+    _, me = object_mesh(current_obj, apply_modifiers)
+    # Face map values follow the polygons of the mesh actually being exported
+    face_map_mesh = me if apply_modifiers else current_obj.data
 
     # Find the tris in the "fallthrough" face map
     fallthrough_map_index = None
@@ -97,15 +163,19 @@ def build_floor(current_obj, portal_objects):
         print(f"{current_obj.name} has 'fallthrough' facemap. Good to go")
 
     face_maps_by_index = None
-    if current_obj.data.face_maps.active:
-        face_maps_by_index = [m_face_map.value for m_face_map in current_obj.data.face_maps.active.data]
+    if face_map_mesh.face_maps.active:
+        face_maps_by_index = [m_face_map.value for m_face_map in face_map_mesh.face_maps.active.data]
 
     for v in me.vertices:
         flr.verts.append(convert_vector3([v.co[0], v.co[1], v.co[2]]))
 
-    flr.tris = create_floor_triangles_from_mesh(current_obj, me, portal_objects)
-    if flr.tris is None:
-        return None
+    tris = create_floor_triangles_from_mesh(current_obj, me, portal_objects)
+    if tris is None:
+        return None, None
+    flr.tris = tris
+    if use_cache:
+        content = _floor_content(flr)
+        _reuse_visibility(current_obj.name, flr, content)
 
     # Mark fallthrough tris now that they're created
     for ft in flr.tris:
@@ -132,40 +202,76 @@ def build_floor(current_obj, portal_objects):
                 # which causes ambiguous point-in-triangle tests. Matches
                 # Maya exporter (FloorBuilder.cpp:593).
                 converted += Vector((0.007, 0.0, 0.003))
-                snapped_y = _snap_to_floor(converted, flr)
-                if snapped_y is not None:
-                    converted.y = snapped_y
                 node.position = [converted.x, converted.y, converted.z]
                 pathGraph.nodes.append(node)
                 index += 1
 
-    portalNames = [p[0].name for p in portal_objects]
-    flr.add_portal_nodes(globalPortalIndices, portalNames)
+        # Snap every waypoint in the cell in one go
+        for node, snapped_y in zip(pathGraph.nodes, _snap_all_to_floor([n.position for n in pathGraph.nodes], flr)):
+            if snapped_y is not None:
+                node.position[1] = snapped_y
+
+    return flr, content
+
+def finish_floor(flr, portal_indices, portal_names, workers=None):
+    """The bpy-free part of build_floor: portal nodes and the waypoint pathgraph."""
+    flr.add_portal_nodes(portal_indices, portal_names)
     flr.prepare_connectivity()
-    flr.make_waypoint_connections()
+    flr.make_waypoint_connections(workers=workers)
     flr.prune_redundant_edges()
     flr.add_portal_edges()
 
-    return flr
-
-def export_one(fullpath, current_obj, portal_objects, use_object_name=True):
+def live_visibility(flr):
+    """flr.visibility restricted to node positions that still exist."""
+    if flr.visibility is None:
+        return {}
+    positions = {tuple(node.position) for node in flr.pathGraph.nodes}
+    return {key: connected for key, connected in flr.visibility.items() if key[0] in positions and key[1] in positions}
+
+def store_visibility(name, content, visibility):
+    """Remember a finished floor's walk results for the next build of name."""
+    _floor_cache.pop(name, None)
+    _floor_cache[name] = content + (visibility,)
+    while len(_floor_cache) > FLOOR_CACHE_SIZE:
+        del _floor_cache[next(iter(_floor_cache))]
+
+def write_floor(flr, fullpath, portal_indices, portal_names, workers=None):
+    """Finish the pathgraph of a floor from extract_floor and write it. Doesn't
+    touch bpy, so it can run in a worker process. Returns the average pathgraph
+    node position (None without nodes) and the walk results worth caching."""
     start = time.time()
+    if workers is None and in_forked_worker():
+        # Already one of several export workers; don't fork another pool per floor
+        workers = 1
+    os.makedirs(os.path.dirname(fullpath) or '.', exist_ok=True)
+    finish_floor(flr, portal_indices, portal_names, workers)
+
+    average = None
+    if flr.pathGraph is not None and flr.pathGraph.nodes:
+        # Report-only: prints anything NPCs would trip over
+        flr.pathGraph.validate()
+        average = tuple(np.mean([node.position for node in flr.pathGraph.nodes], axis=0).tolist())
+
+    flr.path = fullpath
+    flr.write()
+    elapsed = time.time() - start
+    print(f"Successfully wrote: {fullpath} Duration: {elapsed:.3f}s")
+
+    return average, live_visibility(flr)
+
+def export_one(fullpath, current_obj, portal_objects, use_object_name=True, apply_modifiers=False):
     print(f'Exporting Flr: {fullpath}')
 
     if use_object_name:
         dirname = os.path.dirname(fullpath)
         fullpath = os.path.join(dirname, current_obj.name + ".flr")
 
-    os.makedirs(os.path.dirname(fullpath) or '.', exist_ok=True)
-
-    flr = build_floor(current_obj, portal_objects)
+    flr, content = extract_floor(current_obj, portal_objects, apply_modifiers=apply_modifiers)
     if flr is None:
         return {'CANCELLED'}, None
 
-    flr.path = fullpath
-    flr.write()
-    elapsed = time.time() - start
-    print(f"Successfully wrote: {fullpath} Duration: {elapsed:.3f}s")
+    _, visibility = write_floor(flr, fullpath, [p[1] for p in portal_objects], [p[0].name for p in portal_objects])
+    store_visibility(current_obj.name, content, visibility)
 
     return {'FINISHED'}, flr
 
@@ -253,27 +359,94 @@ def _match_segment_to_poly(a, b, poly_verts):
 
     return False
 
+# Farthest a floor edge endpoint can be from a portal polygon and still match
+# (Test 1 of _match_segment_to_poly); pads the portal bounds in the hash.
+PORTAL_MATCH_TOLERANCE = 0.1
+
+def _build_portal_hash(portal_cache):
+    """Index every portal polygon by the grid cells its bounds (padded by
+    PORTAL_MATCH_TOLERANCE) overlap. Built once per export, so matching a floor
+    edge only tests polygons near it instead of every polygon of every portal.
+    Entries keep the portal_cache/polygon order so the first match is unchanged."""
+    entries = []
+    for portalIndex, portalObj, pid, portalMesh in portal_cache:
+        mesh_verts = [Vector(v.co) for v in portalMesh.vertices]
+        for portalTri in portalMesh.polygons:
+            verts = [mesh_verts[p] for p in portalTri.vertices]
+            lo = Vector([min(v[i] for v in verts) - PORTAL_MATCH_TOLERANCE for i in range(3)])
+            hi = Vector([max(v[i] for v in verts) + PORTAL_MATCH_TOLERANCE for i in range(3)])
+            entries.append((len(entries), portalIndex, portalObj, pid, portalTri.index, verts, lo, hi))
+
+    # Cells about the size of a portal polygon keep both lookups and inserts small
+    cell_size = 1.0
+    if entries:
+        cell_size = max(sum(max(e[7] - e[6]) for e in entries) / len(entries), 0.25)
+
+    cells = {}
+    for entry in entries:
+        lo = [math.floor(c / cell_size) for c in entry[6]]
+        hi = [math.floor(c / cell_size) for c in entry[7]]
+        for x in range(lo[0], hi[0] + 1):
+            for y in range(lo[1], hi[1] + 1):
+                for z in range(lo[2], hi[2] + 1):
+                    cells.setdefault((x, y, z), []).append(entry)
+    return cells, cell_size
+
+def _portal_candidates(portal_hash, a, b):
+    """Portal polygons, in export order, whose padded bounds contain both a and b."""
+    cells, cell_size = portal_hash
+    key = (math.floor(a[0] / cell_size), math.floor(a[1] / cell_size), math.floor(a[2] / cell_size))
+    return [e for e in cells.get(key, ())
+            if all(e[6][i] <= a[i] <= e[7][i] and e[6][i] <= b[i] <= e[7][i] for i in range(3))]
+
 def create_floor_triangles_from_mesh(obj, me, portal_objects):
     tris = []
-    edge_types = {}
-    for edge in me.edges:
-        key = frozenset(edge.vertices)
-        edge_types[key] = FloorEdgeType.Crossable
-        if edge.use_seam:
-            edge_types[key] = FloorEdgeType.Uncrossable
-        elif edge.use_edge_sharp:
-            edge_types[key] = FloorEdgeType.WallBase
-        elif edge.crease > 0.9:
-            edge_types[key] = FloorEdgeType.WallTop
-
-    # Build edge-to-triangle adjacency map for O(1) neighbor lookups
-    edge_adj = {}
-    for poly in me.polygons:
-        verts = poly.vertices
-        n = len(verts)
-        for i in range(n):
-            edge_key = frozenset((verts[i], verts[(i + 1) % n]))
-            edge_adj.setdefault(edge_key, []).append(poly.index)
+
+    loop_totals = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_total", loop_totals)
+    bad = np.nonzero(loop_totals != 3)[0]
+    if len(bad):
+        print(f"Error. Triangle {bad[0]} has {loop_totals[bad[0]]} vertices. Only triangles supported!")
+        return None
+
+    loop_verts = np.empty(len(me.loops), dtype=np.int64)
+    me.loops.foreach_get("vertex_index", loop_verts)
+    loop_starts = np.empty(len(me.polygons), dtype=np.int64)
+    me.polygons.foreach_get("loop_start", loop_starts)
+    poly_verts = loop_verts[loop_starts[:, None] + np.arange(3)]
+    # Floor winding is the reverse of Blender's
+    corners = poly_verts[:, [0, 2, 1]]
+
+    # Edge types, looked up by canonical (low, high) vertex pair
+    edge_verts = np.empty(len(me.edges) * 2, dtype=np.int64)
+    me.edges.foreach_get("vertices", edge_verts)
+    edge_verts = np.sort(edge_verts.reshape(-1, 2), axis=1)
+    seam = np.empty(len(me.edges), dtype=bool)
+    me.edges.foreach_get("use_seam", seam)
+    sharp = np.empty(len(me.edges), dtype=bool)
+    me.edges.foreach_get("use_edge_sharp", sharp)
+    crease = np.empty(len(me.edges), dtype=np.float32)
+    me.edges.foreach_get("crease", crease)
+    mesh_edge_types = np.full(len(me.edges), FloorEdgeType.Crossable, dtype=np.int64)
+    mesh_edge_types[crease > 0.9] = FloorEdgeType.WallTop
+    mesh_edge_types[sharp] = FloorEdgeType.WallBase
+    mesh_edge_types[seam] = FloorEdgeType.Uncrossable
+
+    vert_count = max(len(me.vertices), 1)
+    edge_keys = edge_verts[:, 0] * vert_count + edge_verts[:, 1]
+    edge_order = np.argsort(edge_keys)
+    ends = corners[:, [1, 2, 0]]
+    tri_edge_keys = np.minimum(corners, ends) * vert_count + np.maximum(corners, ends)
+    tri_edge_types = mesh_edge_types[edge_order[np.searchsorted(edge_keys[edge_order], tri_edge_keys)]]
+
+    # Neighbour links from one sort of the 3F edge array
+    neighbors, non_manifold = FloorFile.triangle_adjacency(corners)
+    if len(non_manifold):
+        print(f"Warning! {obj.name} has {len(non_manifold)} non-manifold edges (shared by 3+ triangles), e.g. vertices {non_manifold[0].tolist()}")
+
+    normals = np.empty(len(me.polygons) * 3, dtype=np.float64)
+    me.polygons.foreach_get("normal", normals)
+    normals = normals.reshape(-1, 3)
 
     # Cache portal meshes to avoid repeated to_mesh() calls
     portal_cache = []
@@ -281,35 +454,18 @@ def create_floor_triangles_from_mesh(obj, me, portal_objects):
         if portalObj.type != 'MESH':
             continue
         portal_cache.append((portalIndex, portalObj, pid, portalObj.to_mesh()))
+    portal_hash = _build_portal_hash(portal_cache)
+    floor_verts = [Vector(v.co) for v in me.vertices]
 
+    edge_type_enums = tuple(FloorEdgeType)
     usedPortals = set()
-    for t1 in me.polygons:
-        if len(t1.vertices) != 3:
-            print(f"Error. Triangle {t1.index} has {len(t1.vertices)} vertices. Only triangles supported!")
-            return None
-
+    for index, (c, n, e, normal) in enumerate(zip(corners.tolist(), neighbors.tolist(), tri_edge_types.tolist(), normals.tolist())):
         ft = FloorTri()
-        ft.index = t1.index
-        ft.corner1 = t1.vertices[0]
-        ft.corner2 = t1.vertices[2]
-        ft.corner3 = t1.vertices[1]
-
-        t1e1 = frozenset([t1.vertices[0],t1.vertices[2]])
-        t1e2 = frozenset([t1.vertices[2],t1.vertices[1]])
-        t1e3 = frozenset([t1.vertices[1],t1.vertices[0]])
-
-        # find the edge types
-        ft.edgeType1 = edge_types[t1e1]
-        ft.edgeType2 = edge_types[t1e2]
-        ft.edgeType3 = edge_types[t1e3]
-
-        for edge_key, attr in [(t1e1, 'nindex1'), (t1e2, 'nindex2'), (t1e3, 'nindex3')]:
-            for tri_idx in edge_adj.get(edge_key, []):
-                if tri_idx != t1.index:
-                    setattr(ft, attr, tri_idx)
-                    break
-
-        ft.normal = convert_vector3([-t1.normal.x, -t1.normal.y, -t1.normal.z])        
+        ft.index = index
+        ft.corner1, ft.corner2, ft.corner3 = c
+        ft.nindex1, ft.nindex2, ft.nindex3 = n
+        ft.edgeType1, ft.edgeType2, ft.edgeType3 = edge_type_enums[e[0]], edge_type_enums[e[1]], edge_type_enums[e[2]]
+        ft.normal = convert_vector3([-normal[0], -normal[1], -normal[2]])
 
         # For each boundary edge, test against all portal polygons using
         # the same 3-test approach as the engine's matchSegmentToPoly:
@@ -317,27 +473,20 @@ def create_floor_triangles_from_mesh(obj, me, portal_objects):
         #   Test 2: Close to a portal edge segment within 5cm
         #   Test 3: Close to nearest point on portal polygon within 1cm
         edges_and_neighbors = [
-            (Vector(me.vertices[ft.corner1].co), Vector(me.vertices[ft.corner2].co), ft.nindex1, 'portalId1'),
-            (Vector(me.vertices[ft.corner2].co), Vector(me.vertices[ft.corner3].co), ft.nindex2, 'portalId2'),
-            (Vector(me.vertices[ft.corner3].co), Vector(me.vertices[ft.corner1].co), ft.nindex3, 'portalId3'),
+            (floor_verts[ft.corner1], floor_verts[ft.corner2], ft.nindex1, 'portalId1'),
+            (floor_verts[ft.corner2], floor_verts[ft.corner3], ft.nindex2, 'portalId2'),
+            (floor_verts[ft.corner3], floor_verts[ft.corner1], ft.nindex3, 'portalId3'),
         ]
 
         for edgeA, edgeB, neighborIdx, portalIdAttr in edges_and_neighbors:
             if neighborIdx != -1:
                 continue
 
-            matched = False
-            for portalIndex, portalObj, pid, portalMesh in portal_cache:
-                for portalTri in portalMesh.polygons:
-                    portalVerts = [Vector(portalMesh.vertices[p].co) for p in portalTri.vertices]
-
-                    if _match_segment_to_poly(edgeA, edgeB, portalVerts):
-                        print(f"   Intersection found: floorTri {t1.index}, Edge: {edgeA} - {edgeB} portalMesh {portalObj.name}: tri {portalTri.index} {portalIdAttr} = {pid}")
-                        setattr(ft, portalIdAttr, portalIndex)
-                        usedPortals.add(portalObj)
-                        matched = True
-                        break
-                if matched:
+            for _, portalIndex, portalObj, pid, portalTriIndex, portalVerts, _, _ in _portal_candidates(portal_hash, edgeA, edgeB):
+                if _match_segment_to_poly(edgeA, edgeB, portalVerts):
+                    print(f"   Intersection found: floorTri {index}, Edge: {edgeA} - {edgeB} portalMesh {portalObj.name}: tri {portalTriIndex} {portalIdAttr} = {pid}")
+                    setattr(ft, portalIdAttr, portalIndex)
+                    usedPortals.add(portalObj)
                     break
 
         tris.append(ft)    
@@ -21,6 +21,7 @@
 # SOFTWARE.
 
 import os
+import shutil
 import bpy
 import base64
 import bmesh
@@ -33,6 +34,7 @@ from . import export_flr
 from . import export_msh
 from . import support
 from . import extents
+from . import export_manifest
 
 from mathutils import Matrix, Vector, Color
 from bpy_extras import io_utils, node_shader_utils
@@ -49,25 +51,51 @@ def mesh_triangulate(me):
     bm.to_mesh(me)
     bm.free()
 
-def save(context, filepath, *, flip_uv_vertical=False, export_children=True):
+def save(context, filepath, *, flip_uv_vertical=False, export_children=True, incremental=True, apply_modifiers=False):
     collection = bpy.context.view_layer.active_layer_collection.collection
     if collection != None:
         dirname = os.path.dirname(filepath)
         fullpath = os.path.join(dirname, collection.name+".lod")
         extract_dir=context.preferences.addons[__package__].preferences.swg_root
-        return export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_children)
+        return export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_children, incremental, apply_modifiers)
     else:
         return {'CANCELLED'}
 
-def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_children):
+def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_children, incremental=True, apply_modifiers=False):
+    start = time.time()
+    manifest = export_manifest.ExportManifest(fullpath, incremental).load()
+    session = export_msh.ExportSession(apply_modifiers=apply_modifiers)
+    jobs = extract(fullpath, extract_dir, collection, flip_uv_vertical, export_children, start, manifest, session=session)
+    session.close()
+    if jobs is None:
+        return {'CANCELLED'}
+    support.run_export_jobs(jobs)
+    manifest.save()
+    return {'FINISHED'}
+
+def extract(fullpath, extract_dir, collection, flip_uv_vertical, export_children, start=None, manifest=None, outputs=None, session=None):
+    """Gather everything the LOD needs from Blender. Returns the (func, args, done)
+    jobs that write the LOD, its child meshes and floor, for support.run_export_jobs,
+    or None if the collection can't be exported. With a manifest, children whose
+    content and files are unchanged since they were recorded in it are skipped.
+    Every file the jobs write is appended to outputs, if given. Each child is
+    read once, through session (an export_msh.ExportSession), which also decides
+    whether modifiers are applied to the children and floor."""
+    if outputs is None:
+        outputs = []
+    owns_session = session is None
+    if owns_session:
+        session = export_msh.ExportSession()
     lodName = os.path.basename(fullpath).replace('.lod','')
     print(f"LOD Name: {lodName}")
 
     appearanceDirname = os.path.dirname(os.path.dirname(fullpath))
 
     lodFile = swg_types.LodFile(fullpath)
-    start = time.time()
+    if start is None:
+        start = time.time()
     print(f'Exporting lod: {fullpath} Flip UV: {flip_uv_vertical}')
+    jobs = []
     
     meshCol = None
     hardpointsCol = None
@@ -89,15 +117,20 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
 
     if meshCol == None:
         print("Error. No 'LODs' collection. Aborting!")
-        return {'CANCELLED'}
+        if owns_session:
+            session.close()
+        return None
 
     total_extents = None
     for obj in meshCol.all_objects:
         # skip nested objects. We only want ones that are directly under the collection, which won't have a parent.
         if obj.parent:
             continue
+        # Unmaterialised detail levels have no geometry here; the levels that do bound them well enough
+        if support.is_lod_placeholder(obj):
+            continue
         print(f"Getting extents for: {obj.name}")
-        obj_extents = export_msh.get_extents(obj)
+        obj_extents = export_msh.get_extents(obj, session)
         if total_extents == None:
             total_extents = obj_extents
         else:
@@ -114,7 +147,9 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
     for child in meshCol.objects:
         if not 'distance' in child:
             print(f"Error. LOD Child: {child.name} doesn't have 'distance' CustomProperty. Please set it!")
-            return {'CANCELLED'}
+            if owns_session:
+                session.close()
+            return None
         min_distances.append((child, child['distance']))
 
     sorted_min_distances = sorted(min_distances, key=lambda x: x[1])
@@ -134,8 +169,26 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
         if export_children:            
             if not os.path.exists(os.path.dirname(mshPath)):
                 os.makedirs(os.path.dirname(mshPath))
+            outputs.append(mshPath)
+            done = None
+            if manifest != None:
+                extra = ['msh', mshPath, flip_uv_vertical]
+                if support.is_lod_placeholder(obj):
+                    # The export is a copy of this file, so it's the content that matters
+                    extra.append(export_manifest.file_checksum(obj['lod_path']))
+                content = export_manifest.hash_objects([obj], *extra, session=session)
+                if manifest.is_current(reference, content):
+                    print(f"{obj.name} unchanged since {mshPath} was written. Skipping")
+                    continue
+                done = functools.partial(_record, manifest, reference, content, [mshPath])
+            if support.is_lod_placeholder(obj):
+                # Never imported, so never edited: the original file is the export
+                if os.path.normcase(os.path.realpath(obj['lod_path'])) != os.path.normcase(os.path.realpath(mshPath)):
+                    print(f"Copying unmaterialised {obj.name} from {obj['lod_path']} to {mshPath}")
+                    jobs.append((shutil.copyfile, (obj['lod_path'], mshPath), done))
+                continue
             print(f"Exporting msh {obj.name} to {mshPath}")
-            export_msh.export_one(mshPath, extract_dir, obj, flip_uv_vertical)
+            jobs.append((export_msh.write, (export_msh.extract(mshPath, extract_dir, obj, flip_uv_vertical, session), mshPath), done))
 
     if collisionCol:
         lodFile.collision = support.create_extents_from_collection(collisionCol)
@@ -167,8 +220,18 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
             floorPath = f'{appearanceDirname}/collision/{floor.name}.flr'
             if not os.path.exists(os.path.dirname(floorPath)):
                 os.makedirs(os.path.dirname(floorPath))
-            print(f"Exporting floor {floor.name} to {floorPath}")
-            export_flr.export_one(floorPath, floor, [])
+            outputs.append(floorPath)
+            floor_content = None
+            if manifest != None:
+                floor_content = export_manifest.hash_objects([floor], 'flr', floorPath, session=session)
+            if floor_content != None and manifest.is_current(lodFile.floor, floor_content):
+                print(f"Floor {floor.name} unchanged since {floorPath} was written. Skipping")
+            else:
+                print(f"Exporting floor {floor.name} to {floorPath}")
+                flr, content = export_flr.extract_floor(floor, [], apply_modifiers=session.apply_modifiers)
+                if flr != None:
+                    jobs.append((export_flr.write_floor, (flr, floorPath, [], []),
+                        functools.partial(_floor_written, floor.name, content, manifest, lodFile.floor, floor_content, floorPath)))
 
     if rtwCol != None:
         for obj in rtwCol.all_objects:
@@ -181,6 +244,17 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
     else:
         print(f"Warning! No 'Radar/Test/Write' collection. Won't have any of those.")
 
+    if owns_session:
+        session.close()
+    jobs.append((write, (lodFile, fullpath, start), None))
+    outputs.extend([fullpath, f"{appearanceDirname}/{lodName}.apt"])
+    return jobs
+
+def write(lodFile, fullpath, start):
+    """Serialise a LodFile and its APT. Doesn't touch bpy, so it can run in a worker process."""
+    lodName = os.path.basename(fullpath).replace('.lod','')
+    appearanceDirname = os.path.dirname(os.path.dirname(fullpath))
+
     print(f"Assembling final IFF ... ")
     lodFile.write(fullpath)
     now = time.time()
@@ -191,7 +265,15 @@ def export_one(fullpath, extract_dir, collection, flip_uv_vertical, export_child
 
     return {'FINISHED'}
 
-def get_extents(collection):
+def _record(manifest, key, content, paths, result):
+    manifest.update(key, content, paths)
+
+def _floor_written(name, content, manifest, key, floor_content, floorPath, result):
+    export_flr.store_visibility(name, content, result[1])
+    if manifest != None:
+        manifest.update(key, floor_content, [floorPath])
+
+def get_extents(collection, session=None):
 
     for child in collection.children:
         if child.name.startswith("LODs"):
@@ -203,8 +285,10 @@ def get_extents(collection):
 
     total_extents = None
     for obj in meshCol.objects:
+        if support.is_lod_placeholder(obj):
+            continue
         print(f"Getting extents for: {obj.name}")
-        obj_extents = export_msh.get_extents(obj)
+        obj_extents = export_msh.get_extents(obj, session)
         if total_extents == None:
             total_extents = obj_extents
         else:
@@ -212,20 +296,3 @@ def get_extents(collection):
             total_extents.expand(obj_extents)
 
     return total_extents
-
-def avg_vert_position_in_blender(collection):
-    for child in collection.children:
-        if child.name.startswith("LODs"):
-            meshCol = child
-
-    if meshCol == None:
-        print("Error. No 'LODs' collection. Aborting!")
-        return None
-
-    if len(meshCol.objects) > 0:
-        sum = export_msh.avg_vert_position_in_blender(meshCol.objects[0])
-        for obj in meshCol.objects[1:0]:
-            sum += export_msh.avg_vert_position_in_blender(obj)
-        return sum / len(meshCol.objects)
-    else:
-        return None
\ No newline at end of file
@@ -0,0 +1,155 @@
+# MIT License
+#
+# Copyright (c) 2022 Nick Rafalski
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from . import support
+
+def _feed_array(h, collection, attr, dtype, width=1):
+	data = np.empty(len(collection) * width, dtype=dtype)
+	collection.foreach_get(attr, data)
+	h.update(data.tobytes())
+
+def _feed_props(h, block):
+	for key in sorted(block.keys()):
+		value = block[key]
+		if hasattr(value, 'to_dict'):
+			value = value.to_dict()
+		elif hasattr(value, 'to_list'):
+			value = value.to_list()
+		h.update(repr((key, value)).encode())
+
+def _feed_mesh(h, obj, session):
+	if session != None:
+		me = session.mesh(obj)
+	else:
+		me = obj.to_mesh()
+		me.calc_normals_split()
+	_feed_array(h, me.vertices, "co", np.float32, 3)
+	_feed_array(h, me.loops, "vertex_index", np.int32)
+	_feed_array(h, me.loops, "normal", np.float32, 3)
+	_feed_array(h, me.polygons, "loop_total", np.int32)
+	_feed_array(h, me.polygons, "material_index", np.int32)
+	_feed_array(h, me.edges, "vertices", np.int32, 2)
+	_feed_array(h, me.edges, "use_seam", bool)
+	_feed_array(h, me.edges, "use_edge_sharp", bool)
+	_feed_array(h, me.edges, "crease", np.float32)
+	for layer in me.uv_layers:
+		h.update(layer.name.encode())
+		_feed_array(h, layer.data, "uv", np.float32, 2)
+	for layer in me.vertex_colors:
+		h.update(layer.name.encode())
+		_feed_array(h, layer.data, "color", np.float32, 4)
+	for face_map in obj.face_maps:
+		h.update(face_map.name.encode())
+	if obj.data.face_maps.active:
+		_feed_array(h, obj.data.face_maps.active.data, "value", np.int32)
+	for slot in obj.material_slots:
+		if slot.material:
+			h.update(slot.material.name.encode())
+			_feed_props(h, slot.material)
+
+def hash_objects(objects, *extra, session=None):
+	"""Hash everything an export reads from objects and their children: meshes, materials, transforms, custom props and light settings. Anything in
+	extra (export options, output paths) is hashed along with them. Meshes come
+	from session (an export_msh.ExportSession) when given, so hashing doesn't
+	read them a second time."""
+	h = hashlib.blake2b()
+	h.update(repr(extra).encode())
+	pending = list(objects)
+	seen = set()
+	while pending:
+		obj = pending.pop(0)
+		if obj.name in seen:
+			continue
+		seen.add(obj.name)
+		h.update(repr((obj.name, obj.type, obj.parent.name if obj.parent else None)).encode())
+		h.update(np.array(obj.matrix_world, dtype=np.float64).tobytes())
+		_feed_props(h, obj)
+		if obj.type == 'MESH':
+			_feed_mesh(h, obj, session)
+		elif obj.type == 'LIGHT':
+			h.update(repr((obj.data.type, obj.data.energy, tuple(obj.data.color))).encode())
+			_feed_props(h, obj.data)
+		elif obj.type == 'EMPTY':
+			h.update(obj.empty_display_type.encode())
+		pending.extend(support.getChildren(obj))
+	return h.hexdigest()
+
+def file_checksum(path):
+	"""blake2b of a file's bytes, or None if it doesn't exist."""
+	if not os.path.isfile(path):
+		return None
+	h = hashlib.blake2b()
+	with open(path, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), b''):
+			h.update(block)
+	return h.hexdigest()
+
+class ExportManifest(object):
+	"""Sidecar next to an exported file recording, per entry (a POB cell, a LOD
+	child), the content hash it was exported from and the checksums of the files
+	it wrote. An entry is current while both still match, so its export can be skipped."""
+	VERSION = 1
+
+	def __init__(self, exported_path, reuse=True):
+		self.path = exported_path + ".manifest.json"
+		# Without reuse nothing counts as current, but entries are still recorded
+		self.reuse = reuse
+		self.entries = {}
+
+	def load(self):
+		self.entries = {}
+		if not os.path.isfile(self.path):
+			return self
+		try:
+			with open(self.path, 'r') as f:
+				data = json.load(f)
+		except (OSError, ValueError) as e:
+			print(f"Warning! Couldn't read export manifest {self.path}: {e}")
+			return self
+		if data.get('version') == ExportManifest.VERSION:
+			self.entries = data.get('entries', {})
+		return self
+
+	def save(self):
+		with open(self.path, 'w') as f:
+			json.dump({'version': ExportManifest.VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+
+	def is_current(self, key, content_hash):
+		entry = self.entries.get(key)
+		if not self.reuse or entry is None or entry['hash'] != content_hash:
+			return False
+		# A recorded None means the file was never written, so there's nothing to reuse
+		return all(checksum != None and file_checksum(path) == checksum for path, checksum in entry['outputs'].items())
+
+	def get(self, key, field, default=None):
+		return self.entries.get(key, {}).get(field, default)
+
+	def update(self, key, content_hash, outputs, **extra):
+		"""Record that key was exported from content_hash, writing outputs."""
+		entry = {'hash': content_hash, 'outputs': {path: file_checksum(path) for path in outputs}}
+		entry.update(extra)
+		self.entries[key] = entry
@@ -25,6 +25,7 @@ import bpy
 import base64
 import bmesh
 import time, datetime, array, functools, math
+import numpy as np
 from . import vector3D
 from . import swg_types
 from . import vertex_buffer_format
@@ -47,7 +48,88 @@ def mesh_triangulate(me):
 	bm.to_mesh(me)
 	bm.free()
 
-def save(context, filepath, *, flip_uv_vertical=False):
+def _loop_array(collection, attr, width=1, dtype=np.float64):
+	data = np.empty(len(collection) * width, dtype=dtype)
+	collection.foreach_get(attr, data)
+	return data.reshape(-1, width) if width > 1 else data
+
+class ExportSession(object):
+	"""Reads each object's mesh once per export. The mesh is triangulated and given
+	split normals and tangents once, and the arrays read from it are cached by
+	object pointer, so extents, manifest hashes and the SPS streams all share
+	one to_mesh() instead of each calling it again. Modifiers are only applied
+	when apply_modifiers is set."""
+
+	def __init__(self, depsgraph=None, apply_modifiers=False):
+		self.depsgraph = depsgraph
+		self.apply_modifiers = apply_modifiers
+		self.owners = {}
+		self.meshes = {}
+		self.streams = {}
+
+	def mesh(self, obj):
+		"""obj's mesh, triangulated, with split normals and tangents calculated
+		and its winding flipped if obj is negatively scaled."""
+		key = obj.as_pointer()
+		if key in self.meshes:
+			return self.meshes[key]
+
+		if self.apply_modifiers and self.depsgraph == None:
+			self.depsgraph = bpy.context.evaluated_depsgraph_get()
+		owner, me = support.object_mesh(obj, self.apply_modifiers, self.depsgraph)
+		mesh_triangulate(me)
+		me.calc_normals_split()
+
+		# Normals are read before the flip below; everything else after it
+		stream = {'normal': _loop_array(me.loops, "normal", 3)}
+
+		for layer in me.uv_layers:
+			me.calc_tangents(uvmap=layer.name)
+
+		#If negative scaling, we have to invert the normals...
+		if obj.matrix_world.determinant() < 0.0:
+			me.flip_normals()
+
+		stream['co'] = _loop_array(me.vertices, "co", 3)
+		stream['vertex_index'] = _loop_array(me.loops, "vertex_index", dtype=np.int32)
+		stream['material_index'] = _loop_array(me.polygons, "material_index", dtype=np.int32)
+		stream['loop_start'] = _loop_array(me.polygons, "loop_start", dtype=np.int32)
+		stream['loop_total'] = _loop_array(me.polygons, "loop_total", dtype=np.int32)
+		stream['uv'] = [_loop_array(layer.data, "uv", 2) for layer in me.uv_layers]
+		stream['color'] = {layer.name: _loop_array(layer.data, "color", 4) for layer in me.vertex_colors}
+		stream['tangent'] = _loop_array(me.loops, "tangent", 3)
+		stream['bitangent_sign'] = _loop_array(me.loops, "bitangent_sign")
+
+		self.owners[key] = owner
+		self.meshes[key] = me
+		self.streams[key] = stream
+		return me
+
+	def stream(self, obj, name):
+		self.mesh(obj)
+		return self.streams[obj.as_pointer()][name]
+
+	def extents(self, obj):
+		co = self.stream(obj, 'co')
+		if len(co) == 0:
+			return extents.BoxExtents([None, None, None], [None, None, None])
+		# convert_vector3 swaps Y and Z
+		points = co[:, [0, 2, 1]]
+		low = points.min(axis=0)
+		high = points.max(axis=0)
+		box = extents.BoxExtents([float(v) for v in low], [float(v) for v in high])
+		box.fitSphere(points)
+		return box
+
+	def close(self):
+		"""Free the temporary meshes. Anything extracted from them stays valid."""
+		for owner in self.owners.values():
+			owner.to_mesh_clear()
+		self.owners = {}
+		self.meshes = {}
+		self.streams = {}
+
+def save(context, filepath, *, flip_uv_vertical=False, apply_modifiers=False):
 	objects = context.selected_objects
 
 	if len(objects) == 0:
@@ -56,6 +138,7 @@ def save(context, filepath, *, flip_uv_vertical=False):
 	else:
 		print(f"Objects to export: {len(objects)}")
 
+	session = ExportSession(apply_modifiers=apply_modifiers)
 	for ob in objects:
 		print(f"Exporting: {ob.name}")
 		if ob.type != 'MESH':
@@ -65,49 +148,51 @@ def save(context, filepath, *, flip_uv_vertical=False):
 			dirname = os.path.dirname(filepath)
 			fullpath = os.path.join(dirname, ob.name+".msh")
 			extract_dir=context.preferences.addons[__package__].preferences.swg_root
-			result = export_one(fullpath, extract_dir, ob, flip_uv_vertical)
+			result = export_one(fullpath, extract_dir, ob, flip_uv_vertical, session)
 			if not 'FINISHED' in result:
+				session.close()
 				return {'CANCELLED'}
+	session.close()
 	return {'FINISHED'}
 
-def export_one(fullpath, extract_dir, obj, flip_uv_vertical):
-	newMsh = swg_types.SWGMesh(fullpath, extract_dir)
+def export_one(fullpath, extract_dir, obj, flip_uv_vertical, session=None):
 	start = time.time()
+	newMsh = extract(fullpath, extract_dir, obj, flip_uv_vertical, session)
+	return write(newMsh, fullpath, start)
+
+def extract(fullpath, extract_dir, obj, flip_uv_vertical, session=None):
+	"""Everything that needs Blender: build the SWGMesh for obj in memory. The
+	SPS streams are read from session's arrays for obj, evaluating it if needed."""
+	owns_session = session == None
+	if owns_session:
+		session = ExportSession()
+	newMsh = swg_types.SWGMesh(fullpath, extract_dir)
 	print(f'Exporting msh: {fullpath} Flip UV: {flip_uv_vertical}')
 
 	def veckey2d(n, v):
 		return round(n[0], 4), round(n[1], 4), round(n[2], 4), round(v[0], 4), round(v[1], 4) 
 				
-	me = obj.to_mesh() 
-	mesh_triangulate(me)	
-	me.calc_normals_split()
-
-	for layer in me.vertex_colors:
-		print(f"Color layer: {layer.name}")
-
-	t_ln = array.array(data_types.ARRAY_FLOAT64, (0.0,)) * len(me.loops) * 3
-	me.loops.foreach_get("normal", t_ln)
-	normals = list(map(list, zip(*[iter(t_ln)]*3)))   
-	uv_maps=[]
-	
-	for layer in me.uv_layers:
-		uv_maps.append(layer.data[:])
-
-	t_ln = array.array(data_types.ARRAY_FLOAT64, [0.0,]) * len(me.loops) * 3
-	uv_names = [uvlayer.name for uvlayer in me.uv_layers]
-
-	for name in uv_names:
-		me.calc_tangents(uvmap=name)
-
-	#If negative scaling, we have to invert the normals...
-	if obj.matrix_world.determinant() < 0.0:
-		me.flip_normals()
+	session.mesh(obj)
+	stream = session.streams[obj.as_pointer()]
+
+	for name in stream['color']:
+		print(f"Color layer: {name}")
+
+	positions = stream['co'].tolist()
+	normals = stream['normal'].tolist()
+	loop_vertices = stream['vertex_index'].tolist()
+	loop_starts = stream['loop_start'].tolist()
+	loop_totals = stream['loop_total'].tolist()
+	uv_maps = [uv.tolist() for uv in stream['uv']]
+	colors = {name: color.tolist() for name, color in stream['color'].items()}
+	tangents = stream['tangent'].tolist()
+	bitangent_signs = stream['bitangent_sign'].tolist()
 
 	faces_by_material = {}
-	for polygon in me.polygons:
-		if not polygon.material_index in faces_by_material:
-			faces_by_material[polygon.material_index] = []   
-		faces_by_material[polygon.material_index].append(polygon)
+	for face_index, material_index in enumerate(stream['material_index'].tolist()):
+		if not material_index in faces_by_material:
+			faces_by_material[material_index] = []   
+		faces_by_material[material_index].append(face_index)
 
 	for index in faces_by_material:
 		print(f"Faces_by_material[{index}]: {len(faces_by_material[index])}")
@@ -151,45 +236,45 @@ def export_one(fullpath, extract_dir, obj, flip_uv_vertical):
 
 		unique_verts = {}
 		last_unique_vert_index = 0
-		for face_index, face in enumerate(face_list):
+		for face_index in face_list:
 			p1 = p2 = p3 = None
-			for uv_index, l_index in enumerate(face.loop_indices):
-				v = me.vertices[face.vertices[uv_index]]
+			loop_start = loop_starts[face_index]
+			for l_index in range(loop_start, loop_start + loop_totals[face_index]):
+				vert_index = loop_vertices[l_index]
 				normal = normals[l_index]
-				test_uv = uv_maps[0][l_index].uv.copy()
+				test_uv = uv_maps[0][l_index]
 				
-				rounded = face.vertices[uv_index], veckey2d(normal, test_uv)
+				rounded = vert_index, veckey2d(normal, test_uv)
 				if rounded not in unique_verts:
 					unique_verts[rounded] = last_unique_vert_index
 					last_unique_vert_index += 1
 
 					swg_v = swg_types.SWGVertex()
-					swg_v.pos = Vector(support.convert_vector3(v.co))
+					swg_v.pos = Vector(support.convert_vector3(positions[vert_index]))
 					swg_v.normal = Vector(support.convert_vector3(normal))
 					
 					if doColor0:
-						swg_v.color0 = me.vertex_colors["color0"].data[l_index].color
+						swg_v.color0 = list(colors["color0"][l_index])
 
 					if doColor1:
-						swg_v.color1 = me.vertex_colors["color1"].data[l_index].color
+						swg_v.color1 = list(colors["color1"][l_index])
 
 					for i in range(0, uvSets):
-						if i >= len(me.uv_layers):
+						if i >= len(uv_maps):
 							break
 
-						uv = me.uv_layers[i].data[l_index].uv.copy()
+						uv = Vector(uv_maps[i][l_index])
 
 						if flip_uv_vertical:
 							uv[1] = (1.0 - uv[1])
 
 						swg_v.texs.append(uv)
 						#if abs(uv[0]) > 10 or abs(uv[1]) > 10:
-						#print(f"SPS {this_mat_index-1} Vert {v.index} UV: {i} = {uv}")
+						#print(f"SPS {this_mat_index-1} Vert {vert_index} UV: {i} = {uv}")
 
 					if doDOT3:
-						loop = me.loops[l_index]						
-						tang = support.convert_vector3(loop.tangent)
-						swg_v.texs.append([ *tang, loop.bitangent_sign])
+						tang = support.convert_vector3(tangents[l_index])
+						swg_v.texs.append([ *tang, bitangent_signs[l_index]])
 
 					thisSPS.verts.append(swg_v)
 					total_verts += 1
@@ -208,53 +293,32 @@ def export_one(fullpath, extract_dir, obj, flip_uv_vertical):
 		newMsh.spss.append(thisSPS)	 
 		this_mat_index += 1
 
-	newMsh.extents = get_extents(obj)
+	newMsh.extents = get_extents(obj, session)
 
 	for ob in bpy.data.objects: 
 		if ob.parent == obj: 
 			if ob.type != 'MESH' and ob.type == 'EMPTY' and ob.empty_display_type == "ARROWS":
 				newMsh.hardpoints.append(support.hardpoint_from_obj(ob))
 
+	if owns_session:
+		session.close()
+	print(f"total_tris: {total_tris} total_verts: {total_verts}")
+	return newMsh
+
+def write(newMsh, fullpath, start=None):
+	"""Serialise a mesh built by extract. Doesn't touch bpy, so it can run in a worker process."""
+	if start is None:
+		start = time.time()
 	newMsh.write(fullpath)
 	now = time.time()
-	print(f"total_tris: {total_tris} total_verts: {total_verts} Successfully wrote: {fullpath} Duration: " + str(datetime.timedelta(seconds=(now-start))))
+	print(f"Successfully wrote: {fullpath} Duration: " + str(datetime.timedelta(seconds=(now-start))))
 
 	return {'FINISHED'}
 
-def get_extents(obj):
-	me = obj.to_mesh()
-	extreme_g_x = None
-	extreme_g_y = None
-	extreme_g_z = None
-			
-	extreme_l_x = None
-	extreme_l_y = None
-	extreme_l_z = None
-
-	for v in me.vertices:
-		c = Vector(support.convert_vector3(v.co))
-		if extreme_g_x == None or c[0] > extreme_g_x:
-			extreme_g_x = c[0]
-		if extreme_l_x == None or c[0] < extreme_l_x:
-			extreme_l_x = c[0]
-		if extreme_g_y == None or c[1] > extreme_g_y:
-			extreme_g_y = c[1]
-		if extreme_l_y == None or c[1] < extreme_l_y:
-			extreme_l_y = c[1]
-		if extreme_g_z == None or c[2] > extreme_g_z:
-			extreme_g_z = c[2]
-		if extreme_l_z == None or c[2] < extreme_l_z:
-			extreme_l_z = c[2]
-
-	return extents.BoxExtents([extreme_l_x, extreme_l_y, extreme_l_z],[extreme_g_x, extreme_g_y, extreme_g_z])
-
-def avg_vert_position_in_blender(obj):
-	me = obj.to_mesh() 
-	if len(me.vertices) > 0:
-		sum = me.vertices[0].co
-		for v in me.vertices[1:]:
-			sum += v.co
-
-		return sum / len(me.vertices)
-	else:
-		return None
\ No newline at end of file
+def get_extents(obj, session=None):
+	if session != None:
+		return session.extents(obj)
+	session = ExportSession()
+	obj_extents = session.extents(obj)
+	session.close()
+	return obj_extents
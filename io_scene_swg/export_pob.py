@@ -35,6 +35,7 @@ from . import export_msh
 from . import export_lod
 from . import support
 from . import extents
+from . import export_manifest
 
 from mathutils import Matrix, Vector, Color
 from bpy_extras import io_utils, node_shader_utils
@@ -44,38 +45,52 @@ from bpy_extras.wm_utils.progress_report import (
 	ProgressReportSubstep,
 )
 
-def get_parent_collections(collection):
+def build_parent_index():
+	"""
+	Maps every collection's name to its parent collections, in one pass over bpy.data.collections.
+
+	Returns:
+		A dict of collection name to a list of parent collections. Collections without parents are absent.
+	"""
+	parent_index = {}
+	for parent in bpy.data.collections:
+		for child in parent.children:
+			parent_index.setdefault(child.name, []).append(parent)
+	return parent_index
+
+def get_parent_collections(collection, parent_index=None):
 	"""
 	Retrieves the parent collection(s) of a given collection.
 
 	Args:
 		collection: The collection to find the parent(s) of.
+		parent_index: From build_parent_index. Built on the spot if not given; pass one in when asking repeatedly.
 
 	Returns:
 		A list of parent collections, or an empty list if no parent is found.
 	"""
-	parent_collections = []
-	for parent in bpy.data.collections:
-		if collection.name in parent.children.keys():
-			parent_collections.append(parent)
-	return parent_collections
+	if parent_index == None:
+		parent_index = build_parent_index()
+	return list(parent_index.get(collection.name, []))
 
 # A collection is probably a cell if it has exactly 1 parent, and 
 # no grandparents (the Collision, LOD and Portals collections will have grandparents)
-def is_cell_collection(collection):
-	parents = get_parent_collections(collection)
+def is_cell_collection(collection, parent_index=None):
+	if parent_index == None:
+		parent_index = build_parent_index()
+	parents = get_parent_collections(collection, parent_index)
 	if len(parents) != 1:
 		return False
 	
-	grandparents = get_parent_collections(parents[0])
+	grandparents = get_parent_collections(parents[0], parent_index)
 	if len(grandparents) != 0:
 		return False
 	
 	return True
 
 # A collection is probably a main POB if it has 0 parents
-def is_main_pob_collection(collection):
-	parents = get_parent_collections(collection)
+def is_main_pob_collection(collection, parent_index=None):
+	parents = get_parent_collections(collection, parent_index)
 	if len(parents) != 0:
 		return False
 	
@@ -97,7 +112,9 @@ def save(context,
 		 *,
 		 flip_uv_vertical=False,
 		 export_children=True,
-		 use_imported_crc=False
+		 use_imported_crc=False,
+		 incremental=True,
+		 apply_modifiers=False
 		 ):
 	exporting_specific_cells_only = False
 	area  = next(area for area in bpy.context.window.screen.areas if area.type == 'OUTLINER')
@@ -113,10 +130,11 @@ def save(context,
 	if len(selected_collections) == 0:
 		return print_and_create_return_object("ERROR", "Need to select either the root POB collection, or several cell collections to export! Aborting!")
 	
+	parent_index = build_parent_index()
 	c = selected_collections[0]
 	pob = None
-	if is_cell_collection(c):
-		parents = get_parent_collections(c)
+	if is_cell_collection(c, parent_index):
+		parents = get_parent_collections(c, parent_index)
 
 		if (len(parents) != 1):
 			return print_and_create_return_object("ERROR", f"Can only export cells with 1 parent. {c.name} has {len(parents)}. Aborting!")
@@ -125,17 +143,17 @@ def save(context,
 
 		exporting_specific_cells_only = True
 		for collection in selected_collections:
-			if not is_cell_collection(collection):
+			if not is_cell_collection(collection, parent_index):
 				return print_and_create_return_object("ERROR", "All selected collections must represent cells! Aborting!")
 			else:
-				parents = get_parent_collections(collection)
+				parents = get_parent_collections(collection, parent_index)
 				if (len(parents) != 1):
 					return print_and_create_return_object("ERROR", f"Can only export cells with 1 parent. {collection.name} has {len(parents)}. Aborting!")
 				else:
 					parent = parents[0]
 					if parent != pob:
 						return print_and_create_return_object("ERROR", f"Can only export cells with the smae parent! Aborting!")
-	elif is_main_pob_collection(c):
+	elif is_main_pob_collection(c, parent_index):
 		pob = c
 	else:
 		return print_and_create_return_object("ERROR", f"Selected collection '{c.name}' is neither a main POB or a cell collection within a POB! Aborting!")
@@ -155,9 +173,9 @@ def save(context,
 	dirname = os.path.dirname(filepath)
 	fullpath = os.path.join(dirname, pob.name+".pob")
 	extract_dir=context.preferences.addons[__package__].preferences.swg_root
-	return export_one(fullpath, extract_dir, pob, (selected_collections if exporting_specific_cells_only else None), flip_uv_vertical, export_children, use_imported_crc)
+	return export_one(fullpath, extract_dir, pob, (selected_collections if exporting_specific_cells_only else None), flip_uv_vertical, export_children, use_imported_crc, incremental, apply_modifiers)
 
-def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip_uv_vertical, export_children, use_imported_crc):
+def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip_uv_vertical, export_children, use_imported_crc, incremental=True, apply_modifiers=False):
 	root = os.path.dirname(os.path.dirname(fullpath))
 
 	pobFile = swg_types.PobFile(fullpath)
@@ -177,8 +195,8 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 	#portalCol = None
 	#pathgraphCol = None
 	portalObjs = []
+	portal_ids = {}
 	cells = []
-	center_by_cell={}
 	avg_of_path_nodes={}
 	
 	for child in collection.children:
@@ -186,13 +204,22 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 		for grandchild in child.children:
 			if grandchild.name.startswith("Portals_"):
 				for obj in grandchild.objects:
-					if (obj not in portalObjs) and (obj.type == 'MESH'):
+					if (obj not in portal_ids) and (obj.type == 'MESH'):
 						idtl = support.obj_to_idtl(obj)
 						pobFile.portals.append(swg_types.Portal(idtl.verts, idtl.indexes))
+						portal_ids[obj] = len(portalObjs)
 						portalObjs.append(obj)
 
 	portal_connections={}
 	clockwise_by_portal={}
+	# Phase one gathers everything from Blender; the child files are then written
+	# together by run_export_jobs, in worker processes where possible.
+	jobs=[]
+	# Cells whose content and files match this are skipped; see export_manifest
+	manifest = export_manifest.ExportManifest(fullpath, incremental).load()
+	exported_cells=[]
+	# Each mesh is read once for hashing, extents and extraction alike
+	session = export_msh.ExportSession(apply_modifiers=apply_modifiers)
 
 	if len(cells) > 0:
 		for cell_id, cellCol in enumerate(cells): 
@@ -213,13 +240,29 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 			if cell_id == 0:
 				can_see_parent = False
 
+			exporting_cell = specific_cells_to_export == None or (cellCol in specific_cells_to_export)
+			unchanged = False
+			cell_failed = False
+			cell_outputs = []
+			if exporting_cell:
+				# Portal ids are global, so the floor also depends on where the cell's portals sit in portalObjs
+				cell_content = export_manifest.hash_objects(cellCol.all_objects, collection.name, name, export_children,
+					[portal_ids[obj] for obj in cellCol.all_objects if obj in portal_ids], session=session)
+				unchanged = manifest.is_current(name, cell_content)
+				if unchanged:
+					print(f"Cell {cellCol.name} is unchanged since its last export. Skipping its appearance and floor")
+
 			for child in cellCol.children:
 				if child.name.startswith("Appearance_"):
 					referencePath = f'appearance/lod/{collection.name}_{name}.lod'
 					fullLodPath = f'{root}/{referencePath}'
-					center_by_cell[cell_id] = export_lod.avg_vert_position_in_blender(child)
-					if export_children and (specific_cells_to_export == None or (cellCol in specific_cells_to_export)):
-						result = export_as_lod(child, extract_dir, fullLodPath )
+					if export_children and exporting_cell and not unchanged:
+						lod_jobs = export_lod.extract(fullLodPath, extract_dir, child, True, True, outputs=cell_outputs, session=session)
+						if lod_jobs == None:
+							print(f"Error exporting appearance for cell {cellCol.name}: {child.name}. It won't be recorded as exported")
+							cell_failed = True
+						else:
+							jobs.extend(lod_jobs)
 				elif child.name.startswith("Collision_"):
 					collision = support.create_extents_from_collection(child)
 					print(f"Cell: {cellCol.name} has collision collection: {child.name}")
@@ -239,14 +282,15 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 						if obj.type != 'MESH':
 							continue
 						
-						if obj in portalObjs:						
-							pid = get_global_portal_id(portalObjs, obj)
+						if obj in portal_ids:
+							pid = portal_ids[obj]
 							thisCellsPortals.append([obj, pid])
 							if not pid in portal_connections:
 								portal_connections[pid] = []
 							portal_connections[pid].append(cell_id)
 						else:
 							print(f"Error! Cell: {cellCol.name} Portal: {obj.name} is NOT in global Portals collection.")
+							session.close()
 							return {'status':'ERROR', 'message': f"2Cell: {cellCol.name} Portal: {obj.name} is NOT in global Portals collection."}
  
 				else:
@@ -256,36 +300,35 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 				if child.name.startswith("Appearance_"):
 					referencePath = f'appearance/mesh/{collection.name}_{name}_mesh_r{cell_id}.msh'
 					fullMshPath = f'{root}/{referencePath}'
-					center_by_cell[cell_id] = export_msh.avg_vert_position_in_blender(child)
-					if export_children and (specific_cells_to_export == None or (cellCol in specific_cells_to_export)):
-						result = export_as_msh(child, extract_dir, fullMshPath)
+					if export_children and exporting_cell and not unchanged:
+						cell_outputs.append(fullMshPath)
+						jobs.append((export_msh.write, (export_msh.extract(fullMshPath, extract_dir, child, True, session), fullMshPath), None))
 				elif child.name.startswith("Floor_"):
 					flrObj = child
 
 			if referencePath == None:
 				print(f"ERROR: Can't proceed because cell: {cellCol.name} has no Appearance object!")
+				session.close()
 				return {'status':'ERROR', 'message':f"ERROR: Can't proceed because cell: {cellCol.name} has no Appearance object!"}
 
-			if flrObj != None and (specific_cells_to_export == None or (cellCol in specific_cells_to_export)):
+			if flrObj != None and exporting_cell and unchanged:
+				floorFile=f'appearance/collision/{collection.name}_{name}_collision_floor0.flr'
+				avg_of_path_nodes[cell_id] = Vector(manifest.get(name, 'path_average', [0,0,0]))
+			elif flrObj != None and exporting_cell:
 				floorFile=f'appearance/collision/{collection.name}_{name}_collision_floor0.flr'
 				passablePortals = [x for x in thisCellsPortals if is_portal_passable(x[0])]
-				result, flr = export_flr.export_one(f'{root}/{floorFile}', flrObj, passablePortals, False)
+				flr, content = export_flr.extract_floor(flrObj, passablePortals, apply_modifiers=apply_modifiers)
 
-				# After we export the flr, the pathgraph will have been updated properly, so find the avg location of its
-				# nodes for our building pathgraph later
-				position = Vector()
-				if len(flr.pathGraph.nodes) > 0:
-					for node in flr.pathGraph.nodes:
-						position += Vector(node.position)
-					position = position / len(flr.pathGraph.nodes)
-
-				avg_of_path_nodes[cell_id] = position				
-
-				if 'FINISHED' not in result:
+				if flr == None:
 					print(f"Error exporting floor for cell {cellCol.name}: {flrObj.name}")
+					session.close()
 					return {'status':"ERROR", 'message':f"Error exporting floor for cell {cellCol.name}: {flrObj.name}"}
 				else:
-					print(f'Wrote floor file: {str(flr)}')
+					cell_outputs.append(f'{root}/{floorFile}')
+					# Once the floor is written its pathgraph is complete, and _floor_written records the avg location
+					# of its nodes for our building pathgraph later
+					jobs.append((export_flr.write_floor, (flr, f'{root}/{floorFile}', [x[1] for x in passablePortals], [x[0].name for x in passablePortals]),
+						functools.partial(_floor_written, avg_of_path_nodes, cell_id, flrObj.name, content)))
 					for tri in flr.tris:
 						if tri.portalId1 != -1:
 							pid = thisCellsPortals[tri.portalId1][1]
@@ -304,24 +347,37 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 				#return {'status':"ERROR", 'message':f"Error! cell {cell_id} ({cellCol.name}) has no floor!"}
 				avg_of_path_nodes[cell_id] = Vector([0,0,0])
 
-			for portal in thisCellsPortals:
-				for pi, portalObj in enumerate(portalObjs):
-					if portal[0] == portalObj:
-						if pi not in clockwise_by_portal:
-							clockwise_by_portal[pi] = cell_id
-
-						doorstyle = None
-						doorHp = None
-						children = support.getChildren(portalObj)
-						if len(children) == 1 and children[0].type == 'EMPTY' and children[0].empty_display_type == 'ARROWS':
-							ob = children[0]
-							doorstyle = ob['doorstyle']
-							doorHp = support.hardpoint_from_obj(ob)[0:12] # skip the last element, which is the hp name used for LODs
-						
-						portalData.append(swg_types.PortalData(pi, True, is_portal_passable(portalObj), -1, doorstyle, doorHp))
+			for portalObj, pi in thisCellsPortals:
+				if pi not in clockwise_by_portal:
+					clockwise_by_portal[pi] = cell_id
+
+				doorstyle = None
+				doorHp = None
+				children = support.getChildren(portalObj)
+				if len(children) == 1 and children[0].type == 'EMPTY' and children[0].empty_display_type == 'ARROWS':
+					ob = children[0]
+					doorstyle = ob['doorstyle']
+					doorHp = support.hardpoint_from_obj(ob)[0:12] # skip the last element, which is the hp name used for LODs
+				
+				portalData.append(swg_types.PortalData(pi, True, is_portal_passable(portalObj), -1, doorstyle, doorHp))
 
 			cell = swg_types.Cell(cellCol.name, can_see_parent, portalData, referencePath, floorFile, collision, lightDatas)
 			pobFile.cells.append(cell)
+
+			if exporting_cell and not unchanged and not cell_failed:
+				exported_cells.append((cell_id, name, cell_content, cell_outputs))
+
+	session.close()
+	print(f"Writing {len(jobs)} cell files ...")
+	support.run_export_jobs(jobs)
+
+	for cell_id, name, cell_content, cell_outputs in exported_cells:
+		if not all(os.path.isfile(path) for path in cell_outputs):
+			print(f"Warning! Not every file for cell {name} was written. It won't be recorded as exported")
+			continue
+		manifest.update(name, cell_content, cell_outputs, path_average=list(avg_of_path_nodes[cell_id]))
+	manifest.save()
+
 	if (specific_cells_to_export == None):
 		print(f"Processing connecting cells with portal_connections: {str(portal_connections)}")
 		print(f"clockwise_by_portal: {clockwise_by_portal}")
@@ -399,11 +455,10 @@ def export_one(fullpath, extract_dir, collection, specific_cells_to_export, flip
 	print(f"Successfully wrote: {fullpath} Duration: " + str(datetime.timedelta(seconds=(now-start))))
 	return {'status':'FINISHED'}
 
-def export_as_lod(collection, extract_dir, path):
-	return export_lod.export_one(path, extract_dir, collection, True, True)
-
-def export_as_msh(child, extract_dir, path):
-	return export_msh.export_one(path, extract_dir, child, True)
+def _floor_written(avg_of_path_nodes, cell_id, name, content, result):
+	average, visibility = result
+	avg_of_path_nodes[cell_id] = Vector(average) if average != None else Vector()
+	export_flr.store_visibility(name, content, visibility)
 
 def determine_if_portal_points_into_cell(portalObj, flrObj, testVertindex):
 	poralMesh = portalObj.to_mesh() 
@@ -419,12 +474,6 @@ def determine_if_portal_points_into_cell(portalObj, flrObj, testVertindex):
 	#print(f" pointOnPortal: {pointOnPortal}  Normal: {norm} pointOnFloorTri: {pointOnFloorTri} Dot: {dot}")
 	return dot > 0
 
-def get_global_portal_id(portalObjs, portal):
-	for pid, p in enumerate(portalObjs):
-		if portal == p:
-			return pid
-	return None
-
 def is_portal_passable(obj):
 	if obj.type != 'MESH':
 		return False
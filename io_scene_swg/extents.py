@@ -2,6 +2,45 @@ from . import nsg_iff
 from . import vector3D
 from . import swg_types
 from mathutils import Vector
+import numpy as np
+
+def bounding_sphere(points):
+    """Near-minimal sphere around points, an (n, 3) array, as (center, radius).
+    Ritter's method: start from the most separated pair of axis extremes, then grow
+    the sphere just enough to take in the farthest point outside it until none are."""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    extremes = points[np.concatenate([points.argmin(axis=0), points.argmax(axis=0)])]
+    separation = ((extremes[:, None, :] - extremes[None, :, :]) ** 2).sum(axis=2)
+    i, j = np.unravel_index(separation.argmax(), separation.shape)
+    center = (extremes[i] + extremes[j]) / 2.0
+    radius = np.sqrt(separation[i, j]) / 2.0
+
+    for _ in range(64):
+        distances = np.sqrt(((points - center) ** 2).sum(axis=1))
+        farthest = distances.argmax()
+        if distances[farthest] <= radius:
+            break
+        # The new sphere touches the farthest point and the far side of the old one
+        grown = (radius + distances[farthest]) / 2.0
+        center = center + (points[farthest] - center) * ((grown - radius) / distances[farthest])
+        radius = grown
+    else:
+        radius = np.sqrt(((points - center) ** 2).sum(axis=1)).max()
+
+    return center.tolist(), float(radius)
+
+def merge_spheres(a, b):
+    """Smallest sphere around two (center, radius) spheres."""
+    (ca, ra), (cb, rb) = a, b
+    offset = np.asarray(cb, dtype=np.float64) - np.asarray(ca, dtype=np.float64)
+    distance = float(np.sqrt((offset ** 2).sum()))
+    if distance + rb <= ra:
+        return a
+    if distance + ra <= rb:
+        return b
+    radius = (distance + ra + rb) / 2.0
+    center = np.asarray(ca, dtype=np.float64) + offset * ((radius - ra) / distance)
+    return center.tolist(), radius
 
 class Extents():
     def __init__(self):
@@ -37,6 +76,24 @@ class Extents():
         if extent == None:
             extent = NullExtents()
         extent.write(iff)
+
+    def bounds(extent):
+        """Axis aligned [min, max] (SWG space) around any extent, or None if it has no volume"""
+        if extent == None or not hasattr(extent, "getBounds"):
+            return None
+        return extent.getBounds()
+
+def _xyz(v):
+    if hasattr(v, "x"):
+        return [v.x, v.y, v.z]
+    return [v[0], v[1], v[2]]
+
+def _union(all_bounds):
+    all_bounds = [b for b in all_bounds if b != None]
+    if len(all_bounds) == 0:
+        return None
+    return [[min(b[0][i] for b in all_bounds) for i in range(3)],
+            [max(b[1][i] for b in all_bounds) for i in range(3)]]
             
 class NullExtents(Extents):
     def __init__(self):
@@ -46,14 +103,19 @@ class NullExtents(Extents):
         iff.insertForm("NULL")
         iff.exitForm("NULL")
 
+    def getBounds(self):
+        return None
+
 class BoxExtents(Extents):
     def __init__(self):
         self.min = [0, 0, 0]
         self.max = [0, 0, 0]
 
-    def __init__(self, min, max):
+    def __init__(self, min, max, sphere=None):
         self.min = min
         self.max = max
+        # (center, radius) written as the EXSP. Without one, the box's half-diagonal is used
+        self.sphere = sphere
 
     def create(iff):
 
@@ -79,11 +141,7 @@ class BoxExtents(Extents):
         iff.insertForm("EXSP")
         iff.insertForm("0001")
         iff.insertChunk("SPHR")
-        max = Vector(self.max)
-        min = Vector(self.min)
-        center = (max + min) / 2.0
-        diff = (max - min) / 2.0
-        rad = diff.magnitude
+        center, rad = self.getSphere()
         iff.insertFloatVector3(center[:])
         iff.insertFloat(rad)
         iff.exitChunk("SPHR")
@@ -106,6 +164,27 @@ class BoxExtents(Extents):
     def getSize(self):
         return [abs(self.max.x - self.min.x)/2, abs(self.max.y - self.min.y)/2, abs(self.max.z - self.min.z)/2]
 
+    def getBounds(self):
+        # Min and max aren't reliably ordered in the file, so sort them per axis
+        a = _xyz(self.min)
+        b = _xyz(self.max)
+        return [[min(a[i], b[i]) for i in range(3)], [max(a[i], b[i]) for i in range(3)]]
+
+    def getSphere(self):
+        if self.sphere != None:
+            return self.sphere
+        max = Vector(self.max)
+        min = Vector(self.min)
+        return (max + min) / 2.0, ((max - min) / 2.0).magnitude
+
+    def fitSphere(self, points):
+        """Use a tight sphere around points (SWG space) for the EXSP, unless the
+        box's own half-diagonal sphere happens to be smaller."""
+        self.sphere = None
+        sphere = bounding_sphere(points)
+        if sphere[1] < self.getSphere()[1]:
+            self.sphere = sphere
+
     def fromCenterAndScale(self, center, scale): 
         self.min = center - scale
         self.max = center + scale
@@ -131,6 +210,13 @@ class BoxExtents(Extents):
         if other.max[2] > self.max[2]:
             self.max[2] = other.max[2]
 
+        if self.sphere != None and other.sphere != None:
+            self.sphere = merge_spheres(self.sphere, other.sphere)
+            if self.sphere[1] >= BoxExtents(self.min, self.max).getSphere()[1]:
+                self.sphere = None
+        else:
+            self.sphere = None
+
 class SphereExtents(Extents):
     def __init__(self, center, radius):
         self.center = center
@@ -158,6 +244,10 @@ class SphereExtents(Extents):
         iff.exitForm("0001")
         iff.exitForm("EXSP")
 
+    def getBounds(self):
+        c = _xyz(self.center)
+        return [[v - self.radius for v in c], [v + self.radius for v in c]]
+
 
 class CylinderExtent(Extents):
     def __init__(self, base, radius, height):
@@ -189,6 +279,10 @@ class CylinderExtent(Extents):
         iff.exitForm("0000")
         iff.exitForm("XCYL")
 
+    def getBounds(self):
+        b = _xyz(self.base)
+        return [[b[0] - self.radius, b[1], b[2] - self.radius], [b[0] + self.radius, b[1] + self.height, b[2] + self.radius]]
+
 
 class CompositeExtent (Extents):
 
@@ -216,6 +310,9 @@ class CompositeExtent (Extents):
     def __init__(self):
         self.extents = []
 
+    def getBounds(self):
+        return _union([Extents.bounds(e) for e in self.extents])
+
 class ComponentExtent(Extents):
 
     def create(iff):
@@ -240,6 +337,9 @@ class ComponentExtent(Extents):
         iff.exitForm("0000")
         iff.exitForm("CMPT")
 
+    def getBounds(self):
+        return Extents.bounds(self.extent)
+
 class DetailExtent(Extents):
 
     def create(iff):
@@ -276,6 +376,9 @@ class DetailExtent(Extents):
         iff.exitForm("0000")
         iff.exitForm("DTAL")
 
+    def getBounds(self):
+        return _union([Extents.bounds(self.broad_extent), Extents.bounds(self.extents)])
+
 
 class MeshExtent(object):
 
@@ -310,3 +413,8 @@ class MeshExtent(object):
         iff.exitForm("0000")
         iff.exitForm("CMSH")
 
+    def getBounds(self):
+        if len(self.verts) == 0:
+            return None
+        verts = [_xyz(v) for v in self.verts]
+        return [[min(v[i] for v in verts) for i in range(3)], [max(v[i] for v in verts) for i in range(3)]]
@@ -0,0 +1,315 @@
+# MIT License
+#
+# Copyright (c) 2022 Nick Rafalski
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math, heapq
+import numpy as np
+import bpy
+
+from . import export_msh
+
+def screen_space_error(distance, pixel_error, screen_height, fov):
+	"""World size of pixel_error pixels at distance, for a vertical fov (radians) spread over screen_height pixels."""
+	return pixel_error * 2.0 * distance * math.tan(fov / 2.0) / screen_height
+
+def _sub(a, b):
+	return (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+
+def _cross(a, b):
+	return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def _dot(a, b):
+	return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+class QuadricDecimator(object):
+	"""Garland-Heckbert quadric error decimation by half-edge collapses: a vertex is
+	always merged into one of its neighbours, so surviving vertices keep their exact
+	position and every corner keeps the attributes of some original corner.
+
+	wedges gives each corner (triangle * 3 + k) an id that is equal for corners with
+	identical attributes (UVs, colours, normal, material). Edges where wedges differ across
+	the two triangles are UV seams, hard edges or material borders; together with
+	open boundaries they are feature edges. Vertices on a feature line may only slide
+	along it, and the line is held in place by constraint quadrics, so seams and
+	material borders survive decimation."""
+
+	FEATURE_WEIGHT = 100.0
+	# Reject collapses that turn a triangle more than ~80 degrees
+	MIN_NORMAL_COS = 0.2
+
+	def __init__(self, positions, triangles, wedges):
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+		triangles = np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+		self.positions = positions.tolist()
+		self.tris = triangles.tolist()
+		self.corners = np.arange(len(triangles) * 3).reshape(-1, 3).tolist()
+		self.wedges = np.asarray(wedges).ravel().tolist()
+		self.alive = [True] * len(self.tris)
+		self.triangle_count = len(self.tris)
+		self.vtris = [set() for _ in range(len(self.positions))]
+		for t, tri in enumerate(self.tris):
+			for v in tri:
+				self.vtris[v].add(t)
+
+		# One plane quadric per triangle, unweighted, so sqrt(cost) bounds the distance
+		# from a collapsed vertex to any of the original planes it represents
+		corners = positions[triangles]
+		normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+		lengths = np.linalg.norm(normals, axis=1)
+		normals = np.divide(normals, lengths[:, None], out=np.zeros_like(normals), where=lengths[:, None] > 0)
+		planes = np.column_stack([normals, -(normals * corners[:, 0]).sum(axis=1)])
+		face_quadrics = planes[:, :, None] * planes[:, None, :]
+		self.quadrics = np.zeros((len(self.positions), 4, 4))
+		for k in range(3):
+			np.add.at(self.quadrics, triangles[:, k], face_quadrics)
+
+		for t, tri in enumerate(self.tris):
+			for k in range(3):
+				a, b = tri[k], tri[(k + 1) % 3]
+				if self._is_feature_edge(a, b):
+					edge = positions[b] - positions[a]
+					normal = np.cross(edge, normals[t])
+					length = np.linalg.norm(normal)
+					if length == 0:
+						continue
+					normal /= length
+					plane = np.append(normal, -normal.dot(positions[a]))
+					quadric = QuadricDecimator.FEATURE_WEIGHT * np.outer(plane, plane)
+					self.quadrics[a] += quadric
+					self.quadrics[b] += quadric
+
+		self.heap = []
+		edges = set()
+		for tri in self.tris:
+			for k in range(3):
+				edges.add((tri[k], tri[(k + 1) % 3]))
+				edges.add((tri[(k + 1) % 3], tri[k]))
+		if len(edges) > 0:
+			directed = np.array(sorted(edges), dtype=np.int64)
+			points = np.column_stack([positions[directed[:, 1]], np.ones(len(directed))])
+			combined = self.quadrics[directed[:, 0]] + self.quadrics[directed[:, 1]]
+			costs = np.maximum(np.einsum('ni,nij,nj->n', points, combined, points), 0.0)
+			self.heap = list(zip(costs.tolist(), directed[:, 0].tolist(), directed[:, 1].tolist()))
+			heapq.heapify(self.heap)
+
+	def _corner(self, t, v):
+		return self.corners[t][self.tris[t].index(v)]
+
+	def _neighbours(self, v):
+		return {w for t in self.vtris[v] for w in self.tris[t] if w != v}
+
+	def _is_feature_edge(self, a, b):
+		shared = self.vtris[a] & self.vtris[b]
+		if len(shared) != 2:
+			return True
+		t1, t2 = shared
+		return (self.wedges[self._corner(t1, a)] != self.wedges[self._corner(t2, a)] or
+			self.wedges[self._corner(t1, b)] != self.wedges[self._corner(t2, b)])
+
+	def _cost(self, v, u):
+		p = np.append(self.positions[u], 1.0)
+		return max(float(p @ (self.quadrics[u] + self.quadrics[v]) @ p), 0.0)
+
+	def _collapse_plan(self, v, u):
+		"""How triangles around v would be rewritten by merging v into u: a list of
+		(triangle, corner) giving the corner of u each keeps. None if it isn't allowed."""
+		shared = self.vtris[v] & self.vtris[u]
+		if len(shared) == 0:
+			return None
+
+		# Link condition: anything else connected to both would make the mesh non-manifold
+		third = {w for t in shared for w in self.tris[t] if w != u and w != v}
+		if (self._neighbours(v) & self._neighbours(u)) != third:
+			return None
+
+		features = [w for w in self._neighbours(v) if self._is_feature_edge(v, w)]
+		if len(features) > 0 and (len(features) != 2 or u not in features):
+			return None
+
+		# Each attribute island of v must touch the edge, which tells us u's attributes there
+		mapping = {}
+		for t in shared:
+			wedge = self.wedges[self._corner(t, v)]
+			corner = self._corner(t, u)
+			if mapping.get(wedge, corner) != corner and self.wedges[mapping[wedge]] != self.wedges[corner]:
+				return None
+			mapping[wedge] = corner
+
+		target = self.positions[u]
+		plan = []
+		for t in self.vtris[v] - shared:
+			wedge = self.wedges[self._corner(t, v)]
+			if wedge not in mapping:
+				return None
+			points = [self.positions[w] for w in self.tris[t]]
+			before = _cross(_sub(points[1], points[0]), _sub(points[2], points[0]))
+			points[self.tris[t].index(v)] = target
+			after = _cross(_sub(points[1], points[0]), _sub(points[2], points[0]))
+			scale = math.sqrt(_dot(before, before) * _dot(after, after))
+			if scale == 0 or _dot(before, after) < QuadricDecimator.MIN_NORMAL_COS * scale:
+				return None
+			plan.append((t, mapping[wedge]))
+		return plan
+
+	def _collapse(self, v, u, plan):
+		for t in self.vtris[v] & self.vtris[u]:
+			self.alive[t] = False
+			self.triangle_count -= 1
+			for w in self.tris[t]:
+				self.vtris[w].discard(t)
+		for t, corner in plan:
+			k = self.tris[t].index(v)
+			self.tris[t][k] = u
+			self.corners[t][k] = corner
+			self.vtris[u].add(t)
+		self.vtris[v] = set()
+		self.quadrics[u] += self.quadrics[v]
+
+		for w in self._neighbours(u):
+			heapq.heappush(self.heap, (self._cost(w, u), w, u))
+			heapq.heappush(self.heap, (self._cost(u, w), u, w))
+
+	def simplify(self, max_error):
+		"""Collapse edges, cheapest first, while the error stays within max_error
+		(world units). Can be called again with a larger max_error to continue."""
+		limit = max_error * max_error
+		while len(self.heap) > 0 and self.heap[0][0] <= limit:
+			cost, v, u = heapq.heappop(self.heap)
+			if len(self.vtris[v]) == 0 or len(self.vtris[u]) == 0:
+				continue
+			current = self._cost(v, u)
+			if current > cost + 1e-12:
+				# One end has absorbed a neighbour since this was queued
+				heapq.heappush(self.heap, (current, v, u))
+				continue
+			plan = self._collapse_plan(v, u)
+			if plan != None:
+				self._collapse(v, u, plan)
+
+	def result(self):
+		"""(original triangle ids, vertex ids, corner ids) of the surviving triangles."""
+		faces = [t for t, alive in enumerate(self.alive) if alive]
+		return (np.array(faces, dtype=np.int64),
+			np.array([self.tris[t] for t in faces], dtype=np.int64).reshape(-1, 3),
+			np.array([self.corners[t] for t in faces], dtype=np.int64).reshape(-1, 3))
+
+def _read(collection, attr, width=1, dtype=np.float64):
+	data = np.empty(len(collection) * width, dtype=dtype)
+	collection.foreach_get(attr, data)
+	return data.reshape(-1, width) if width > 1 else data
+
+def generate_lods(context, obj, distances, *, pixel_error=1.0, screen_height=1080, fov=math.radians(60.0)):
+	"""Build a LOD chain from obj (LOD0). distances are the 'distance' of LOD0 and of
+	each level after it. Level i is first drawn at distances[i-1], so it is decimated
+	until its error would exceed pixel_error pixels there; a level that can't lose
+	any triangles within that budget is skipped and the previous level covers its
+	range. Levels generated from obj before are reused, and any left over are
+	removed. Returns [(object, triangle count)], starting with obj."""
+	depsgraph = context.evaluated_depsgraph_get()
+	evaluated = obj.evaluated_get(depsgraph)
+	me = evaluated.to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
+	export_msh.mesh_triangulate(me)
+	me.calc_normals_split()
+
+	positions = _read(me.vertices, "co", 3)
+	vertex_index = _read(me.loops, "vertex_index", dtype=np.int64)
+	normals = _read(me.loops, "normal", 3)
+	loop_start = _read(me.polygons, "loop_start", dtype=np.int64)
+	materials = _read(me.polygons, "material_index", dtype=np.int64)
+	uvs = [(layer.name, _read(layer.data, "uv", 2)) for layer in me.uv_layers]
+	colors = [(layer.name, _read(layer.data, "color", 4)) for layer in me.vertex_colors]
+	evaluated.to_mesh_clear()
+
+	# Corner t * 3 + k is loop corner_loops[t, k]
+	corner_loops = (loop_start[:, None] + np.arange(3)).ravel()
+	keys = [materials.repeat(3)[:, None], np.round(normals[corner_loops], 4)]
+	keys.extend(np.round(uv[corner_loops], 4) for name, uv in uvs)
+	keys.extend(np.round(color[corner_loops], 4) for name, color in colors)
+	wedges = np.unique(np.hstack(keys), axis=0, return_inverse=True)[1].ravel()
+
+	print(f"Generating LODs for {obj.name}: {len(materials)} triangles")
+	decimator = QuadricDecimator(positions, vertex_index[corner_loops].reshape(-1, 3), wedges)
+	# Earlier results for obj, by level
+	previous = {o['lod_level']: o for o in bpy.data.objects if o.get('lod_source') == obj.name and o != obj and 'lod_level' in o}
+	obj['distance'] = distances[0]
+	levels = [(obj, len(materials))]
+	for i in range(1, len(distances)):
+		budget = screen_space_error(distances[i - 1], pixel_error, screen_height, fov)
+		decimator.simplify(budget)
+		faces, triangles, corners = decimator.result()
+		if len(faces) >= levels[-1][1]:
+			print(f"Level for distance {distances[i]}: nothing to remove within {budget:.4f}m. Extending {levels[-1][0].name} instead")
+			levels[-1][0]['distance'] = distances[i]
+			continue
+
+		name = f"{obj.name}_l{len(levels)}"
+		print(f"Level {len(levels)} ({name}): {len(faces)} triangles, max error {budget:.4f}m, distance {distances[i]}")
+		mesh = build_mesh(f"{name}-mesh", obj, positions, triangles, corner_loops[corners], materials[faces], normals, uvs, colors)
+		lod = previous.pop(len(levels), None)
+		if lod != None:
+			_replace_mesh(lod, mesh)
+			lod.name = name
+		else:
+			lod = bpy.data.objects.new(name, mesh)
+			for collection in obj.users_collection:
+				collection.objects.link(lod)
+		lod.parent = obj.parent
+		lod.matrix_world = obj.matrix_world.copy()
+		lod['distance'] = distances[i]
+		lod['lod_source'] = obj.name
+		lod['lod_level'] = len(levels)
+		levels.append((lod, len(faces)))
+
+	for lod in previous.values():
+		print(f"Removing {lod.name}, left over from an earlier LOD generation")
+		mesh = lod.data
+		bpy.data.objects.remove(lod, do_unlink=True)
+		if mesh.users == 0:
+			bpy.data.meshes.remove(mesh)
+	return levels
+
+def _replace_mesh(obj, mesh):
+	old = obj.data
+	obj.data = mesh
+	if old.users == 0:
+		bpy.data.meshes.remove(old)
+
+def build_mesh(name, obj, positions, triangles, loops, materials, normals, uvs, colors):
+	"""A mesh of triangles over positions, whose corners take their UVs, colours and
+	split normals from the given loops of the source mesh."""
+	used, remapped = np.unique(triangles, return_inverse=True)
+	mesh = bpy.data.meshes.new(name)
+	mesh.from_pydata(positions[used].tolist(), [], remapped.reshape(-1, 3).tolist())
+	mesh.polygons.foreach_set("material_index", materials)
+	for material in obj.data.materials:
+		mesh.materials.append(material)
+
+	# from_pydata makes loop k of polygon t number t * 3 + k, the same order as loops
+	loops = loops.ravel()
+	for layer_name, uv in uvs:
+		mesh.uv_layers.new(name=layer_name).data.foreach_set("uv", uv[loops].ravel())
+	for layer_name, color in colors:
+		mesh.vertex_colors.new(name=layer_name).data.foreach_set("color", color[loops].ravel())
+
+	mesh.use_auto_smooth = True
+	mesh.normals_split_custom_set(normals[loops].tolist())
+	mesh.update()
+	return mesh
@@ -28,9 +28,11 @@ from mathutils import Vector
 from .swg_types import FloorEdgeType, FloorFile
 from .support import convert_vector3, create_pathgraph
 
-def import_flr(context, filepath, collection=None):
-    flr = FloorFile(filepath)
-    flr.load()
+def import_flr(context, filepath, collection=None, session=None):
+    flr = session.take(filepath) if session is not None else None
+    if flr is None:
+        flr = FloorFile(filepath)
+        flr.load()
 
     name = os.path.basename(filepath).rsplit(".", 1)[0]
     mesh = bpy.data.meshes.new(name=f'{name}-mesh')
@@ -48,24 +50,25 @@ def import_flr(context, filepath, collection=None):
     for vert in flr.verts:
         verts.append(Vector(convert_vector3([vert[0], vert[1], vert[2]])))
 
-    for tri in flr.tris:
-        tris.append([tri.corner1, tri.corner3, tri.corner2])
+    tri_array = flr.tri_array()
+    for (c1, c2, c3), (e1, e2, e3) in zip(tri_array['corners'].tolist(), tri_array['edgeTypes'].tolist()):
+        tris.append([c1, c3, c2])
 
-        edges.append([tri.corner1, tri.corner2])
-        edge_types[frozenset((tri.corner1, tri.corner2))] = tri.edgeType1
+        edges.append([c1, c2])
+        edge_types[frozenset((c1, c2))] = e1
 
-        edges.append([tri.corner2, tri.corner3])
-        edge_types[frozenset((tri.corner2, tri.corner3))] = tri.edgeType2
+        edges.append([c2, c3])
+        edge_types[frozenset((c2, c3))] = e2
 
-        edges.append([tri.corner3, tri.corner1])
-        edge_types[frozenset((tri.corner3, tri.corner1))] = tri.edgeType3
+        edges.append([c3, c1])
+        edge_types[frozenset((c3, c1))] = e3
 
     mesh.from_pydata(verts, edges, tris)
     mesh.update()
     mesh.validate()
 
     face_map = obj.face_maps.new(name="fallthrough")
-    face_map.add([x.index for x in flr.tris if x.fallthrough])
+    face_map.add(tri_array['index'][tri_array['fallthrough'] != 0].tolist())
 
     for edge in mesh.edges:
         edge_type = edge_types[frozenset(edge.vertices)]
@@ -86,6 +89,7 @@ def import_flr(context, filepath, collection=None):
     bm.free()
 
     if flr.pathGraph is not None:
+        flr.validate()
         create_pathgraph(collection, flr.pathGraph, obj, True)
 
     return obj
\ No newline at end of file
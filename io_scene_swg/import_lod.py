@@ -42,14 +42,26 @@ def load_new(context,
              flip_uv_vertical=False,
              remove_duplicate_verts=True,
              do_floor=True,
-             do_collision=True
+             do_collision=True,
+             session=None,
+             lazy_lods=False,
+             detail_level=0
              ):  
 
     s=context.preferences.addons[__package__].preferences.swg_root
-     
-    lodFile = swg_types.LodFile(filepath)
-    if not lodFile.load(filepath):
-        return {'CANCELLED'}
+
+    owns_session = session == None
+    if owns_session:
+        session = import_msh.ImportSession(s, lod_floors=do_floor)
+    session.prefetch(filepath)
+
+    lodFile = session.take(filepath)
+    if lodFile == None:
+        lodFile = swg_types.LodFile(filepath)
+        if not lodFile.load(filepath):
+            if owns_session:
+                session.close()
+            return {'CANCELLED'}
     
         
     name=os.path.basename(filepath).rsplit( ".", 1 )[ 0 ]
@@ -74,7 +86,7 @@ def load_new(context,
         if lodFile.floor != None:
             floor_path = support.find_file(lodFile.floor, s)
             if floor_path:
-                flr = import_flr.import_flr(context, floor_path, collection=floorCol ) 
+                flr = import_flr.import_flr(context, floor_path, collection=floorCol, session=session)
             else:
                 print(f"Didn't find floor_file: {lodFile.floor}")
 
@@ -89,15 +101,22 @@ def load_new(context,
         support.add_rtw_mesh(rtw, lodFile.writeshape, "Write")
 
 
+    if lazy_lods and detail_level not in lodFile.lods and len(lodFile.lods) > 0:
+        print(f"Warning! {name} has no detail level {detail_level}. Importing level {min(lodFile.lods)} instead")
+        detail_level = min(lodFile.lods)
+
     for id, lod in lodFile.lods.items():
         lod[2] = os.path.join("appearance",lod[2])
         file = support.find_file(lod[2], s)
         if file == None:
             print(f"Couldn't find mesh path: {lod[2]}")
             continue
+        elif file.endswith(".msh") and lazy_lods and id != detail_level:
+            print(f"Deferring mesh: {lod[2]}. Materialise it to import it")
+            create_placeholder(lods, file, lod[1], flip_uv_vertical, remove_duplicate_verts)
         elif file.endswith(".msh"):
             print(f"Importing mesh: {lod[2]} from {file}")
-            obj = import_msh.import_msh(context, file, lods, flip_uv_vertical, remove_duplicate_verts, True)
+            obj = import_msh.import_msh(context, file, lods, flip_uv_vertical, remove_duplicate_verts, True, session=session)
             obj['distance'] = lod[1]
         else:
             print(f"Unhandled LOD Child type: {file}")
@@ -110,4 +129,42 @@ def load_new(context,
     for hpnts in lodFile.hardpoints:     
         support.create_hardpoint_obj(hpnts[12], hpnts[0:12], collection = hardpoints)
 
+    if owns_session:
+        session.close()
     return ('SUCCESS', collection)
+
+def create_placeholder(collection, filepath, distance, flip_uv_vertical, remove_duplicate_verts):
+    """An empty standing in for a detail level that hasn't been imported. It keeps
+    everything materialise needs to import the real mesh later."""
+    name = os.path.basename(filepath).rsplit(".", 1)[0]
+    obj = bpy.data.objects.new(name, None)
+    obj.empty_display_type = 'CUBE'
+    obj['distance'] = distance
+    obj['lod_path'] = filepath
+    obj['flip_uv_vertical'] = flip_uv_vertical
+    obj['remove_duplicate_verts'] = remove_duplicate_verts
+    collection.objects.link(obj)
+    return obj
+
+def materialise(context, placeholder, session=None):
+    """Import the mesh a placeholder from create_placeholder stands for, in the same
+    collections and with the same distance, and remove the placeholder."""
+    collections = list(placeholder.users_collection)
+    if len(collections) == 0:
+        collections = [context.collection]
+
+    obj = import_msh.import_msh(context, placeholder['lod_path'], collections[0],
+        bool(placeholder['flip_uv_vertical']), bool(placeholder['remove_duplicate_verts']), True, session=session)
+    if not isinstance(obj, bpy.types.Object):
+        print(f"Error. Couldn't materialise {placeholder.name} from {placeholder['lod_path']}")
+        return None
+
+    for collection in collections[1:]:
+        collection.objects.link(obj)
+    obj['distance'] = placeholder['distance']
+    obj.parent = placeholder.parent
+    obj.matrix_world = placeholder.matrix_world.copy()
+    name = placeholder.name
+    bpy.data.objects.remove(placeholder)
+    obj.name = name
+    return obj
@@ -20,6 +20,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 import bpy, base64
+import numpy as np
 from . import swg_types
 from . import support
 from bpy.props import *
@@ -148,13 +149,22 @@ def import_mgn( context,
             vgs[weight[0]].add([i], weight[1], 'ADD')
     
     scene_object.shape_key_add(name='Basis')
-    for i, blend in enumerate(mgn.blends):
-        sk = scene_object.shape_key_add(name=blend.name)
-        for vert in blend.positions:
-            id = vert[0]
-            delta = [vert[1][0], vert[1][1], -vert[1][2]]
-            delta_v = Vector(delta)
-            sk.data[id].co = scene_object.data.vertices[id].co + (global_matrix @ delta_v)
+    if len(mgn.blends) > 0:
+        basis = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get("co", basis)
+        basis = basis.reshape(-1, 3)
+        rotation = np.array(global_matrix.to_3x3(), dtype=np.float32)
+        translation = np.array(global_matrix.translation, dtype=np.float32)
+        for i, blend in enumerate(mgn.blends):
+            sk = scene_object.shape_key_add(name=blend.name)
+            if len(blend.positions) == 0:
+                continue
+            ids = np.fromiter((vert[0] for vert in blend.positions), dtype=np.int64, count=len(blend.positions))
+            deltas = np.array([vert[1] for vert in blend.positions], dtype=np.float32)
+            deltas[:, 2] = -deltas[:, 2]
+            co = basis.copy()
+            co[ids] += deltas @ rotation.T + translation
+            sk.data.foreach_set("co", co.ravel())
     
     for i, skel in enumerate(mgn.skeletons):
         scene_object[f'SKTM_{i}'] = skel
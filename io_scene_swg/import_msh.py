@@ -22,6 +22,8 @@
 
 import base64, os, bpy, time, datetime, math
 import bmesh
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 from mathutils import Matrix, Vector, Color, Quaternion, Euler
 
 from bpy_extras.io_utils import unpack_list
@@ -59,29 +61,179 @@ def rotate_object(obj, rot_mat):
 	# assemble the new matrix
 	obj.matrix_world = orig_loc_mat @ rot_mat @ orig_rot_mat @ orig_scale_mat
 
+# Threads parsing referenced files during a prefetch. Parsing is mostly waiting
+# on reads, which release the GIL.
+PREFETCH_WORKERS = 8
+TEXTURE_ATTRS = ('main', 'specular', 'normal', 'compressed_normal', 'envm', 'emission', 'detail', 'hueb')
+
+class ImportSession(object):
+	"""State shared by everything one import operation brings in. Meshes are
+	kept by resolved path and the options that shape them, so an MSH referenced
+	by several cells or LODs is parsed and built once, and its other objects
+	are linked duplicates sharing the same bpy.types.Mesh.
+
+	prefetch walks the reference graph below a file (POB cells, APT references,
+	LOD levels, floors, shaders and their textures) and parses the bpy-free
+	swg_types objects on a thread pool, while the main thread creates the
+	datablocks for whatever it has already taken."""
+	def __init__(self, swg_root=None, lazy_lods=False, detail_level=0, lod_floors=True):
+		self.meshes = {}
+		self.swg_root = swg_root
+		# A lazy LOD import only wants one detail level parsed
+		self.lazy_lods = lazy_lods
+		self.detail_level = detail_level
+		# Whether the importer will want each LOD's floor
+		self.lod_floors = lod_floors
+		self._futures = {}
+		self._lock = threading.Lock()
+		self._pool = None
+		self._closed = False
+
+	@staticmethod
+	def resolve(filepath):
+		return os.path.normcase(os.path.realpath(filepath))
+
+	@staticmethod
+	def mesh_key(filepath, flip_uv_vertical, remove_duplicate_verts):
+		return (ImportSession.resolve(filepath), flip_uv_vertical, remove_duplicate_verts)
+
+	def prefetch(self, *filepaths):
+		"""Start parsing filepaths and everything they reference, if not already started."""
+		if self.swg_root == None:
+			return
+		for filepath in filepaths:
+			if filepath:
+				self._submit(filepath)
+
+	def take(self, filepath):
+		"""The prefetched object for filepath, waiting for it if needed. Each parse is
+		handed out once, since importers adjust what they load. None if it was never
+		prefetched or failed to parse; the caller then loads it itself."""
+		with self._lock:
+			future = self._futures.get(ImportSession.resolve(filepath))
+		if future == None:
+			return None
+		try:
+			result = future.result()
+		except Exception as e:
+			print(f"Prefetch of {filepath} failed ({e}), loading it directly")
+			return None
+		with self._lock:
+			# Leave the done future behind, so the file isn't prefetched again
+			self._futures[ImportSession.resolve(filepath)] = _TAKEN
+		return result
+
+	def close(self):
+		with self._lock:
+			# Parses still running mustn't start a new pool through prefetch
+			self._closed = True
+			pool = self._pool
+			self._pool = None
+			futures = list(self._futures.values())
+		if pool != None:
+			# Cancelling each future rather than shutdown(cancel_futures=True), which needs Python 3.9
+			for future in futures:
+				future.cancel()
+			pool.shutdown(wait=False)
+
+	def _submit(self, filepath):
+		key = ImportSession.resolve(filepath)
+		with self._lock:
+			if self._closed or key in self._futures:
+				return
+			if self._pool == None:
+				self._pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+			try:
+				self._futures[key] = self._pool.submit(self._parse, filepath)
+			except RuntimeError:
+				# Pool already shut down
+				pass
+
+	def _find(self, relative_path):
+		return support.find_file(relative_path, self.swg_root) if relative_path else None
+
+	def _parse(self, filepath):
+		"""Parse one file and queue up what it references. Returns None if it didn't parse."""
+		extension = os.path.splitext(filepath)[1].lower()
+		if extension == ".pob":
+			parsed = swg_types.PobFile(filepath)
+			parsed.load()
+			for cell in parsed.cells:
+				self.prefetch(self._find(cell.appearance_file), self._find(cell.floor_file))
+		elif extension == ".apt":
+			parsed = swg_types.AptFile(filepath)
+			parsed.load()
+			self.prefetch(parsed.get_reference_fullpath(self.swg_root))
+		elif extension == ".lod":
+			parsed = swg_types.LodFile(filepath)
+			if not parsed.load(filepath):
+				return None
+			for id, lod in parsed.lods.items():
+				if not self.lazy_lods or id == self.detail_level:
+					self.prefetch(self._find(os.path.join("appearance", lod[2])))
+			if self.lod_floors:
+				self.prefetch(self._find(parsed.floor))
+		elif extension == ".msh":
+			parsed = swg_types.SWGMesh(filepath, self.swg_root)
+			if not parsed.load():
+				return None
+			for sps in parsed.spss:
+				if sps.real_shader:
+					for attr in TEXTURE_ATTRS:
+						self.prefetch(self._find(getattr(sps.real_shader, attr)))
+		elif extension == ".flr":
+			parsed = swg_types.FloorFile(filepath)
+			if parsed.load() == False:
+				return None
+		else:
+			# Textures are turned into images on the main thread; reading them
+			# here just gets them off the network share and into the OS cache.
+			with open(filepath, 'rb') as f:
+				while f.read(1 << 20):
+					pass
+			return None
+		return parsed
+
+_TAKEN = Future()
+_TAKEN.set_result(None)
+
 def import_msh(context,
 			   filepath,
 			   parent=None,
 			   flip_uv_vertical=False,
 			   remove_duplicate_verts=True,
 			   just_the_mesh = False,
+			   session = None,
 	):  
 
+	name=os.path.basename(filepath).rsplit( ".", 1 )[ 0 ]
+	if parent == None:
+		parent = bpy.context.scene.collection
+
+	key = None
+	if session != None:
+		key = ImportSession.mesh_key(filepath, flip_uv_vertical, remove_duplicate_verts)
+		if key in session.meshes:
+			mesh, hardpoints = session.meshes[key]
+			print(f'Instancing msh: {filepath} (mesh {mesh.name} already imported)')
+			obj = bpy.data.objects.new(name, mesh)
+			parent.objects.link(obj)
+			if not just_the_mesh:
+				for data in hardpoints:
+					support.create_hardpoint_obj(data[12], data[0:12], parent = obj)
+			return obj
+
 	print(f'Importing msh: {filepath} Flip UV: {flip_uv_vertical}')
 
 	swg_root = context.preferences.addons[__package__].preferences.swg_root
-	msh = swg_types.SWGMesh(filepath, swg_root)
-	if not msh.load():
-		return {'CANCELLED'}
+	msh = session.take(filepath) if session != None else None
+	if msh == None:
+		msh = swg_types.SWGMesh(filepath, swg_root)
+		if not msh.load():
+			return {'CANCELLED'}
 	
-		
-	name=os.path.basename(filepath).rsplit( ".", 1 )[ 0 ]
 	mesh = bpy.data.meshes.new(name=f'{name}-mesh')
 	obj = bpy.data.objects.new(name, mesh)
-
-	if parent == None:
-		parent = bpy.context.scene.collection
-	
 	parent.objects.link(obj)
 
 	faces_by_material = {}
@@ -218,6 +370,9 @@ def import_msh(context,
 	mesh.update() 
 	mesh.validate()
 
+	if key != None:
+		session.meshes[key] = (mesh, msh.hardpoints)
+
 	if not just_the_mesh:
 		for data in msh.hardpoints:
 			support.create_hardpoint_obj(data[12], data[0:12], parent = obj)
@@ -38,13 +38,22 @@ def load_new(context,
 			 filepath,
 			 *,
 			 flip_uv_vertical=False,
-			 remove_duplicate_verts=True
+			 remove_duplicate_verts=True,
+			 lazy_lods=False,
+			 detail_level=0
 			 ):  
 
 	SWG_ROOT=context.preferences.addons[__package__].preferences.swg_root
 	print(f"Loading pob {filepath}")
-	pob = swg_types.PobFile(filepath)
-	pob.load()		
+	# Cells often share appearances; import each unique mesh once. Everything the
+	# POB references is parsed in the background while cells are built here.
+	# Cell appearances are imported without their LOD floors; the cell's own floor is used
+	session = import_msh.ImportSession(SWG_ROOT, lazy_lods, detail_level, lod_floors=False)
+	session.prefetch(filepath)
+	pob = session.take(filepath)
+	if pob == None:
+		pob = swg_types.PobFile(filepath)
+		pob.load()		
 		
 	name=os.path.basename(filepath).rsplit( ".", 1 )[ 0 ]
 	collection = bpy.data.collections.new(name)
@@ -68,6 +77,7 @@ def load_new(context,
 			parent=cell_collection,
 			flip_uv_vertical=flip_uv_vertical,
 			remove_duplicate_verts=remove_duplicate_verts,
+			session=session,
 			)
 			mesh.name = f'Appearance_{cell.name}'
 		elif appearance_path and appearance_path.endswith(".lod"):
@@ -77,17 +87,23 @@ def load_new(context,
 				flip_uv_vertical=flip_uv_vertical,
 				remove_duplicate_verts=remove_duplicate_verts,
 				do_collision=False,
-				do_floor=False
+				do_floor=False,
+				session=session,
+				lazy_lods=lazy_lods,
+				detail_level=detail_level
 				)
 			if result[0] == 'SUCCESS':
 				result[1].name = f'Appearance_{cell.name}'
 			else:
 				print(f"Error. Erro while importing LOD: {appearance_path}")
+				session.close()
 				return ('CANCELLED')
 
 		elif appearance_path and appearance_path.endswith(".apt"):
-			apt = swg_types.AptFile(appearance_path)
-			apt.load()
+			apt = session.take(appearance_path)
+			if apt == None:
+				apt = swg_types.AptFile(appearance_path)
+				apt.load()
 			referenceFilePath = apt.get_reference_fullpath(SWG_ROOT)
 
 			if referenceFilePath and referenceFilePath.endswith(".msh"):
@@ -96,6 +112,7 @@ def load_new(context,
 				parent=cell_collection,
 				flip_uv_vertical=flip_uv_vertical,
 				remove_duplicate_verts=False,
+				session=session,
 				)
 				mesh.name = f'Appearance_{cell.name}'
 			elif referenceFilePath and referenceFilePath.endswith(".lod"):
@@ -105,12 +122,16 @@ def load_new(context,
 					flip_uv_vertical=flip_uv_vertical,
 					remove_duplicate_verts=remove_duplicate_verts,
 					do_collision=False,
-					do_floor=False
+					do_floor=False,
+					session=session,
+					lazy_lods=lazy_lods,
+					detail_level=detail_level
 					)
 				if result[0] == 'SUCCESS':
 					result[1].name = f'Appearance_{cell.name}'
 				else:
 					print(f"Error. Error while importing LOD: {appearance_path}")
+					session.close()
 					return ('CANCELLED')
 			else:
 				print(f"Couldn't find referenced file: {apt.reference}")
@@ -122,7 +143,7 @@ def load_new(context,
 			floor_path = support.find_file(cell.floor_file, SWG_ROOT)
 			if floor_path:
 				print(f"Found floor_file: {cell.floor_file} at {floor_path}")
-				flr = import_flr.import_flr(context, floor_path, collection=cell_collection) 
+				flr = import_flr.import_flr(context, floor_path, collection=cell_collection, session=session)
 				flr.name = f'Floor_{cell.name}'
 			else:
 				print(f"Didn't find floor_file: {cell.floor_file}")
@@ -161,7 +182,10 @@ def load_new(context,
 	# collection.children.link(pgrf_collection)
 	# if pob.pathGraph != None:
 	#	 support.create_pathgraph(pgrf_collection, pob.pathGraph, None, True)
+	# The building pathgraph isn't imported, but report anything wrong with it
+	pob.validate()
 
+	session.close()
 	return ('SUCCESS', collection)
 
 def create_portal_number(pob, p_ind, collection):
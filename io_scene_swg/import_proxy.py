@@ -0,0 +1,122 @@
+# MIT License
+#
+# Copyright (c) 2022 Nick Rafalski
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os, bpy
+
+from . import import_pob
+from . import swg_types
+from . import support
+from . import extents
+
+def load_new(context,
+			 filepath,
+			 *,
+			 parent=None,
+			 cache=None
+			 ):
+	"""Import a .pob, .lod or .msh as bounding boxes only: one CUBE empty per POB
+	cell or LOD level, sized from the APPR extents. Nothing but the extents (and a
+	POB's portals) is read, so no geometry, materials or textures are loaded.
+	cache maps paths to AppearanceBounds and can be shared between calls."""
+
+	swg_root = context.preferences.addons[__package__].preferences.swg_root
+	if parent == None:
+		parent = bpy.context.scene.collection
+	if cache == None:
+		cache = {}
+
+	name = os.path.basename(filepath).rsplit(".", 1)[0]
+	if filepath.endswith(".pob"):
+		pob = swg_types.PobFile(filepath)
+		pob.load(proxy=True)
+
+		collection = bpy.data.collections.new(name)
+		parent.children.link(collection)
+		for cell in pob.cells:
+			cell_collection = bpy.data.collections.new(cell.name)
+			collection.children.link(cell_collection)
+			appearance_path = support.find_file(cell.appearance_file, swg_root)
+			bounds = read_bounds(appearance_path, swg_root, cache) if appearance_path else None
+			if bounds == None:
+				print(f"Warning! Couldn't read bounds of {cell.appearance_file} for cell {cell.name}")
+				continue
+			add_bounds_box(cell_collection, f'Bounds_{cell.name}', bounds.extents, cell.appearance_file)
+
+		portals = bpy.data.collections.new("Portals")
+		collection.children.link(portals)
+		for p_ind in range(0, len(pob.portals)):
+			import_pob.create_portal_number(pob, p_ind, portals)
+		return ('SUCCESS', collection)
+
+	bounds = read_bounds(filepath, swg_root, cache)
+	if bounds == None:
+		return ('ERROR', None)
+
+	if len(bounds.lods) == 0:
+		return ('SUCCESS', add_bounds_box(parent, name, bounds.extents, filepath))
+
+	collection = bpy.data.collections.new(name)
+	parent.children.link(collection)
+	for id, lod in bounds.lods.items():
+		if len(lod) < 3:
+			print(f"Warning! Detail level {id} of {filepath} has no child. Skipping it")
+			continue
+		child = os.path.join("appearance", lod[2])
+		child_path = support.find_file(child, swg_root)
+		child_bounds = read_bounds(child_path, swg_root, cache) if child_path else None
+		if child_bounds == None:
+			print(f"Warning! Couldn't read bounds of LOD child: {child}")
+			continue
+		box = add_bounds_box(collection, os.path.basename(child).rsplit(".", 1)[0], child_bounds.extents, child)
+		box['distance'] = lod[1]
+	return ('SUCCESS', collection)
+
+def read_bounds(filepath, swg_root, cache):
+	"""AppearanceBounds of filepath, following .apt references. None if unreadable."""
+	if filepath in cache:
+		return cache[filepath]
+
+	bounds = swg_types.AppearanceBounds(filepath)
+	if not bounds.load():
+		bounds = None
+	elif bounds.reference != None:
+		reference_path = support.find_file(bounds.reference, swg_root)
+		bounds = read_bounds(reference_path, swg_root, cache) if reference_path else None
+
+	cache[filepath] = bounds
+	return bounds
+
+def add_bounds_box(collection, name, extent, appearance):
+	box = bpy.data.objects.new(name=name, object_data=None)
+	box.empty_display_type = "CUBE"
+	box.empty_display_size = 1
+	bounds = extents.Extents.bounds(extent)
+	if bounds != None:
+		center = [(bounds[0][i] + bounds[1][i]) / 2.0 for i in range(3)]
+		size = [(bounds[1][i] - bounds[0][i]) / 2.0 for i in range(3)]
+		box.location = support.convert_vector3(center)
+		box.scale = support.convert_scale(size)
+	else:
+		print(f"Warning! {appearance} has no extents. Leaving a unit box for {name}")
+	box['proxy_appearance'] = appearance
+	collection.objects.link(box)
+	return box
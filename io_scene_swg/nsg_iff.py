@@ -175,6 +175,10 @@ class IFF():
 		self.stack_depth -= 1
 		self.inChunk = False
 
+	def getRemainingLength(self):
+		s = self.stack[self.stack_depth]
+		return s.length - s.used
+
 	def read_misc(self, readLength):
 		s = self.stack[self.stack_depth]
 		readData = self.data[s.start + s.used:s.start + s.used + readLength]
@@ -1,5 +1,8 @@
-import os, bpy, math, mathutils
+import os, sys, time, bpy, math, mathutils
+import multiprocessing
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as PoolTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from bpy_extras.image_utils import load_image
 from bpy_extras import node_shader_utils
 from bpy_extras.io_utils import axis_conversion
@@ -19,7 +22,22 @@ SWG_EFT_HUEMAP_RB = 64
 
 def getChildren(myObject):
 	return list(myObject.children)
-	
+
+def is_lod_placeholder(obj):
+	"""True for the empties a lazy LOD import leaves in place of unimported detail levels."""
+	return obj.type == 'EMPTY' and 'lod_path' in obj
+
+def object_mesh(obj, apply_modifiers=False, depsgraph=None):
+	"""A temporary mesh for obj, and the object to call to_mesh_clear() on when done
+	with it. Without apply_modifiers it's obj's own mesh data, as exports have always
+	used; with it, obj is evaluated through depsgraph (the current one if None)."""
+	if not apply_modifiers:
+		return obj, obj.to_mesh()
+	if depsgraph == None:
+		depsgraph = bpy.context.evaluated_depsgraph_get()
+	evaluated = obj.evaluated_get(depsgraph)
+	return evaluated, evaluated.to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph)
+
 def clean_path(path):
 	return path.replace('\\', '/') if (os.sep == '/') else path.replace('/', '\\')
 
@@ -1081,3 +1099,83 @@ def hardpoint_from_obj(ob):
 		m[1][0], m[1][2], m[1][1], m[1][3],
 		clean_name
 	]
+
+# Longest a forked pool may take before it's abandoned and the work is done serially
+PARALLEL_TIMEOUT = 1800
+
+def can_fork():
+	"""Whether work can be spread over forked processes. Forked workers share the
+	already-imported add-on, but forking multithreaded Blender is only dependable on Linux."""
+	return sys.platform.startswith('linux')
+
+# Set in processes started by forked_map
+_in_forked_worker = False
+
+def in_forked_worker():
+	"""Whether this is one of forked_map's worker processes, which shouldn't fork more."""
+	return _in_forked_worker
+
+def _init_forked_worker(initializer, initargs):
+	global _in_forked_worker
+	_in_forked_worker = True
+	if initializer != None:
+		initializer(*initargs)
+
+def forked_map(func, items, workers, initializer=None, initargs=(), timeout=PARALLEL_TIMEOUT):
+	"""list(map(func, items)) over a pool of forked processes. None if that isn't
+	possible here, or the pool broke or timed out, so the caller can run serially."""
+	if not can_fork():
+		return None
+	pool = None
+	futures = []
+	try:
+		pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'),
+			initializer=_init_forked_worker, initargs=(initializer, initargs))
+		futures = [pool.submit(func, item) for item in items]
+		deadline = time.monotonic() + timeout
+		results = [future.result(timeout=max(0.0, deadline - time.monotonic())) for future in futures]
+		pool.shutdown()
+		return results
+	except (OSError, BrokenProcessPool, PoolTimeoutError) as e:
+		print(f"Warning: parallel run failed ({e!r}), falling back to serial")
+		if pool != None:
+			# A hung worker would block shutdown, so don't wait for them. Futures are
+			# cancelled by hand since shutdown(cancel_futures=True) needs Python 3.9.
+			processes = list((getattr(pool, '_processes', None) or {}).values())
+			for future in futures:
+				future.cancel()
+			pool.shutdown(wait=False)
+			for process in processes:
+				process.terminate()
+		return None
+
+# Jobs for the current run_export_jobs call. Forked workers inherit this list, so
+# the jobs themselves (which may hold mathutils types) never need pickling.
+_export_jobs = []
+
+def _run_export_job(index):
+	func, args, _ = _export_jobs[index]
+	return func(*args)
+
+def run_export_jobs(jobs, workers=None):
+	"""Run (func, args, done) jobs, spread over a process pool when there's more
+	than one, then call each done(result) (if not None) here in the main process.
+	Only the results cross back from the workers, so they must be picklable.
+	Returns the results in job order."""
+	global _export_jobs
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = min(workers, len(jobs))
+	results = None
+	if workers > 1 and can_fork():
+		_export_jobs = jobs
+		try:
+			results = forked_map(_run_export_job, range(len(jobs)), workers)
+		finally:
+			_export_jobs = []
+	if results is None:
+		results = [func(*args) for func, args, _ in jobs]
+	for (_, _, done), result in zip(jobs, results):
+		if done is not None:
+			done(result)
+	return results
@@ -21,7 +21,9 @@
 # SOFTWARE.
 from audioop import cross
 from enum import IntEnum
+import heapq
 import math
+import os
 from re import I
 from sys import maxsize
 from xml.dom import minidom
@@ -31,6 +33,7 @@ from . import palette_argb
 from . import vertex_buffer_format
 from . import extents
 import mathutils
+import numpy as np
 from mathutils import Vector
 
 SWG_ROOT=None
@@ -313,6 +316,160 @@ class PathGraph(object):
 		iff.exitForm("PGRF")
 
 
+	def edge_array(self):
+		"""(E, 2) int array of (indexA, indexB) per edge."""
+		return np.array([(e.indexA, e.indexB) for e in self.edges], dtype=np.int64).reshape(-1, 2)
+
+	def csr(self):
+		"""Compressed sparse row adjacency. Returns (order, offsets, targets):
+		self.edges[order] is grouped by indexA (stable), node n's edges are
+		order[offsets[n]:offsets[n + 1]] and lead to targets[offsets[n]:offsets[n + 1]].
+		Edges whose indexA isn't a node are left out."""
+		edges = self.edge_array()
+		count = len(self.nodes)
+		order = np.argsort(edges[:, 0], kind='stable')
+		order = order[(edges[order, 0] >= 0) & (edges[order, 0] < count)]
+		offsets = np.zeros(count + 1, dtype=np.int64)
+		np.cumsum(np.bincount(edges[order, 0], minlength=count), out=offsets[1:])
+		return order, offsets, edges[order, 1]
+
+	def components(self):
+		"""Connected component label per node (the lowest node index in it),
+		treating every edge as two-way."""
+		count = len(self.nodes)
+		labels = np.arange(count)
+		edges = self.edge_array()
+		edges = edges[np.all((edges >= 0) & (edges < count), axis=1)]
+		a, b = edges[:, 0], edges[:, 1]
+		# Propagate the minimum label along edges until nothing changes
+		while True:
+			updated = labels.copy()
+			np.minimum.at(updated, a, labels[b])
+			np.minimum.at(updated, b, labels[a])
+			updated = updated[updated]
+			if np.array_equal(updated, labels):
+				return labels
+			labels = updated
+
+	def validate(self, verbose=True, longest=0):
+		"""Check the graph is something NPCs can navigate. Returns a dict of
+		problem lists, all empty for a good graph:
+		  bad_indices      nodes whose index isn't their position in nodes
+		  bad_edges        edges pointing at nodes that don't exist
+		  duplicate_edges  (a, b) pairs that appear more than once
+		  asymmetric       edges (a, b) without a matching (b, a)
+		  unreachable      nodes not connected to the largest component
+		  unlinked_portals portal nodes with no edges
+		With verbose and longest, the longest paths (see longest_paths) are printed too."""
+		count = len(self.nodes)
+		edges = self.edge_array()
+		issues = {}
+		issues['bad_indices'] = [i for i, node in enumerate(self.nodes) if node.index != i]
+
+		valid = np.all((edges >= 0) & (edges < count), axis=1)
+		issues['bad_edges'] = [tuple(e) for e in edges[~valid].tolist()]
+		edges = edges[valid]
+
+		keys = edges[:, 0] * max(count, 1) + edges[:, 1]
+		unique_keys, key_counts = np.unique(keys, return_counts=True)
+		duplicates = unique_keys[key_counts > 1]
+		issues['duplicate_edges'] = [(int(k // count), int(k % count)) for k in duplicates.tolist()]
+
+		reverse = edges[:, 1] * max(count, 1) + edges[:, 0]
+		asymmetric = edges[~np.isin(reverse, unique_keys)]
+		issues['asymmetric'] = [tuple(e) for e in asymmetric.tolist()]
+
+		labels = self.components()
+		if count:
+			largest = np.argmax(np.bincount(labels))
+			issues['unreachable'] = np.nonzero(labels != largest)[0].tolist()
+		else:
+			issues['unreachable'] = []
+
+		linked = np.zeros(count, dtype=bool)
+		linked[edges.ravel()] = True
+		portal_types = (PathNodeType.CellPortal, PathNodeType.BuildingPortal)
+		issues['unlinked_portals'] = [i for i, node in enumerate(self.nodes) if node.type in portal_types and not linked[i]]
+
+		if verbose:
+			for name, problems in issues.items():
+				if problems:
+					print(f"PathGraph: {len(problems)} {name}: {problems[:10]}{' ...' if len(problems) > 10 else ''}")
+			if longest > 0 and not issues['bad_edges']:
+				for length, start, goal in self.longest_paths(longest):
+					print(f"PathGraph: path {start} -> {goal} is {length:.2f} long")
+		return issues
+
+	def _weighted_csr(self):
+		"""CSR adjacency as Python lists with Euclidean edge lengths, for the searches."""
+		_, offsets, targets = self.csr()
+		positions = np.array([list(node.position) for node in self.nodes], dtype=np.float64).reshape(-1, 3)
+		sources = np.repeat(np.arange(len(self.nodes)), np.diff(offsets))
+		valid = (targets >= 0) & (targets < len(self.nodes))
+		lengths = np.full(len(targets), np.inf)
+		lengths[valid] = np.linalg.norm(positions[targets[valid]] - positions[sources[valid]], axis=1)
+		return offsets.tolist(), targets.tolist(), lengths.tolist(), positions
+
+	def shortest_distances(self, sources=None):
+		"""Dijkstra from each source node (all nodes by default) along edge
+		directions. Returns a (len(sources), N) array, inf where unreachable."""
+		if sources is None:
+			sources = range(len(self.nodes))
+		sources = list(sources)
+		offsets, targets, lengths, _ = self._weighted_csr()
+		result = np.full((len(sources), len(self.nodes)), np.inf)
+		for row, source in enumerate(sources):
+			dist = result[row]
+			dist[source] = 0.0
+			heap = [(0.0, source)]
+			done = set()
+			while heap:
+				d, node = heapq.heappop(heap)
+				if node in done:
+					continue
+				done.add(node)
+				for i in range(offsets[node], offsets[node + 1]):
+					nd = d + lengths[i]
+					if nd < dist[targets[i]]:
+						dist[targets[i]] = nd
+						heapq.heappush(heap, (nd, targets[i]))
+		return result
+
+	def find_path(self, start, goal):
+		"""A* from node start to node goal, with straight-line distance as the
+		heuristic. Returns (length, [node indices]), or (inf, []) if unreachable."""
+		offsets, targets, lengths, positions = self._weighted_csr()
+		to_goal = np.linalg.norm(positions - positions[goal], axis=1).tolist()
+		best = {start: 0.0}
+		came_from = {}
+		heap = [(to_goal[start], 0.0, start)]
+		while heap:
+			_, d, node = heapq.heappop(heap)
+			if node == goal:
+				path = [goal]
+				while path[-1] != start:
+					path.append(came_from[path[-1]])
+				return d, path[::-1]
+			if d > best[node]:
+				continue
+			for i in range(offsets[node], offsets[node + 1]):
+				nd = d + lengths[i]
+				target = targets[i]
+				if nd < best.get(target, float('inf')):
+					best[target] = nd
+					came_from[target] = node
+					heapq.heappush(heap, (nd + to_goal[target], nd, target))
+		return float('inf'), []
+
+	def longest_paths(self, count=10):
+		"""The count longest shortest paths between connected node pairs (start <
+		goal), as (length, start, goal) tuples, longest first. Handy for spotting detours."""
+		dist = self.shortest_distances()
+		# Each unordered pair once, and only if connected
+		dist[~np.isfinite(dist) | ~np.triu(np.ones(dist.shape, dtype=bool), 1)] = -1.0
+		flat = np.argsort(dist, axis=None, kind='stable')[::-1][:count]
+		return [(float(dist.flat[i]), int(i // len(self.nodes)), int(i % len(self.nodes))) for i in flat.tolist() if dist.flat[i] > 0.0]
+
 	def write(self, iff):
 		iff.insertForm("PGRF")
 		iff.insertForm("0001")
@@ -331,33 +488,31 @@ class PathGraph(object):
 			iff.insertFloat(node.radius)
 		iff.exitChunk("PNOD")
 		
+		order, offsets, _ = self.csr()
+		edges = [self.edges[i] for i in order.tolist()]
+		if len(edges) != len(self.edges):
+			print(f"Warning! Dropping {len(self.edges) - len(edges)} PathGraph edges that start at a missing node")
 		iff.insertChunk("PEDG")
-		iff.insert_int32(len(self.edges))
-		for edge in self.edges:
+		iff.insert_int32(len(edges))
+		for edge in edges:
 			iff.insert_int32(edge.indexA)
 			iff.insert_int32(edge.indexB)
 			iff.insertFloat(edge.widthRight)
 			iff.insertFloat(edge.widthLeft)
 		iff.exitChunk("PEDG")
 
-		edgeCounts = [0]*len(self.nodes)
-		edgeStarts = [-1]*len(self.nodes)
-		for i, edge in enumerate(self.edges):
-			edgeCounts[edge.indexA] += 1
-
-			if edgeStarts[edge.indexA] == -1:
-				edgeStarts[edge.indexA] = i
+		# ECNT/ESTR index PEDG per node, so PEDG is written in CSR order
+		edgeCounts = np.diff(offsets)
+		edgeStarts = np.where(edgeCounts > 0, offsets[:-1], -1)
 
 		iff.insertChunk("ECNT")
 		iff.insert_int32(len(edgeCounts))
-		for ec in edgeCounts:
-			iff.insert_int32(ec)
+		iff.insertChunkData(edgeCounts.astype('<i4').tobytes())
 		iff.exitChunk("ECNT")
 
 		iff.insertChunk("ESTR")
 		iff.insert_int32(len(edgeStarts))
-		for es in edgeStarts:
-			iff.insert_int32(es)
+		iff.insertChunkData(edgeStarts.astype('<i4').tobytes())
 		iff.exitChunk("ESTR")
 
 		iff.exitForm("0001")
@@ -527,7 +682,9 @@ class PobFile(object):
 		iff.exitForm("PRTO")
 		iff.write(fullpath)
 
-	def load(self):
+	def load(self, proxy=False):
+		"""Read the POB. With proxy, only the portal IDTLs and each cell's DATA chunk
+		are read; collision, portal data, lights and the pathgraph are skipped."""
 		print(f"Loading pob from {self.filename}")
 		iff = nsg_iff.IFF(filename=self.filename)
 		iff.enterForm("PRTO")
@@ -558,6 +715,12 @@ class PobFile(object):
 					floor = iff.read_string()
 				iff.exitChunk("DATA")
 
+				if proxy:
+					iff.exitForm("0005")
+					iff.exitForm("CELL")
+					self.cells.append(Cell(name, can_see_parent, [], appearance, floor, None, []))
+					continue
+
 				print(f"CELL {i} collision form: {iff.getCurrentName()}")
 				collision = extents.Extents.create(iff)
 
@@ -649,6 +812,9 @@ class PobFile(object):
 				self.cells.append(Cell(name, can_see_parent, portals, appearance, floor, collision, lights))
 			iff.exitForm("CELS")
 
+			if proxy:
+				return
+
 			if iff.getCurrentName() == "PGRF":
 				self.pathGraph = PathGraph()
 				self.pathGraph.load(iff)
@@ -661,6 +827,13 @@ class PobFile(object):
 		else:
 			print(f"Unhandled PRTO version: {version}")
 			return	 
+
+	def validate(self, verbose=True, longest=3):
+		"""Check the loaded building pathgraph; see PathGraph.validate. Returns its
+		problem lists, or an empty dict when there is no pathgraph."""
+		if self.pathGraph is None:
+			return {}
+		return self.pathGraph.validate(verbose, longest)
 	
 	def load_0004_prtl(self, iff, num_portals):
 		iff.enterForm("PRTS")
@@ -707,6 +880,75 @@ class PobFile(object):
 		print(f"Found Portals: {len(self.portals)}")
 		iff.exitForm("PRTS")
 
+class AppearanceBounds(object):
+	"""Just the APPR extents of a .msh or .lod, read without touching any geometry.
+	For a .lod, lods maps each detail level to [near, far, child path] like LodFile.
+	For an .apt, only reference is read."""
+	__slots__ = ('filename', 'extents', 'lods', 'reference')
+	def __init__(self, filename):
+		self.filename = filename
+		self.extents = None
+		self.lods = {}
+		self.reference = None
+
+	def load(self):
+		iff = nsg_iff.IFF(filename=self.filename)
+		top = iff.getCurrentName()
+		if top == "APT ":
+			iff.enterForm("APT ")
+			iff.enterAnyForm()
+			iff.enterChunk("NAME")
+			self.reference = iff.read_string()
+			return True
+		elif top not in ["MESH", "DTLA"]:
+			print(f"Can't read bounds of {self.filename}. Unhandled first form: {top}")
+			return False
+
+		iff.enterForm(top)
+		version = iff.getCurrentName()
+		if version not in (["0005", "0004"] if top == "MESH" else ["0007", "0008", "0005"]):
+			print(f"Unsupported {top} version: {version}")
+			return False
+		iff.enterForm(version)
+		iff.enterForm("APPR")
+		appr_version = iff.getCurrentName()
+		if appr_version != "0003":
+			print(f"Unsupported APPR version: {appr_version}")
+			return False
+		iff.enterForm(appr_version)
+		self.extents = extents.Extents.create(iff)
+		if top == "MESH":
+			return True
+
+		# Exiting jumps over the collision, hardpoints and floor without parsing them
+		iff.exitForm(appr_version)
+		iff.exitForm("APPR")
+
+		if iff.getCurrentName() == "PIVT":
+			iff.enterChunk("PIVT")
+			iff.exitChunk("PIVT")
+
+		iff.enterChunk("INFO")
+		while not iff.atEndOfForm():
+			id = iff.read_uint32()
+			near = iff.read_float()
+			far = iff.read_float()
+			self.lods[id] = [near, far]
+		iff.exitChunk("INFO")
+
+		iff.enterForm("DATA")
+		while not iff.atEndOfForm():
+			iff.enterChunk("CHLD")
+			ind = iff.read_uint32()
+			child = iff.read_string()
+			if ind in self.lods:
+				self.lods[ind].append(child)
+			else:
+				print(f"Warning! {self.filename} has child {child} for detail level {ind}, which isn't in its INFO. Ignoring it")
+			iff.exitChunk("CHLD")
+		iff.exitForm("DATA")
+		return True
+
 class LodFile(object):
 
 	__slots__ = ('path', 'extents', 'mesh','hardpoints','collision','floor', 'lods', 'radar', 'testshape', 'writeshape')
@@ -985,99 +1227,295 @@ class IndexedTriangleList(object):
 		iff.exitForm("0000")
 		iff.exitForm("IDTL")
 		
-class BoxTreeNode:
-	__slots__ = ('box_min', 'box_max', 'index', 'userId', 'childA', 'childB')
-	def __init__(self, box_min, box_max, userId=-1):
-		self.box_min = list(box_min)
-		self.box_max = list(box_max)
-		self.index = 0
-		self.userId = userId
-		self.childA = None
-		self.childB = None
-
 class BoxTree:
 	"""AABB tree for spatial acceleration of floor collision queries.
-	Uses top-down median-split construction (O(n log n)) which produces a
-	functionally equivalent tree to the engine's bottom-up greedy approach."""
+	Nodes are stored flat, in pre-order, in a NumPy structured array with the
+	exact record layout of the NODS chunk. Built top-down with median or
+	Surface Area Heuristic splits, which produces a functionally equivalent
+	tree to the engine's bottom-up greedy approach."""
+
+	NODE_DTYPE = np.dtype([
+		('box_max', '<f4', 3),
+		('box_min', '<f4', 3),
+		('index', '<i4'),
+		('userId', '<i4'),
+		('childA', '<i4'),
+		('childB', '<i4'),
+	])
+
+	# Below this many triangles a SAH sweep isn't worth it, split at the median
+	SAH_MIN_LEAVES = 64
+	# SAH children get at least 1/SAH_MIN_CHILD_DIVISOR of their parent's leaves
+	SAH_MIN_CHILD_DIVISOR = 8
 
-	@staticmethod
-	def build_from_tris(verts, tris):
-		"""Build a BoxTree from floor vertices and triangles."""
-		if not tris:
-			return BoxTree()
-
-		leaves = []
-		for i, tri in enumerate(tris):
-			corners = [verts[tri.corner1], verts[tri.corner2], verts[tri.corner3]]
-			bmin = [min(c[j] for c in corners) for j in range(3)]
-			bmax = [max(c[j] for c in corners) for j in range(3)]
-			centroid = [(bmin[j] + bmax[j]) * 0.5 for j in range(3)]
-			leaves.append((BoxTreeNode(bmin, bmax, userId=i), centroid))
+	def __init__(self):
+		self.nodes = np.zeros(0, dtype=BoxTree.NODE_DTYPE)
+
+	def __len__(self):
+		return len(self.nodes)
 
+	@staticmethod
+	def build_from_tris(verts, corners, use_sah=False):
+		"""Build a BoxTree from floor vertices and (T, 3) triangle corner indices.
+		Works level by level: every node on a level owns a contiguous range of
+		`perm`, so bounds and median splits are a few array ops per level."""
 		tree = BoxTree()
-		tree.root = BoxTree._build_recursive(leaves)
+		corners = np.asarray(corners, dtype=np.int64).reshape(-1, 3)
+		count = len(corners)
+		if count == 0:
+			return tree
+
+		points = np.asarray(verts, dtype=np.float64).reshape(-1, 3)[corners]
+		leaf_min = points.min(axis=1)
+		leaf_max = points.max(axis=1)
+		centroids = (leaf_min + leaf_max) * 0.5
+
+		nodes = np.zeros(2 * count - 1, dtype=BoxTree.NODE_DTYPE)
+		nodes['index'] = np.arange(len(nodes))
+		nodes['userId'] = -1
+		nodes['childA'] = -1
+		nodes['childB'] = -1
+
+		perm = np.arange(count)
+		starts = np.zeros(1, dtype=np.int64)
+		ends = np.full(1, count, dtype=np.int64)
+		node_ids = np.zeros(1, dtype=np.int64)
+		while len(starts):
+			bounds = np.empty(2 * len(starts), dtype=np.int64)
+			bounds[0::2] = starts
+			bounds[1::2] = ends
+			nodes['box_min'][node_ids] = BoxTree._segment_reduce(np.minimum, leaf_min[perm], bounds)
+			nodes['box_max'][node_ids] = BoxTree._segment_reduce(np.maximum, leaf_max[perm], bounds)
+
+			sizes = ends - starts
+			is_leaf = sizes == 1
+			nodes['userId'][node_ids[is_leaf]] = perm[starts[is_leaf]]
+			starts, ends, node_ids, sizes = starts[~is_leaf], ends[~is_leaf], node_ids[~is_leaf], sizes[~is_leaf]
+			if len(starts) == 0:
+				break
+
+			# Median split on the longest axis of each node's centroid bounds.
+			# Sorting (segment, key) keeps every node's leaves inside its own range.
+			bounds = np.empty(2 * len(starts), dtype=np.int64)
+			bounds[0::2] = starts
+			bounds[1::2] = ends
+			cmin = BoxTree._segment_reduce(np.minimum, centroids[perm], bounds)
+			cmax = BoxTree._segment_reduce(np.maximum, centroids[perm], bounds)
+			axes = np.argmax(cmax - cmin, axis=1)
+			segment = np.repeat(np.arange(len(starts)), sizes)
+			positions = np.repeat(starts, sizes) + (np.arange(len(segment)) - np.repeat(np.cumsum(sizes) - sizes, sizes))
+			keys = centroids[perm[positions], axes[segment]]
+			perm[positions] = perm[positions][np.lexsort((keys, segment))]
+			mids = starts + sizes // 2
+
+			if use_sah:
+				for i in np.nonzero(sizes >= BoxTree.SAH_MIN_LEAVES)[0].tolist():
+					s, e = int(starts[i]), int(ends[i])
+					split = BoxTree._split_sah(perm[s:e], leaf_min, leaf_max, centroids)
+					if split is not None:
+						perm[s:e] = np.concatenate(split)
+						mids[i] = s + len(split[0])
+
+			# Pre-order numbering: childA follows its parent, childB follows childA's subtree
+			child_a = node_ids + 1
+			child_b = node_ids + 2 * (mids - starts)
+			nodes['childA'][node_ids] = child_a
+			nodes['childB'][node_ids] = child_b
+
+			# Interleave children so segments stay ordered by start; reduceat is
+			# much faster walking the array forwards than jumping around it
+			starts = np.stack((starts, mids), axis=1).ravel()
+			ends = np.stack((mids, ends), axis=1).ravel()
+			node_ids = np.stack((child_a, child_b), axis=1).ravel()
+
+		tree.nodes = nodes
 		return tree
 
 	@staticmethod
-	def _build_recursive(leaves):
-		if len(leaves) == 1:
-			return leaves[0][0]
-
-		# Find longest axis of the overall bounding box of centroids
-		cmin = [min(c[j] for _, c in leaves) for j in range(3)]
-		cmax = [max(c[j] for _, c in leaves) for j in range(3)]
-		extents = [cmax[j] - cmin[j] for j in range(3)]
-		axis = extents.index(max(extents))
-
-		# Sort by centroid along that axis and split at median
-		leaves.sort(key=lambda lc: lc[1][axis])
-		mid = len(leaves) // 2
-
-		childA = BoxTree._build_recursive(leaves[:mid])
-		childB = BoxTree._build_recursive(leaves[mid:])
-
-		parent = BoxTreeNode(
-			[min(childA.box_min[k], childB.box_min[k]) for k in range(3)],
-			[max(childA.box_max[k], childB.box_max[k]) for k in range(3)],
-		)
-		parent.childA = childA
-		parent.childB = childB
-		return parent
+	def _segment_reduce(ufunc, values, bounds):
+		"""ufunc.reduce over values[bounds[2i]:bounds[2i+1]] for every i."""
+		# Per column: reduceat along axis 0 of a 2D array is far slower than on 1D
+		padded = np.concatenate((values, values[:1])).T.copy()
+		return np.stack([ufunc.reduceat(column, bounds)[0::2] for column in padded], axis=1)
 
-	def __init__(self):
-		self.root = None
+	@staticmethod
+	def _surface_area(box_min, box_max):
+		d = box_max - box_min
+		return 2.0 * (d[:, 0] * d[:, 1] + d[:, 1] * d[:, 2] + d[:, 2] * d[:, 0])
+
+	@staticmethod
+	def _split_sah(leaves, leaf_min, leaf_max, centroids):
+		"""Sweep every centroid-sorted split position on each axis and keep the
+		one with the lowest area-weighted cost. leaves arrive sorted on the longest
+		axis, as for a median split; None if nothing beats splitting them there."""
+		count = len(leaves)
+
+		def cost_of(left, right):
+			area = BoxTree._surface_area(
+				np.stack((leaf_min[left].min(axis=0), leaf_min[right].min(axis=0))),
+				np.stack((leaf_max[left].max(axis=0), leaf_max[right].max(axis=0))))
+			return area[0] * len(left) + area[1] * len(right)
+		best_cost = cost_of(leaves[:count // 2], leaves[count // 2:])
+		best = None
+
+		# Lopsided splits (1 vs n-1 at worst) would make the tree deep, so keep both sides this big
+		smallest = max(1, count // BoxTree.SAH_MIN_CHILD_DIVISOR)
+		left_counts = np.arange(1, count)
+		for axis in range(3):
+			order = leaves[np.argsort(centroids[leaves, axis], kind='stable')]
+			mins = leaf_min[order]
+			maxs = leaf_max[order]
+			left_area = BoxTree._surface_area(np.minimum.accumulate(mins)[:-1], np.maximum.accumulate(maxs)[:-1])
+			right_area = BoxTree._surface_area(np.minimum.accumulate(mins[::-1])[::-1][1:], np.maximum.accumulate(maxs[::-1])[::-1][1:])
+			cost = (left_area * left_counts + right_area * (count - left_counts))[smallest - 1:count - smallest]
+			i = int(np.argmin(cost))
+			if cost[i] < best_cost:
+				best_cost = cost[i]
+				best = (order[:i + smallest], order[i + smallest:])
+		return best
+
+	def load(self, iff):
+		iff.enterForm("BTRE")
+		version = iff.getCurrentName()
+		if version == "0000":
+			iff.enterForm("0000")
+			iff.enterChunk("NODS")
+			count = iff.read_int32()
+			data = iff.read_misc(count * BoxTree.NODE_DTYPE.itemsize)
+			self.nodes = np.frombuffer(data, dtype=BoxTree.NODE_DTYPE, count=count).copy()
+			iff.exitChunk("NODS")
+			iff.exitForm("0000")
+		else:
+			print(f"Unhandled BTRE version: {version}")
+		iff.exitForm("BTRE")
+
+	def root(self):
+		"""Index of the root node: the one node no other node points at.
+		Trees we build are pre-order (root 0), but the engine's aren't."""
+		if len(self.nodes) == 0:
+			return -1
+		referenced = np.zeros(len(self.nodes), dtype=bool)
+		for field in ('childA', 'childB'):
+			children = self.nodes[field]
+			referenced[children[(children >= 0) & (children < len(self.nodes))]] = True
+		return int(np.argmin(referenced))
+
+	def _collect(self, test):
+		"""Walk the tree a level at a time, keeping nodes whose boxes pass
+		test(box_min, box_max) -> bool mask. Returns the surviving leaves' userIds."""
+		if len(self.nodes) == 0:
+			return np.zeros(0, dtype=np.int64)
+		box_min = self.nodes['box_min'].astype(np.float64)
+		box_max = self.nodes['box_max'].astype(np.float64)
+		child_a = self.nodes['childA']
+		child_b = self.nodes['childB']
+		found = []
+		frontier = np.array([self.root()], dtype=np.int64)
+		while len(frontier):
+			frontier = frontier[test(box_min[frontier], box_max[frontier])]
+			is_leaf = child_a[frontier] < 0
+			found.append(self.nodes['userId'][frontier[is_leaf]])
+			inner = frontier[~is_leaf]
+			frontier = np.concatenate((child_a[inner], child_b[inner])).astype(np.int64)
+		found = np.concatenate(found).astype(np.int64)
+		found.sort()
+		return found
+
+	def query_box(self, lo, hi):
+		"""userIds of leaves whose boxes overlap the box [lo, hi]."""
+		lo = np.asarray(lo, dtype=np.float64)
+		hi = np.asarray(hi, dtype=np.float64)
+		return self._collect(lambda bmin, bmax: np.all((bmin <= hi) & (bmax >= lo), axis=1))
+
+	def query_points_xz(self, px, pz):
+		"""query_box() for arrays of points against the XZ footprint, walking the
+		tree for all of them at once. Returns (owner, userId) arrays pairing each
+		point index with every leaf whose box contains it."""
+		px = np.asarray(px, dtype=np.float64)
+		pz = np.asarray(pz, dtype=np.float64)
+		if len(self.nodes) == 0 or len(px) == 0:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+		box_min = self.nodes['box_min'].astype(np.float64)
+		box_max = self.nodes['box_max'].astype(np.float64)
+		child_a = self.nodes['childA'].astype(np.int64)
+		child_b = self.nodes['childB'].astype(np.int64)
+		user_ids = self.nodes['userId'].astype(np.int64)
+		found_owner = []
+		found_ids = []
+		owner = np.arange(len(px))
+		node = np.full(len(px), self.root(), dtype=np.int64)
+		while len(owner):
+			x, z = px[owner], pz[owner]
+			inside = (box_min[node, 0] <= x) & (x <= box_max[node, 0]) & (box_min[node, 2] <= z) & (z <= box_max[node, 2])
+			owner, node = owner[inside], node[inside]
+			is_leaf = child_a[node] < 0
+			found_owner.append(owner[is_leaf])
+			found_ids.append(user_ids[node[is_leaf]])
+			owner, node = owner[~is_leaf], node[~is_leaf]
+			owner = np.concatenate((owner, owner))
+			node = np.concatenate((child_a[node], child_b[node]))
+		return np.concatenate(found_owner), np.concatenate(found_ids)
+
+	def query_segment(self, start, end, ignore_axis=None):
+		"""userIds of leaves whose boxes the segment start -> end passes through
+		(slab test). ignore_axis drops one axis, e.g. 1 to test the XZ footprint."""
+		start = np.asarray(start, dtype=np.float64)
+		direction = np.asarray(end, dtype=np.float64) - start
+		flat = direction == 0.0
+		inv = 1.0 / np.where(flat, 1.0, direction)
+		ignored = np.zeros(3, dtype=bool)
+		if ignore_axis is not None:
+			ignored[ignore_axis] = True
+
+		def test(bmin, bmax):
+			t1 = (bmin - start) * inv
+			t2 = (bmax - start) * inv
+			near = np.where(flat | ignored, 0.0, np.minimum(t1, t2))
+			far = np.where(flat | ignored, 1.0, np.maximum(t1, t2))
+			# An axis the segment doesn't move along must already be inside the slab
+			inside = np.all(~flat | ignored | ((bmin <= start) & (start <= bmax)), axis=1)
+			return inside & (np.maximum(near.max(axis=1), 0.0) <= np.minimum(far.min(axis=1), 1.0))
+		return self._collect(test)
+
+	def nearest(self, point, k, distance):
+		"""The k leaves closest to point, best-first. distance(userId) gives the
+		exact squared distance to a leaf; boxes only bound it from below.
+		Returns a list of (squared distance, userId), closest first."""
+		if len(self.nodes) == 0 or k <= 0:
+			return []
+		point = np.asarray(point, dtype=np.float64)
+		nodes = self.nodes
+		root = self.root()
+		# Entries are (distance, is_exact, node or userId)
+		heap = [(0.0, 0, root)]
+		result = []
+		while heap and len(result) < k:
+			dist, exact, item = heapq.heappop(heap)
+			if exact:
+				result.append((dist, item))
+				continue
+			node = nodes[item]
+			if node['childA'] < 0:
+				user_id = int(node['userId'])
+				heapq.heappush(heap, (float(distance(user_id)), 1, user_id))
+				continue
+			for child in (int(node['childA']), int(node['childB'])):
+				gap = np.maximum(np.maximum(nodes['box_min'][child] - point, point - nodes['box_max'][child]), 0.0)
+				heapq.heappush(heap, (float(gap @ gap), 0, child))
+		return result
 
 	def write(self, iff):
-		if self.root is None:
+		if len(self.nodes) == 0:
 			return
-		# Assign pre-order indices and flatten to list
-		flat = []
-		self._flatten(self.root, flat)
-
 		iff.insertForm("BTRE")
 		iff.insertForm("0000")
 		iff.insertChunk("NODS")
-		iff.insert_int32(len(flat))
-		for node in flat:
-			iff.insertFloatVector3(node.box_max)
-			iff.insertFloatVector3(node.box_min)
-			iff.insert_int32(node.index)
-			iff.insert_int32(node.userId)
-			iff.insert_int32(node.childA.index if node.childA else -1)
-			iff.insert_int32(node.childB.index if node.childB else -1)
+		iff.insert_int32(len(self.nodes))
+		iff.insertChunkData(self.nodes.tobytes())
 		iff.exitChunk("NODS")
 		iff.exitForm("0000")
 		iff.exitForm("BTRE")
 
-	def _flatten(self, node, flat):
-		"""Pre-order traversal to assign indices and collect into flat list."""
-		node.index = len(flat)
-		flat.append(node)
-		if node.childA:
-			self._flatten(node.childA, flat)
-		if node.childB:
-			self._flatten(node.childB, flat)
-
 class FloorEdgeType(IntEnum):
 	Uncrossable = 0
 	Crossable = 1
@@ -1112,100 +1550,388 @@ class FloorTri(object):
 		self.portalId2 = -1
 		self.portalId3 = -1
 
-	def _read_connected_tri(self, iff):
-		self.corner1 = iff.read_int32()
-		self.corner2 = iff.read_int32()
-		self.corner3 = iff.read_int32()
+	# Record layout of a TRIS 0002 entry. 0001 entries are the same size, with
+	# crossable flags where 0002 has edge types.
+	DTYPE = np.dtype([
+		('corners', '<i4', 3),
+		('index', '<i4'),
+		('neighbors', '<i4', 3),
+		('normal', '<f4', 3),
+		('edgeTypes', 'u1', 3),
+		('fallthrough', 'u1'),
+		('partTag', '<i4'),
+		('portalIds', '<i4', 3),
+	])
 
-		self.index = iff.read_int32()
+	@staticmethod
+	def read_array(iff, count, version):
+		"""Read count TRIS records in one go into a FloorTri.DTYPE array."""
+		data = iff.read_misc(count * FloorTri.DTYPE.itemsize)
+		tris = np.frombuffer(data, dtype=FloorTri.DTYPE, count=count).copy()
+		if version == "0001":
+			tris['edgeTypes'] = np.where(tris['edgeTypes'] != 0, FloorEdgeType.Crossable, FloorEdgeType.Uncrossable)
+		elif count and tris['edgeTypes'].max() > FloorEdgeType.Invalid:
+			raise ValueError(f"Invalid floor edge type {tris['edgeTypes'].max()}")
+		return tris
 
-		self.nindex1 = iff.read_int32()
-		self.nindex2 = iff.read_int32()
-		self.nindex3 = iff.read_int32()
+	@staticmethod
+	def from_array(tris):
+		"""FloorTri objects for every record of a FloorTri.DTYPE array."""
+		edge_types = tuple(FloorEdgeType)
+		result = []
+		for corners, index, neighbors, normal, types, fallthrough, partTag, portalIds in zip(
+				tris['corners'].tolist(), tris['index'].tolist(), tris['neighbors'].tolist(), tris['normal'].tolist(),
+				tris['edgeTypes'].tolist(), tris['fallthrough'].tolist(), tris['partTag'].tolist(), tris['portalIds'].tolist()):
+			f = FloorTri()
+			f.corner1, f.corner2, f.corner3 = corners
+			f.index = index
+			f.nindex1, f.nindex2, f.nindex3 = neighbors
+			f.normal = normal
+			f.edgeType1, f.edgeType2, f.edgeType3 = edge_types[types[0]], edge_types[types[1]], edge_types[types[2]]
+			f.fallthrough = fallthrough != 0
+			f.partTag = partTag
+			f.portalId1, f.portalId2, f.portalId3 = portalIds
+			result.append(f)
+		return result
 
-	def read_0001(self, iff):
-		self._read_connected_tri(iff)
+	@staticmethod
+	def to_array(tris):
+		"""Pack FloorTri objects into a FloorTri.DTYPE array."""
+		result = np.zeros(len(tris), dtype=FloorTri.DTYPE)
+		if len(tris) == 0:
+			return result
+		result['corners'] = [(t.corner1, t.corner2, t.corner3) for t in tris]
+		result['index'] = [t.index for t in tris]
+		result['neighbors'] = [(t.nindex1, t.nindex2, t.nindex3) for t in tris]
+		result['normal'] = [tuple(t.normal) for t in tris]
+		result['edgeTypes'] = [(t.edgeType1, t.edgeType2, t.edgeType3) for t in tris]
+		result['fallthrough'] = [t.fallthrough for t in tris]
+		result['partTag'] = [t.partTag for t in tris]
+		result['portalIds'] = [(t.portalId1, t.portalId2, t.portalId3) for t in tris]
+		return result
 
-		self.normal = iff.read_vector3()
+class PathEdge(object):
+	__slots__ = ('tri','edge','crossable')
+	# Record layout of a BEDG entry
+	DTYPE = np.dtype([('tri', '<i4'), ('edge', '<i4'), ('crossable', 'u1')])
 
-		crossable1 = iff.read_bool8()
-		crossable2 = iff.read_bool8()
-		crossable3 = iff.read_bool8()
-		self.edgeType1 = FloorEdgeType.Crossable if crossable1 else FloorEdgeType.Uncrossable
-		self.edgeType2 = FloorEdgeType.Crossable if crossable2 else FloorEdgeType.Uncrossable
-		self.edgeType3 = FloorEdgeType.Crossable if crossable3 else FloorEdgeType.Uncrossable
+	def __init__(self, tri, edge, crossable):
+		self.tri = tri
+		self.edge = edge
+		self.crossable = crossable
+	
+	@staticmethod
+	def read(iff):
+		return PathEdge(iff.read_int32(), iff.read_int32(), iff.read_bool8())
 
-		self.fallthrough = iff.read_bool8()
+	def write(self, iff):
+		iff.insert_int32(self.tri)
+		iff.insert_int32(self.edge)
+		iff.insert_bool(self.crossable)
 
-		self.partTag = iff.read_int32()
+class FloorTriGrid(object):
+	"""Uniform grid over the XZ footprint of a floor's triangles.
+	Each cell lists (ascending) the triangles whose XZ bounds overlap it, stored
+	CSR-style, so point location only tests the handful of triangles in one cell."""
+	__slots__ = ('tri_xz', 'tri_min', 'tri_max', 'centroids', 'origin', 'cell_size', 'cols', 'rows', 'cell_starts', 'cell_tris')
+
+	def __init__(self, verts, corners, tris_per_cell = 2.0):
+		verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+		corners = np.asarray(corners, dtype=np.int64).reshape(-1, 3)
+		count = len(corners)
+
+		self.tri_xz = verts[corners][:, :, [0, 2]]
+		self.tri_min = self.tri_xz.min(axis=1)
+		self.tri_max = self.tri_xz.max(axis=1)
+		self.centroids = self.tri_xz.mean(axis=1)
+
+		if count == 0:
+			self.origin = np.zeros(2)
+			self.cell_size = 1.0
+			self.cols = self.rows = 1
+			self.cell_starts = np.zeros(2, dtype=np.int64)
+			self.cell_tris = np.zeros(0, dtype=np.int64)
+			return
 
-		self.portalId1 = iff.read_int32()
-		self.portalId2 = iff.read_int32()
-		self.portalId3 = iff.read_int32()
+		lo = self.tri_min.min(axis=0)
+		hi = self.tri_max.max(axis=0)
+		size = np.maximum(hi - lo, 1e-6)
+		# Aim for a few triangles per cell, but never make cells much smaller than
+		# an average triangle or every triangle lands in lots of cells.
+		by_density = math.sqrt(size[0] * size[1] * tris_per_cell / count)
+		by_tri_size = float((self.tri_max - self.tri_min).mean())
+		self.cell_size = max(by_density, by_tri_size, 1e-3)
+		self.origin = lo
+		self.cols = int(size[0] // self.cell_size) + 1
+		self.rows = int(size[1] // self.cell_size) + 1
+
+		cmin = np.clip(((self.tri_min - lo) // self.cell_size).astype(np.int64), 0, [self.cols - 1, self.rows - 1])
+		cmax = np.clip(((self.tri_max - lo) // self.cell_size).astype(np.int64), 0, [self.cols - 1, self.rows - 1])
+		spans = cmax - cmin + 1
+		per_tri = spans[:, 0] * spans[:, 1]
+
+		tri_ids = np.repeat(np.arange(count), per_tri)
+		offsets = np.arange(len(tri_ids)) - np.repeat(np.cumsum(per_tri) - per_tri, per_tri)
+		span_x = np.repeat(spans[:, 0], per_tri)
+		cell_x = np.repeat(cmin[:, 0], per_tri) + offsets % span_x
+		cell_z = np.repeat(cmin[:, 1], per_tri) + offsets // span_x
+		cells = cell_z * self.cols + cell_x
+
+		order = np.argsort(cells, kind='stable')
+		self.cell_tris = tri_ids[order]
+		self.cell_starts = np.searchsorted(cells[order], np.arange(self.cols * self.rows + 1))
 
-	def read_0002(self, iff):
-		self._read_connected_tri(iff)
+	@staticmethod
+	def points_in_tris_xz(px, pz, tri_xz):
+		"""Vectorised FloorFile._point_in_tri_xz: point i against triangle tri_xz[i]."""
+		ax, az = tri_xz[:, 0, 0], tri_xz[:, 0, 1]
+		bx, bz = tri_xz[:, 1, 0], tri_xz[:, 1, 1]
+		cx, cz = tri_xz[:, 2, 0], tri_xz[:, 2, 1]
+		d1 = (px - bx) * (az - bz) - (ax - bx) * (pz - bz)
+		d2 = (px - cx) * (bz - cz) - (bx - cx) * (pz - cz)
+		d3 = (px - ax) * (cz - az) - (cx - ax) * (pz - az)
+		has_neg = (d1 < 0) | (d2 < 0) | (d3 < 0)
+		has_pos = (d1 > 0) | (d2 > 0) | (d3 > 0)
+		return ~(has_neg & has_pos)
+
+	def _cell_coords(self, x, z):
+		return int(math.floor((x - self.origin[0]) / self.cell_size)), int(math.floor((z - self.origin[1]) / self.cell_size))
+
+	def _in_grid(self, ix, iz):
+		return 0 <= ix < self.cols and 0 <= iz < self.rows
+
+	def cell_candidates(self, ix, iz):
+		"""Triangles whose XZ bounds overlap cell (ix, iz), ascending."""
+		if not self._in_grid(ix, iz):
+			return self.cell_tris[:0]
+		cell = iz * self.cols + ix
+		return self.cell_tris[self.cell_starts[cell]:self.cell_starts[cell + 1]]
+
+	def candidates(self, x, z):
+		"""Triangles whose XZ bounds contain the point, ascending."""
+		cand = self.cell_candidates(*self._cell_coords(x, z))
+		inside = (self.tri_min[cand, 0] <= x) & (x <= self.tri_max[cand, 0]) & (self.tri_min[cand, 1] <= z) & (z <= self.tri_max[cand, 1])
+		return cand[inside]
+
+	def locate(self, x, z):
+		"""Lowest-index triangle containing the point on the XZ plane, or -1."""
+		cand = self.cell_candidates(*self._cell_coords(x, z))
+		if len(cand) == 0:
+			return -1
+		hits = cand[FloorTriGrid.points_in_tris_xz(x, z, self.tri_xz[cand])]
+		return int(hits[0]) if len(hits) else -1
+
+	def nearest_centroid(self, x, z):
+		"""Triangle with the nearest centroid on the XZ plane, searching outward ring by ring."""
+		if len(self.centroids) == 0:
+			return -1
+		ix, iz = self._cell_coords(x, z)
+		if not self._in_grid(ix, iz):
+			d = ((self.centroids - (x, z)) ** 2).sum(axis=1)
+			return int(np.argmin(d))
+
+		best = -1
+		best_dist = float('inf')
+		for r in range(max(self.cols, self.rows)):
+			for dz in range(-r, r + 1):
+				step = 1 if abs(dz) == r else 2 * r
+				for dx in range(-r, r + 1, max(step, 1)):
+					cand = self.cell_candidates(ix + dx, iz + dz)
+					if len(cand) == 0:
+						continue
+					d = ((self.centroids[cand] - (x, z)) ** 2).sum(axis=1)
+					j = int(np.argmin(d))
+					if d[j] < best_dist or (d[j] == best_dist and cand[j] < best):
+						best_dist = d[j]
+						best = int(cand[j])
+			# Anything in ring r+1 or beyond is at least r cells away
+			if best != -1 and best_dist <= (r * self.cell_size) ** 2:
+				break
+		return best
+
+	def find(self, x, z):
+		"""Triangle containing the point, falling back to the nearest centroid."""
+		idx = self.locate(x, z)
+		if idx == -1:
+			idx = self.nearest_centroid(x, z)
+		return max(idx, 0)
+
+	def cell_candidates_many(self, px, pz):
+		"""cell_candidates() for arrays of points, flattened: returns (owner, tri)
+		arrays pairing each point index with every triangle listed in its cell."""
+		ix = np.floor((px - self.origin[0]) / self.cell_size).astype(np.int64)
+		iz = np.floor((pz - self.origin[1]) / self.cell_size).astype(np.int64)
+		in_grid = (ix >= 0) & (ix < self.cols) & (iz >= 0) & (iz < self.rows)
+		cells = np.where(in_grid, iz * self.cols + ix, 0)
+		starts = self.cell_starts[cells]
+		counts = np.where(in_grid, self.cell_starts[cells + 1] - starts, 0)
+
+		owner = np.repeat(np.arange(len(px)), counts)
+		offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+		return owner, self.cell_tris[np.repeat(starts, counts) + offsets]
+
+	def locate_many(self, positions):
+		"""Batched locate() for an (N, 3) array of positions. Returns an int array, -1 where nothing contains the point."""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+		px = positions[:, 0]
+		pz = positions[:, 2]
+		count = len(positions)
+		result = np.full(count, np.iinfo(np.int64).max, dtype=np.int64)
+		if count == 0 or len(self.centroids) == 0:
+			return np.full(count, -1, dtype=np.int64)
+
+		owner, cand = self.cell_candidates_many(px, pz)
+		hit = FloorTriGrid.points_in_tris_xz(px[owner], pz[owner], self.tri_xz[cand])
+		np.minimum.at(result, owner[hit], cand[hit])
+		result[result == np.iinfo(np.int64).max] = -1
+		return result
 
-		self.normal = iff.read_vector3()
+	def find_many(self, positions):
+		"""Batched find() for an (N, 3) array of positions. Returns an int array."""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+		if len(positions) == 0 or len(self.centroids) == 0:
+			return np.zeros(len(positions), dtype=np.int64)
 
-		self.edgeType1 = FloorEdgeType(iff.read_uint8())
-		self.edgeType2 = FloorEdgeType(iff.read_uint8())
-		self.edgeType3 = FloorEdgeType(iff.read_uint8())
+		result = self.locate_many(positions)
+		for i in np.nonzero(result == -1)[0]:
+			result[i] = max(self.nearest_centroid(positions[i, 0], positions[i, 2]), 0)
+		return result
 
-		self.fallthrough = iff.read_bool8()
+class FloorWalker(object):
+	"""Picklable, bpy-free snapshot of the floor data needed for line-of-sight
+	walks, so node connectivity can be tested in worker processes."""
+	__slots__ = ('verts_xz', 'tri_edges', '_components')
+	def __init__(self, verts, tris):
+		"""tris is a FloorTri.DTYPE array."""
+		self.verts_xz = [(v[0], v[2]) for v in verts]
+		self.tri_edges = [(
+			(c[0], c[1], n[0], e[0]),
+			(c[1], c[2], n[1], e[1]),
+			(c[2], c[0], n[2], e[2]),
+		) for c, n, e in zip(tris['corners'].tolist(), tris['neighbors'].tolist(), tris['edgeTypes'].tolist())]
+		self._components = None
+
+	def components(self):
+		"""Island id per triangle. Triangles on different islands (linked only
+		through crossable edges) can never see each other."""
+		if self._components is None:
+			parent = list(range(len(self.tri_edges)))
+			def root(i):
+				while parent[i] != i:
+					parent[i] = parent[parent[i]]
+					i = parent[i]
+				return i
+			for tri, edges in enumerate(self.tri_edges):
+				for _, _, neighbor, etype in edges:
+					if neighbor != -1 and etype != FloorEdgeType.Uncrossable:
+						a, b = root(tri), root(neighbor)
+						if a != b:
+							parent[max(a, b)] = min(a, b)
+			self._components = [root(i) for i in range(len(parent))]
+		return self._components
+
+	def connects(self, tri_a, tri_b, pos_a, pos_b):
+		if tri_a is None or tri_b is None:
+			return False
+		if tri_a == tri_b:
+			return True
+		components = self.components()
+		if components[tri_a] != components[tri_b]:
+			return False
+		return self.walk(tri_a, pos_a, pos_b, tri_b)
 
-		self.partTag = iff.read_int32()
+	def walk(self, start_tri, start_pos, end_pos, end_tri):
+		"""Walk across floor triangles following the straight line from
+		start_pos to end_pos on the XZ plane.  Uses a stack so that
+		vertex-grazing dead-ends can be backtracked."""
+		ax, az = start_pos[0], start_pos[2]
+		bx, bz = end_pos[0], end_pos[2]
 
-		self.portalId1 = iff.read_int32()
-		self.portalId2 = iff.read_int32()
-		self.portalId3 = iff.read_int32()
+		# Stack entries: [current_tri, entry_s, came_from, candidates | None]
+		# candidates (computed lazily): list of (s, neighbor, etype) sorted by s
+		stack = [[start_tri, 0.0, -1, None]]
+		visited = {start_tri}
 
-	def write_0002(self, iff):
-		iff.insert_int32(self.corner1)
-		iff.insert_int32(self.corner2)
-		iff.insert_int32(self.corner3)
+		while stack:
+			frame = stack[-1]
+			current_tri, entry_s, came_from = frame[0], frame[1], frame[2]
 
-		iff.insert_int32(self.index)
+			# Lazily compute exit candidates on first visit to this frame
+			if frame[3] is None:
+				edges = self.tri_edges[current_tri]
+				candidates = []
+				s_min = entry_s + 1e-6
+				for ci, cj, neighbor, etype in edges:
+					if neighbor == came_from:
+						continue
+					v1 = self.verts_xz[ci]
+					v2 = self.verts_xz[cj]
+					result = FloorFile._seg_intersect_xz(
+						ax, az, bx, bz, v1[0], v1[1], v2[0], v2[1])
+					if result is None:
+						continue
+					s, t = result
+					if s > s_min and s <= 1.0 and -1e-6 <= t <= 1.0 + 1e-6:
+						candidates.append((s, neighbor, etype))
+				candidates.sort()
+				frame[3] = candidates
 
-		iff.insert_int32(self.nindex1)
-		iff.insert_int32(self.nindex2)
-		iff.insert_int32(self.nindex3)
+			candidates = frame[3]
 
-		iff.insertFloatVector3(self.normal)
+			if not candidates:
+				visited.discard(current_tri)
+				stack.pop()
+				continue
 
-		iff.insert_int8(self.edgeType1)
-		iff.insert_int8(self.edgeType2)
-		iff.insert_int8(self.edgeType3)
+			s, neighbor, etype = candidates.pop(0)
 
-		iff.insert_bool(self.fallthrough)
+			if etype == FloorEdgeType.Uncrossable:
+				return False
 
-		iff.insert_int32(self.partTag)
+			if neighbor == -1 or neighbor in visited:
+				continue
 
-		iff.insert_int32(self.portalId1)
-		iff.insert_int32(self.portalId2)
-		iff.insert_int32(self.portalId3)
+			if neighbor == end_tri:
+				return True
 
-class PathEdge(object):
-	__slots__ = ('tri','edge','crossable')
-	def __init__(self, tri, edge, crossable):
-		self.tri = tri
-		self.edge = edge
-		self.crossable = crossable
-	
-	def write(self, iff):
-		iff.insert_int32(self.tri)
-		iff.insert_int32(self.edge)
-		iff.insert_bool(self.crossable)
+			visited.add(neighbor)
+			stack.append([neighbor, s, current_tri, None])
+
+		return False
+
+_worker_walker = None
+
+def _init_walk_worker(walker):
+	global _worker_walker
+	_worker_walker = walker
+
+def _walk_worker_chunk(jobs):
+	return [_worker_walker.connects(*job) for job in jobs]
+
+# Below this many candidate pairs, process start-up costs more than it saves.
+PARALLEL_WALK_MIN_PAIRS = 2000
 
 class FloorFile(object):
 
-	__slots__ = ('path', 'verts', 'tris', 'pathGraph', '_node_triangles')
+	__slots__ = ('path', 'verts', '_tris', '_tri_array', '_tri_cache', '_vert_cache', '_corner_cache', 'pathGraph', 'boxTree', 'borderEdges', 'visibility', '_node_triangles', '_tri_grid', '_walker')
 	def __init__(self, path):
 		self.path = path
 		self.verts = []
-		self.tris = []
+		self._tris = []
+		self._tri_array = None
+		# tri_array() of the FloorTri objects, until they're handed out again
+		self._tri_cache = None
+		# vert_array() and tri_corners() for the queries, dropped with the triangles
+		self._vert_cache = None
+		self._corner_cache = None
 		self.pathGraph = None
+		# Optional {(pos_a, pos_b): bool} of walk results to reuse and extend
+		self.visibility = None
+		self.boxTree = None
+		self.borderEdges = []
 		self._node_triangles = None
+		self._tri_grid = None
+		self._walker = None
 
 	def __str__(self):
 		return f"Path: {self.path}"
@@ -1213,6 +1939,43 @@ class FloorFile(object):
 	def __repr__(self):
 		return self.__str__()
 
+	@property
+	def tris(self):
+		"""FloorTri objects. Loaded floors keep their triangles in a FloorTri.DTYPE
+		array and only build these on first access; from then on the objects are
+		the authoritative copy."""
+		if self._tris is None:
+			self._tris = FloorTri.from_array(self._tri_array)
+			self._tri_array = None
+		# The caller may edit them
+		self._tri_cache = None
+		self._corner_cache = None
+		return self._tris
+
+	@tris.setter
+	def tris(self, tris):
+		self._tris = tris
+		self._tri_array = None
+		self._tri_cache = None
+		self._vert_cache = None
+		self._corner_cache = None
+		# Everything indexed by triangle is stale now
+		self.boxTree = None
+		self._node_triangles = None
+		self._tri_grid = None
+		self._walker = None
+
+	def tri_array(self):
+		"""The triangles as a FloorTri.DTYPE array, in TRIS record layout."""
+		if self._tris is None:
+			return self._tri_array
+		if self._tri_cache is None:
+			self._tri_cache = FloorTri.to_array(self._tris)
+		return self._tri_cache
+
+	def tri_count(self):
+		return len(self._tri_array) if self._tris is None else len(self._tris)
+
 	def load(self):
 		iff = nsg_iff.IFF(filename=self.path)
 		iff.enterForm("FLOR")
@@ -1226,24 +1989,26 @@ class FloorFile(object):
 			print(f"Unhandled FLR version: {version}")
 			return False
 
-		print(f"Verts: {len(self.verts)} Tris: {len(self.tris)}")
+		print(f"Verts: {len(self.verts)} Tris: {self.tri_count()}")
 		return True
 
+	def _read_verts(self, iff):
+		data = iff.read_misc(iff.getRemainingLength())
+		self.verts = np.frombuffer(data, dtype='<f4').reshape(-1, 3).tolist()
+		self._vert_cache = None
+
 	def _load_0006(self, iff):
 		iff.enterForm("0006")
 
 		iff.enterChunk("VERT")
 		vertCount = iff.read_int32()
-		while not iff.atEndOfForm():
-			self.verts.append(iff.read_vector3())
+		self._read_verts(iff)
 		iff.exitChunk("VERT")
 
 		iff.enterChunk("TRIS")
 		triCount = iff.read_int32()
-		for i in range(triCount):
-			f = FloorTri()
-			f.read_0002(iff)
-			self.tris.append(f)
+		self._tri_array = FloorTri.read_array(iff, triCount, "0002")
+		self._tris = None
 		iff.exitChunk("TRIS")
 
 		self._load_tail(iff)
@@ -1253,15 +2018,13 @@ class FloorFile(object):
 		iff.enterForm("0005")
 
 		iff.enterChunk("VERT")
-		while not iff.atEndOfForm():
-			self.verts.append(iff.read_vector3())
+		self._read_verts(iff)
 		iff.exitChunk("VERT")
 
 		iff.enterChunk("TRIS")
-		while not iff.atEndOfForm():
-			f = FloorTri()
-			f.read_0001(iff)
-			self.tris.append(f)
+		triCount = iff.getRemainingLength() // FloorTri.DTYPE.itemsize
+		self._tri_array = FloorTri.read_array(iff, triCount, "0001")
+		self._tris = None
 		iff.exitChunk("TRIS")
 
 		self._load_tail(iff)
@@ -1270,11 +2033,15 @@ class FloorFile(object):
 	def _load_tail(self, iff):
 		"""Read optional BTRE, BEDG, and PGRF sections."""
 		if not iff.atEndOfForm() and iff.getCurrentName() == "BTRE":
-			iff.enterForm("BTRE")
-			iff.exitForm("BTRE")
+			self.boxTree = BoxTree()
+			self.boxTree.load(iff)
 
 		if not iff.atEndOfForm() and iff.getCurrentName() == "BEDG":
+			# Rebuilt from the triangles by write
 			iff.enterChunk("BEDG")
+			count = iff.read_int32()
+			data = iff.read_misc(count * PathEdge.DTYPE.itemsize)
+			self.borderEdges = np.frombuffer(data, dtype=PathEdge.DTYPE, count=count).copy()
 			iff.exitChunk("BEDG")
 
 		if not iff.atEndOfForm() and iff.getCurrentName() == "PGRF":
@@ -1288,37 +2055,25 @@ class FloorFile(object):
 
 		iff.insertChunk("VERT")
 		iff.insert_int32(len(self.verts))
-		for v in self.verts:
-			iff.insertFloatVector3(v)
+		iff.insertChunkData(np.asarray(self.verts, dtype='<f4').reshape(-1, 3).tobytes())
 		iff.exitChunk("VERT")
 
+		tris = self.tri_array()
 		iff.insertChunk("TRIS")
-		iff.insert_int32(len(self.tris))
-		for t in self.tris:
-			t.write_0002(iff)
+		iff.insert_int32(len(tris))
+		iff.insertChunkData(tris.tobytes())
 		iff.exitChunk("TRIS")
 
 		# Build box tree for meshes with >= 10 triangles (matches C++ gs_minTrianglesForBoxtree)
-		if len(self.tris) >= 10:
-			boxTree = BoxTree.build_from_tris(self.verts, self.tris)
+		if len(tris) >= 10:
+			boxTree = BoxTree.build_from_tris(self.verts, tris['corners'], use_sah=True)
 			boxTree.write(iff)
 
-		# Collect border edges, excluding WallTop (matches C++ FloorMesh::write)
-		borderEdges = []
-		for index, tri in enumerate(self.tris):
-			for nindex, edge_id, edge_type in [
-				(tri.nindex1, 0, tri.edgeType1),
-				(tri.nindex2, 1, tri.edgeType2),
-				(tri.nindex3, 2, tri.edgeType3),
-			]:
-				if nindex == -1 and edge_type != FloorEdgeType.WallTop:
-					borderEdges.append(PathEdge(index, edge_id, edge_type != FloorEdgeType.Uncrossable))
-
-		if borderEdges:
+		borderEdges = self.border_edges(tris)
+		if len(borderEdges):
 			iff.insertChunk("BEDG")
 			iff.insert_int32(len(borderEdges))
-			for be in borderEdges:
-				be.write(iff)
+			iff.insertChunkData(borderEdges.tobytes())
 			iff.exitChunk("BEDG")
 
 		if self.pathGraph is not None:
@@ -1328,6 +2083,20 @@ class FloorFile(object):
 		iff.exitForm("FLOR")
 		iff.write(self.path)
 
+	def validate(self, verbose=True, longest=3):
+		"""Check the loaded cell pathgraph; see PathGraph.validate. Adds off_floor,
+		the waypoints that aren't over any triangle. Returns the problem lists, or
+		an empty dict when there is no pathgraph."""
+		if self.pathGraph is None:
+			return {}
+		issues = self.pathGraph.validate(verbose, longest)
+		waypoints = [node for node in self.pathGraph.nodes if node.type == PathNodeType.CellWaypoint]
+		on_floor = self.points_in_floor([list(node.position) for node in waypoints])
+		issues['off_floor'] = [node.index for node, ok in zip(waypoints, on_floor.tolist()) if not ok]
+		if verbose and issues['off_floor']:
+			print(f"{self.path}: {len(issues['off_floor'])} waypoints aren't over the floor: {issues['off_floor'][:10]}")
+		return issues
+
 	def prepare_connectivity(self):
 		"""Locate which floor triangle each pathgraph node lies on.
 		Call once before make_waypoint_connections / add_portal_edges."""
@@ -1335,30 +2104,258 @@ class FloorFile(object):
 			print(f"Error! Asked to prepare_connectivity without first assigning pathGraph")
 			return
 		self._node_triangles = {}
-		for node in self.pathGraph.nodes:
-			self._node_triangles[node.index] = self._find_triangle(node.position)
-
-	def _find_triangle(self, pos):
-		"""Find which triangle a position lies on (XZ plane).
-		Falls back to nearest triangle centroid for boundary points."""
-		px, pz = pos[0], pos[2]
-		for idx, tri in enumerate(self.tris):
-			if FloorFile._point_in_tri_xz(px, pz,
-				self.verts[tri.corner1][0], self.verts[tri.corner1][2],
-				self.verts[tri.corner2][0], self.verts[tri.corner2][2],
-				self.verts[tri.corner3][0], self.verts[tri.corner3][2]):
-				return idx
-		# Fallback: nearest triangle by centroid distance
-		best_dist = float('inf')
-		best_idx = 0
-		for idx, tri in enumerate(self.tris):
-			cx = (self.verts[tri.corner1][0] + self.verts[tri.corner2][0] + self.verts[tri.corner3][0]) / 3.0
-			cz = (self.verts[tri.corner1][2] + self.verts[tri.corner2][2] + self.verts[tri.corner3][2]) / 3.0
-			d = (px - cx) ** 2 + (pz - cz) ** 2
-			if d < best_dist:
-				best_dist = d
-				best_idx = idx
-		return best_idx
+		nodes = self.pathGraph.nodes
+		found = self.tri_grid().find_many([list(node.position) for node in nodes])
+		for node, tri in zip(nodes, found.tolist()):
+			self._node_triangles[node.index] = tri
+
+	def snap_heights(self, positions, max_below, max_above):
+		"""Vertical ray cast for an (N, 3) array of positions in one go. Prefers the
+		nearest floor at most max_below underneath, else the nearest at most
+		max_above overhead. Returns an (N,) array of heights, NaN where nothing is hit."""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+		count = len(positions)
+		result = np.full(count, np.nan)
+		if count == 0 or self.tri_count() == 0:
+			return result
+
+		px, py, pz = positions[:, 0], positions[:, 1], positions[:, 2]
+		owner, cand = self.box_tree().query_points_xz(px, pz)
+		points = self._tri_points(cand)
+		hit = FloorTriGrid.points_in_tris_xz(px[owner], pz[owner], points[:, :, [0, 2]])
+		owner, points = owner[hit], points[hit]
+		heights = FloorFile._plane_heights(px[owner], pz[owner], points)
+		keep = ~np.isnan(heights)
+		owner, heights = owner[keep], heights[keep]
+
+		def nearest(dist, limit):
+			"""(points, heights) of the closest hit per point with 0 <= dist <= limit."""
+			idx = np.nonzero((dist >= 0.0) & (dist <= limit))[0]
+			idx = idx[np.lexsort((dist[idx], owner[idx]))]
+			first = np.ones(len(idx), dtype=bool)
+			first[1:] = owner[idx[1:]] != owner[idx[:-1]]
+			return owner[idx[first]], heights[idx[first]]
+
+		# Above first so hits below overwrite them
+		points, hit_heights = nearest(heights - py[owner], max_above)
+		result[points] = hit_heights
+		points, hit_heights = nearest(py[owner] - heights, max_below)
+		result[points] = hit_heights
+		return result
+
+	@staticmethod
+	def triangle_adjacency(corners):
+		"""Neighbour links for (T, 3) triangle corners, where edge i of a triangle
+		runs corners[i] -> corners[(i + 1) % 3]. Edges are canonicalised and
+		sorted so triangles sharing one land next to each other; each edge links
+		to the lowest-index other triangle on it, or -1 on a border.
+		Returns ((T, 3) neighbours, (K, 2) vertex pairs of non-manifold edges)."""
+		corners = np.asarray(corners, dtype=np.int64).reshape(-1, 3)
+		count = len(corners)
+		if count == 0:
+			return np.zeros((0, 3), dtype=np.int64), np.zeros((0, 2), dtype=np.int64)
+
+		ends = corners[:, [1, 2, 0]]
+		lo = np.minimum(corners, ends).ravel()
+		hi = np.maximum(corners, ends).ravel()
+		owner = np.repeat(np.arange(count), 3)
+		order = np.lexsort((owner, hi, lo))
+		lo, hi, owner = lo[order], hi[order], owner[order]
+
+		starts = np.ones(len(order), dtype=bool)
+		starts[1:] = (lo[1:] != lo[:-1]) | (hi[1:] != hi[:-1])
+		group = np.cumsum(starts) - 1
+		first_idx = np.nonzero(starts)[0]
+		first = owner[first_idx][group]
+		# Lowest triangle on the edge that isn't the group's first one
+		second = np.full(len(first_idx), count, dtype=np.int64)
+		others = owner != first
+		np.minimum.at(second, group[others], owner[others])
+		second = second[group]
+
+		neighbors_sorted = np.where(owner != first, first, np.where(second < count, second, -1))
+		neighbors = np.empty(len(order), dtype=np.int64)
+		neighbors[order] = neighbors_sorted
+
+		distinct = np.ones(len(order), dtype=bool)
+		distinct[1:] = starts[1:] | (owner[1:] != owner[:-1])
+		tris_per_edge = np.bincount(group, weights=distinct)
+		non_manifold = np.nonzero(tris_per_edge > 2)[0]
+		return neighbors.reshape(-1, 3), np.column_stack((lo[first_idx[non_manifold]], hi[first_idx[non_manifold]]))
+
+	def border_edges(self, tris=None):
+		"""BEDG records: edges with no neighbour, excluding WallTop (matches C++ FloorMesh::write)."""
+		if tris is None:
+			tris = self.tri_array()
+		border = (tris['neighbors'] == -1) & (tris['edgeTypes'] != FloorEdgeType.WallTop)
+		borderTris, borderEdgeIds = np.nonzero(border)
+		borderEdges = np.zeros(len(borderTris), dtype=PathEdge.DTYPE)
+		borderEdges['tri'] = borderTris
+		borderEdges['edge'] = borderEdgeIds
+		borderEdges['crossable'] = tris['edgeTypes'][border] != FloorEdgeType.Uncrossable
+		return borderEdges
+
+	def tri_corners(self):
+		"""(T, 3) int array of triangle corner indices."""
+		if self._corner_cache is None:
+			self._corner_cache = self.tri_array()['corners'].astype(np.int64)
+		return self._corner_cache
+
+	def vert_array(self):
+		"""(V, 3) float array of the vertices. Call once verts are final."""
+		if self._vert_cache is None:
+			self._vert_cache = np.asarray(self.verts, dtype=np.float64).reshape(-1, 3)
+		return self._vert_cache
+
+	def tri_grid(self):
+		"""XZ grid over the triangles, built on first use. Call once tris are final."""
+		if self._tri_grid is None:
+			self._tri_grid = FloorTriGrid(self.vert_array(), self.tri_corners())
+		return self._tri_grid
+
+	def box_tree(self):
+		"""BoxTree over the triangles: the BTRE loaded with the file while it still
+		matches the triangle count, otherwise one built on first use."""
+		if self.boxTree is None or len(self.boxTree) != 2 * self.tri_count() - 1:
+			self.boxTree = BoxTree.build_from_tris(self.vert_array(), self.tri_corners())
+		return self.boxTree
+
+	def _tri_points(self, tris):
+		"""(N, 3, 3) corner positions for an array of triangle indices."""
+		return self.vert_array()[self.tri_corners()[tris]]
+
+	@staticmethod
+	def _plane_heights(x, z, points):
+		"""Height at (x, z) of each (3, 3) triangle's plane in points, from XZ
+		barycentrics. Vertical triangles have no XZ area and can't be hit by a
+		vertical ray; their heights are NaN."""
+		a, b, c = points[:, 0], points[:, 1], points[:, 2]
+		den = (b[:, 2] - c[:, 2]) * (a[:, 0] - c[:, 0]) + (c[:, 0] - b[:, 0]) * (a[:, 2] - c[:, 2])
+		flat = den == 0.0
+		den = np.where(flat, 1.0, den)
+		wa = ((b[:, 2] - c[:, 2]) * (x - c[:, 0]) + (c[:, 0] - b[:, 0]) * (z - c[:, 2])) / den
+		wb = ((c[:, 2] - a[:, 2]) * (x - c[:, 0]) + (a[:, 0] - c[:, 0]) * (z - c[:, 2])) / den
+		heights = wa * a[:, 1] + wb * b[:, 1] + (1.0 - wa - wb) * c[:, 1]
+		heights[flat] = np.nan
+		return heights
+
+	def tris_at(self, x, z):
+		"""Triangles (ascending) whose XZ footprint contains the point."""
+		cand = self.box_tree().query_box((x, -np.inf, z), (x, np.inf, z))
+		if len(cand) == 0:
+			return cand
+		points = self._tri_points(cand)
+		return cand[FloorTriGrid.points_in_tris_xz(x, z, points[:, :, [0, 2]])]
+
+	def point_in_floor(self, x, z):
+		"""True if the point lies on the floor's footprint on the XZ plane."""
+		return len(self.tris_at(x, z)) > 0
+
+	def points_in_floor(self, positions):
+		"""Batched point_in_floor() for an (N, 3) array of positions."""
+		positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+		result = np.zeros(len(positions), dtype=bool)
+		if len(positions) == 0 or self.tri_count() == 0:
+			return result
+		px, pz = positions[:, 0], positions[:, 2]
+		owner, cand = self.box_tree().query_points_xz(px, pz)
+		hit = FloorTriGrid.points_in_tris_xz(px[owner], pz[owner], self._tri_points(cand)[:, :, [0, 2]])
+		result[owner[hit]] = True
+		return result
+
+	def ray_cast_y(self, x, z, y=None):
+		"""Cast a ray straight down from (x, y, z) and return (tri, height) for the
+		first triangle hit, or (-1, None). With y None the topmost triangle wins."""
+		cand = self.tris_at(x, z)
+		if len(cand) == 0:
+			return -1, None
+		heights = FloorFile._plane_heights(x, z, self._tri_points(cand))
+		keep = ~np.isnan(heights)
+		if y is not None:
+			keep &= heights <= y
+		if not np.any(keep):
+			return -1, None
+		cand, heights = cand[keep], heights[keep]
+		i = int(np.argmax(heights))
+		return int(cand[i]), float(heights[i])
+
+	def segment_overlaps(self, start, end):
+		"""Triangles (ascending) the segment start -> end crosses on the XZ plane."""
+		cand = self.box_tree().query_segment(start, end, ignore_axis=1)
+		if len(cand) == 0:
+			return cand
+		tri_xz = self._tri_points(cand)[:, :, [0, 2]]
+		s = np.array((start[0], start[2]), dtype=np.float64)
+		e = np.array((end[0], end[2]), dtype=np.float64)
+		hit = FloorTriGrid.points_in_tris_xz(s[0], s[1], tri_xz) | FloorTriGrid.points_in_tris_xz(e[0], e[1], tri_xz)
+
+		def side(o, a, b):
+			return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+		for i in range(3):
+			p = tri_xz[:, i]
+			q = tri_xz[:, (i + 1) % 3]
+			# Straddle test both ways; touching counts as overlapping
+			hit |= (side(s, e, p) * side(s, e, q) <= 0) & (side(p, q, s) * side(p, q, e) <= 0)
+		return cand[hit]
+
+	def nearest_tris(self, position, k=1):
+		"""The k triangles closest to position in 3D, as (tri, distance) pairs, closest first."""
+		p = tuple(float(v) for v in position[:3])
+		corners = self.tri_corners()
+		verts = self.verts
+
+		def distance(tri):
+			c1, c2, c3 = corners[tri]
+			return FloorFile._point_tri_distance_sq(p, verts[c1], verts[c2], verts[c3])
+		return [(tri, math.sqrt(d)) for d, tri in self.box_tree().nearest(p, k, distance)]
+
+	@staticmethod
+	def _point_tri_distance_sq(p, a, b, c):
+		"""Squared distance from p to triangle (a,b,c), via the closest point on it
+		(Ericson, Real-Time Collision Detection 5.1.5)."""
+		def sub(u, v):
+			return (u[0] - v[0], u[1] - v[1], u[2] - v[2])
+		def dot(u, v):
+			return u[0] * v[0] + u[1] * v[1] + u[2] * v[2]
+		def at(u, t, v):
+			return (u[0] + t * v[0], u[1] + t * v[1], u[2] + t * v[2])
+
+		ab, ac, ap = sub(b, a), sub(c, a), sub(p, a)
+		d1, d2 = dot(ab, ap), dot(ac, ap)
+		if d1 <= 0 and d2 <= 0:
+			closest = a
+		else:
+			bp = sub(p, b)
+			d3, d4 = dot(ab, bp), dot(ac, bp)
+			cp = sub(p, c)
+			d5, d6 = dot(ab, cp), dot(ac, cp)
+			vc = d1 * d4 - d3 * d2
+			vb = d5 * d2 - d1 * d6
+			va = d3 * d6 - d5 * d4
+			if d3 >= 0 and d4 <= d3:
+				closest = b
+			elif vc <= 0 and d1 >= 0 and d3 <= 0:
+				closest = at(a, d1 / (d1 - d3), ab)
+			elif d6 >= 0 and d5 <= d6:
+				closest = c
+			elif vb <= 0 and d2 >= 0 and d6 <= 0:
+				closest = at(a, d2 / (d2 - d6), ac)
+			elif va <= 0 and (d4 - d3) >= 0 and (d5 - d6) >= 0:
+				closest = at(b, (d4 - d3) / ((d4 - d3) + (d5 - d6)), sub(c, b))
+			elif va + vb + vc == 0:
+				closest = a
+			else:
+				denom = 1.0 / (va + vb + vc)
+				v, w = vb * denom, vc * denom
+				closest = (a[0] + ab[0] * v + ac[0] * w, a[1] + ab[1] * v + ac[1] * w, a[2] + ab[2] * v + ac[2] * w)
+		d = sub(p, closest)
+		return dot(d, d)
+
+	def walker(self):
+		"""Line-of-sight walk snapshot of the triangles, built on first use."""
+		if self._walker is None:
+			self._walker = FloorWalker(self.verts, self.tri_array())
+		return self._walker
 
 	@staticmethod
 	def _point_in_tri_xz(px, pz, ax, az, bx, bz, cx, cz):
@@ -1376,75 +2373,36 @@ class FloorFile(object):
 		engine's FloorMesh::testConnectable / pathWalkCircle approach."""
 		tri_a = self._node_triangles.get(nodeA.index)
 		tri_b = self._node_triangles.get(nodeB.index)
-		if tri_a is None or tri_b is None:
-			return False
-		if tri_a == tri_b:
-			return True
-		return self._walk_mesh(tri_a, nodeA.position, nodeB.position, tri_b)
+		return self.connect_many([(tri_a, tri_b, tuple(nodeA.position), tuple(nodeB.position))], workers=1)[0]
+
+	def connect_many(self, jobs, workers=None):
+		"""Run FloorWalker.connects for many (tri_a, tri_b, pos_a, pos_b) jobs.
+		Results already in self.visibility are reused, new ones are added to it."""
+		if self.visibility is None:
+			return self._walk_jobs(jobs, workers)
+
+		keys = [(tuple(job[2]), tuple(job[3])) for job in jobs]
+		todo = [i for i, key in enumerate(keys) if key not in self.visibility]
+		if todo:
+			for i, connected in zip(todo, self._walk_jobs([jobs[i] for i in todo], workers)):
+				self.visibility[keys[i]] = connected
+		return [self.visibility[key] for key in keys]
+
+	def _walk_jobs(self, jobs, workers=None):
+		"""Walk every job, spreading them over a process pool when there are enough of them."""
+		walker = self.walker()
+		if workers is None:
+			workers = os.cpu_count() or 1
+		if workers > 1 and len(jobs) >= PARALLEL_WALK_MIN_PAIRS and support.can_fork():
+			chunk_size = max(256, len(jobs) // (workers * 4))
+			chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+			results = support.forked_map(_walk_worker_chunk, chunks, workers, _init_walk_worker, (walker,))
+			if results != None:
+				return [r for chunk in results for r in chunk]
+		return [walker.connects(*job) for job in jobs]
 
 	def _walk_mesh(self, start_tri, start_pos, end_pos, end_tri):
-		"""Walk across floor triangles following the straight line from
-		start_pos to end_pos on the XZ plane.  Uses a stack so that
-		vertex-grazing dead-ends can be backtracked."""
-		ax, az = start_pos[0], start_pos[2]
-		bx, bz = end_pos[0], end_pos[2]
-
-		# Stack entries: [current_tri, entry_s, came_from, candidates | None]
-		# candidates (computed lazily): list of (s, neighbor, etype) sorted by s
-		stack = [[start_tri, 0.0, -1, None]]
-		visited = {start_tri}
-
-		while stack:
-			frame = stack[-1]
-			current_tri, entry_s, came_from = frame[0], frame[1], frame[2]
-
-			# Lazily compute exit candidates on first visit to this frame
-			if frame[3] is None:
-				tri = self.tris[current_tri]
-				edges = (
-					(tri.corner1, tri.corner2, tri.nindex1, tri.edgeType1),
-					(tri.corner2, tri.corner3, tri.nindex2, tri.edgeType2),
-					(tri.corner3, tri.corner1, tri.nindex3, tri.edgeType3),
-				)
-				candidates = []
-				s_min = entry_s + 1e-6
-				for ci, cj, neighbor, etype in edges:
-					if neighbor == came_from:
-						continue
-					v1 = self.verts[ci]
-					v2 = self.verts[cj]
-					result = FloorFile._seg_intersect_xz(
-						ax, az, bx, bz, v1[0], v1[2], v2[0], v2[2])
-					if result is None:
-						continue
-					s, t = result
-					if s > s_min and s <= 1.0 and -1e-6 <= t <= 1.0 + 1e-6:
-						candidates.append((s, neighbor, etype))
-				candidates.sort()
-				frame[3] = candidates
-
-			candidates = frame[3]
-
-			if not candidates:
-				visited.discard(current_tri)
-				stack.pop()
-				continue
-
-			s, neighbor, etype = candidates.pop(0)
-
-			if etype == FloorEdgeType.Uncrossable:
-				return False
-
-			if neighbor == -1 or neighbor in visited:
-				continue
-
-			if neighbor == end_tri:
-				return True
-
-			visited.add(neighbor)
-			stack.append([neighbor, s, current_tri, None])
-
-		return False
+		return self.walker().walk(start_tri, start_pos, end_pos, end_tri)
 
 	@staticmethod
 	def _seg_intersect_xz(ax, az, bx, bz, cx, cz, dx, dz):
@@ -1464,24 +2422,44 @@ class FloorFile(object):
 		return (s, t)
 
 
-	def make_waypoint_connections(self):
+	def make_waypoint_connections(self, workers=None):
+		"""Connect every pair of waypoints that can see each other. Pairs on
+		different floor islands are pruned before any mesh walk."""
 		if self.pathGraph is None:
 			print(f"Error! Asked to make waypoint connections without first assigning pathGraph")
 			return
 
 		waypoints = [n for n in self.pathGraph.nodes if n.type == 1]
-		for i, node in enumerate(waypoints):
-			for node2 in waypoints[i + 1:]:
-				if self.do_nodes_connect(node, node2):
-					edge = PathGraphEdge()
-					edge.indexA = node.index
-					edge.indexB = node2.index
-					self.pathGraph.edges.append(edge)
-
-					edge2 = PathGraphEdge()
-					edge2.indexA = node2.index
-					edge2.indexB = node.index
-					self.pathGraph.edges.append(edge2)
+		if len(waypoints) < 2:
+			return
+
+		components = self.walker().components()
+		tris = [self._node_triangles.get(n.index) for n in waypoints]
+		island = np.array([components[t] if t is not None else -1 - i for i, t in enumerate(tris)])
+
+		first, second = np.triu_indices(len(waypoints), 1)
+		keep = island[first] == island[second]
+		first = first[keep].tolist()
+		second = second[keep].tolist()
+
+		jobs = [(tris[i], tris[j], tuple(waypoints[i].position), tuple(waypoints[j].position)) for i, j in zip(first, second)]
+		reused = 0 if self.visibility is None else sum(1 for job in jobs if (job[2], job[3]) in self.visibility)
+		results = self.connect_many(jobs, workers)
+		print(f"Waypoint pairs: {len(waypoints) * (len(waypoints) - 1) // 2} walked: {len(jobs) - reused} reused: {reused} connected: {sum(results)}")
+
+		for i, j, connected in zip(first, second, results):
+			if connected:
+				node = waypoints[i]
+				node2 = waypoints[j]
+				edge = PathGraphEdge()
+				edge.indexA = node.index
+				edge.indexB = node2.index
+				self.pathGraph.edges.append(edge)
+
+				edge2 = PathGraphEdge()
+				edge2.indexA = node2.index
+				edge2.indexB = node.index
+				self.pathGraph.edges.append(edge2)
 		
 
 	def add_portal_nodes(self, globalPortalIndices, portalNames=None):
@@ -1533,27 +2511,23 @@ class FloorFile(object):
 			print(f"Error! Asked to add_portal_edges without first assigning pathGraph")
 			return
 
+		others = [n for n in self.pathGraph.nodes if n.type != 0]
+		if not others:
+			return
+		other_positions = np.array([list(n.position) for n in others], dtype=np.float64)
+
 		for ni1, node1 in enumerate(self.pathGraph.nodes):
 			if node1.type != 0: 
 				continue
 
+			# Walk candidates nearest-first; the first one we can see is the closest connectable node
+			dist_sq = ((other_positions - list(node1.position)) ** 2).sum(axis=1)
 			minId = -1
-			minDist = maxsize
-
-			for ni2, node2 in enumerate(self.pathGraph.nodes):
-				if node2.type == 0 or (node1 == node2): 
-					continue
-
-				connectable = self.do_nodes_connect(node1, node2)
-				dist = (Vector(node2.position) - Vector(node1.position)).length
-				#print(f"Comparing node {node1.index} to node {node2.index} Connectable: {connectable} dist: {dist}")
-				if connectable and (dist < minDist):
-					minDist = dist
+			for ni2 in np.argsort(dist_sq, kind='stable').tolist():
+				node2 = others[ni2]
+				if self.do_nodes_connect(node1, node2):
 					minId = node2.index
-					#print(f"   {node2.index} is better!")
-				else:
-					#print(f"   {node2.index} is not better")
-					pass
+					break
 
 			if minId != -1:
 				edge = PathGraphEdge()
@@ -1571,38 +2545,41 @@ class FloorFile(object):
 
 	def prune_redundant_edges(self):
 		edgesToRemove = set()
+		edges = self.pathGraph.edges
+		edge_array = self.pathGraph.edge_array()
+		positions = np.array([list(n.position) for n in self.pathGraph.nodes], dtype=np.float64).reshape(-1, 3)
 
 		# Group edges by each vertex they touch — only edges sharing a
-		# vertex can be redundant, so this avoids the O(E^2) full scan.
-		edges_by_vertex = {}
-		for edge in self.pathGraph.edges:
-			edges_by_vertex.setdefault(edge.indexA, []).append(edge)
-			edges_by_vertex.setdefault(edge.indexB, []).append(edge)
+		# vertex can be redundant. Within a vertex, edges stay in edge order.
+		vertex = np.concatenate((edge_array[:, 0], edge_array[:, 1]))
+		edge_ids = np.concatenate((np.arange(len(edges)), np.arange(len(edges))))
+		other = np.concatenate((edge_array[:, 1], edge_array[:, 0]))
+		order = np.lexsort((edge_ids, vertex))
+		vertex, edge_ids, other = vertex[order], edge_ids[order], other[order]
+		bounds = np.flatnonzero(np.diff(vertex)) + 1
+		starts = np.concatenate(([0], bounds))
+		ends = np.concatenate((bounds, [len(vertex)]))
 
 		angle_threshold = (20.0 / 360.0) * (2.0 * math.pi)
 
-		for vertex, edges in edges_by_vertex.items():
-			for i, edge1 in enumerate(edges):
-				for edge2 in edges[i + 1:]:
-					# Skip same or reverse edge
-					if edge1.indexA == edge2.indexA and edge1.indexB == edge2.indexB:
-						continue
-					if edge1.indexA == edge2.indexB and edge1.indexB == edge2.indexA:
-						continue
-
-					A = Vector(self.pathGraph.nodes[vertex].position)
-					B_idx = edge1.indexB if edge1.indexA == vertex else edge1.indexA
-					C_idx = edge2.indexB if edge2.indexA == vertex else edge2.indexA
-					B = Vector(self.pathGraph.nodes[B_idx].position)
-					C = Vector(self.pathGraph.nodes[C_idx].position)
-
-					dA = (B - A).normalized()
-					dB = (C - A).normalized()
-					if support.angle_between_unnormalized(dA, dB) < angle_threshold:
-						if (B - A).length > (C - A).length:
-							edgesToRemove.add(edge1)
-						else:
-							edgesToRemove.add(edge2)
+		for start, end in zip(starts.tolist(), ends.tolist()):
+			if end - start < 2:
+				continue
+			ids = edge_ids[start:end]
+			others = other[start:end]
+			# Every pair of directions out of this vertex in one dot-product matrix
+			offsets = positions[others] - positions[vertex[start]]
+			lengths = np.linalg.norm(offsets, axis=1)
+			directions = offsets / np.where(lengths > 0.0, lengths, 1.0)[:, None]
+			angles = np.arccos(np.clip(directions @ directions.T, -1.0, 1.0))
+			# Two edges to the same neighbour are the same edge or its reverse
+			close = np.triu(angles < angle_threshold, 1) & (others[:, None] != others[None, :])
+			first, second = np.nonzero(close)
+			if len(first) == 0:
+				continue
+			# Of each near-collinear pair, drop the longer edge
+			longer = np.where(lengths[first] > lengths[second], ids[first], ids[second])
+			edgesToRemove.update(edges[i] for i in longer.tolist())
 
 		# Also remove the reverse of each pruned edge to maintain symmetric connectivity
 		edge_by_pair = {}
@@ -2460,18 +3437,60 @@ class SWGMgn(object):
 				if weight[1] != before:
 					print(f"Vert {i} changed weight for bone {weight[0]} from {before} to {weight[1]}")
 
+	@staticmethod
+	def mask_to_zone_indices(mask):
+		indices = []
+		while mask:
+			low = mask & -mask
+			indices.append(low.bit_length() - 1)
+			mask ^= low
+		return indices
+
+	def occlusion_zone_bits(self):
+		"""Zone name -> bit, which is the zone's index in this file's OZN list."""
+		return {occ[0]: occ[1] for occ in self.occlusions}
+
+	def occlusion_zone_indices(self, combination, zone_bits = None):
+		"""The OZN indices of a combination like "chest:torso_f", in the order written."""
+		if zone_bits is None:
+			zone_bits = self.occlusion_zone_bits()
+		indices = []
+		for name in combination.split(":"):
+			if name not in zone_bits:
+				print(f"Warning! Occlusion zone '{name}' (from '{combination}') has no matching OZN_{name} Custom Property. Skipping it")
+				continue
+			indices.append(zone_bits[name])
+		return indices
+
+	def occlusion_zone_mask(self, combination, zone_bits = None):
+		mask = 0
+		for index in self.occlusion_zone_indices(combination, zone_bits):
+			mask |= 1 << index
+		return mask
+
+	def zones_this_occludes_mask(self):
+		mask = 0
+		for occ in self.occlusions:
+			if occ[2] == 1:
+				mask |= 1 << occ[1]
+		return mask
+
 	def compute_fully_occluded_zone_combination(self):
-		result=set()
+		mask = 0
 		if self.occlusion_zones and len(self.occlusion_zones) > 0:
+			zone_bits = self.occlusion_zone_bits()
 			for occ in self.occlusion_zones:
-				if len(occ[1]) == 0:
-					continue
-				else:
-					for name in occ[0].split(":"):
-						for ozn in self.occlusions:
-							if ozn[0] == name:
-								result.add(ozn[1])
-		return result
+				if len(occ[1]) > 0:
+					mask |= self.occlusion_zone_mask(occ[0], zone_bits)
+		return self.mask_to_zone_indices(mask)
+
+	def triangle_occlusion_zones(self):
+		tri_zones = {}
+		if self.occlusion_zones:
+			for i, occ in enumerate(self.occlusion_zones):
+				for tri in occ[1]:
+					tri_zones.setdefault(tri, i)
+		return tri_zones
 
 		
 	def load(self):
@@ -2668,25 +3687,20 @@ class SWGMgn(object):
 		if iff.getCurrentName() == "OZC ":
 			iff.enterChunk("OZC ")
 			self.occlusion_zones=[]
+			zone_names = {x[1]: x[0] for x in self.occlusions}
 			while not iff.atEndOfForm():
-				this_zone=[]
 				count = iff.read_int16()
-				for i in range(0,count):
-					n = iff.read_int16()
-					this_zone.append(next(x[0] for x in self.occlusions if x[1] == n))
+				this_zone = [zone_names[iff.read_int16()] for i in range(0,count)]
 				self.occlusion_zones.append([":".join(this_zone),[]])
 			iff.exitChunk("OZC ")
 
 		if iff.getCurrentName() == "ZTO ":
 			iff.enterChunk("ZTO ")
-			for occ in self.occlusions:
-				occ[2] = 0
+			mask = 0
 			while not iff.atEndOfForm():
-				index = iff.read_int16()
-				for occ in self.occlusions:
-					if occ[1] == index:
-						occ[2] = 1
-						#print(f"Occ: {str(occ)} is ZTO: {index} Setting occluded to: {occ[2]}")
+				mask |= 1 << iff.read_int16()
+			for occ in self.occlusions:
+				occ[2] = 1 if (mask >> occ[1]) & 1 else 0
 			iff.exitChunk("ZTO ")
 
 		global_tri_index=0
@@ -2804,11 +3818,7 @@ class SWGMgn(object):
 		print(self)
 
 	def get_zones_this_occludes(self):
-		i = 0
-		for zone in self.occlusions:
-			if zone[2] == 1:
-				i += 1
-		return i
+		return bin(self.zones_this_occludes_mask()).count("1")
 
 	def write(self):
 		tris_with_no_facemap=[]
@@ -2934,25 +3944,24 @@ class SWGMgn(object):
 
 		if self.occlusion_zones and len(self.occlusion_zones) > 0:
 			iff.insertChunk("OZC ")
+			zone_bits = self.occlusion_zone_bits()
 			for i, occ in enumerate(self.occlusion_zones):
 				print(f"OZC {i}: {occ[0]} has tris: {str(len(occ[1]))}")
-				zones=occ[0].split(':')				
+				zones = self.occlusion_zone_indices(occ[0], zone_bits)
 				iff.insert_int16(len(zones))
-				for zone_name in zones:
-					for zone in self.occlusions:
-						if zone[0] == zone_name:
-							iff.insert_int16(zone[1])
-							print(f"Adding OZC {zone[1]} which is {zone_name}")
+				for zone in zones:
+					iff.insert_int16(zone)
 			iff.exitChunk("OZC ")
 
-		occluded = [x for x in self.occlusions if x[2] == 1]			
+		occluded = self.mask_to_zone_indices(self.zones_this_occludes_mask())
 		if len(occluded) > 0:
 			iff.insertChunk("ZTO ")
-			for occ in occluded:
-					iff.insert_int16(occ[1])
+			for zone in occluded:
+				iff.insert_int16(zone)
 			iff.exitChunk("ZTO ")
 
 		global_tri_index=0
+		tri_zones = self.triangle_occlusion_zones()
 		for psdt in self.psdts:
 			iff.insertForm("PSDT")
 			iff.insertChunk("NAME")
@@ -3004,16 +4013,12 @@ class SWGMgn(object):
 					iff.insert_uint32(len(prim) // 3)
 					for value in prim:
 						if global_tri_index % 3 == 0:
-							found=False
-							for i, occ in enumerate(self.occlusion_zones):
-								if (global_tri_index // 3) in occ[1]:
-									iff.insert_int16(i)
-									found=True
-									break
-							if not found:
+							zone = tri_zones.get(global_tri_index // 3)
+							if zone is None:
 								#print(f"WARNING: Tri: {global_tri_index // 3} Not in any Face Map (occlusion zone). Assuming 0!")
 								tris_with_no_facemap.append(global_tri_index)
-								iff.insert_int16(0)
+								zone = 0
+							iff.insert_int16(zone)
 						iff.insert_uint32(value)
 						global_tri_index += 1
 					iff.exitChunk("OITL")